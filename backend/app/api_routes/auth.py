@@ -9,29 +9,15 @@ from typing import List, Optional
 from pydantic import BaseModel
 
 from ..schemas import UserCreate, Token, LoginRequest, LoginResponse
-from ..crud import get_user_by_id, create_user, get_user_by_email
+from ..crud import get_user_by_id, create_user, get_user_by_email, user_book_ids, user_cache_stats
 from ..db import get_db
+from ..dependencies import get_current_user
 from ..auth_utils import create_access_token, verify_password
-from ..config import ACCESS_TOKEN_EXPIRE_MINUTES, SUPABASE_URL, SUPABASE_KEY, SUPABASE_BUCKET
+from ..config import ACCESS_TOKEN_EXPIRE_MINUTES
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-# Create a supabase client for storage listing (server-side)
-try:
-    from supabase import create_client as create_supabase_client
-except Exception:
-    create_supabase_client = None
-
-if create_supabase_client and SUPABASE_URL and SUPABASE_KEY:
-    try:
-        supabase = create_supabase_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception:
-        supabase = None
-        logger.exception("Failed to initialize Supabase client in auth.py")
-else:
-    supabase = None
-
 
 
 @router.post("/signup", response_model=Token)
@@ -68,59 +54,27 @@ def login(payload: LoginRequest, db: Session = Depends(get_db)):
         additional_claims={"email": user.email},
     )
 
-    book_ids: List[str] = []
-    bucket_name = SUPABASE_BUCKET or "pen_and_paper"
-
-    if supabase and bucket_name:
-        try:
-            # Different supabase client versions use different signatures.
-            # Common: supabase.storage.from_(bucket).list(path)
-            # Try listing with the user prefix; adapt if your client expects `path=` keyword.
-            raw_list = supabase.storage.from_(bucket_name).list(str(user.id))
-            data_list = []
-            if isinstance(raw_list, dict):
-                data_list = raw_list.get("data") or []
-            elif isinstance(raw_list, list):
-                data_list = raw_list
-            else:
-                data_list = []
-
-            found = []
-            for item in data_list:
-                name = None
-                if isinstance(item, dict):
-                    name = item.get("name") or item.get("path") or item.get("id")
-                else:
-                    name = str(item)
-
-                if not name:
-                    continue
-
-                parts = name.split("/")
-                if parts[0] == str(user.id):
-                    if len(parts) >= 2:
-                        candidate = parts[1]
-                    else:
-                        continue
-                else:
-                    candidate = parts[0]
-
-                # skip obvious filenames
-                if "." in candidate:
-                    continue
-
-                found.append(candidate)
-
-            book_ids = sorted(set(found))
-        except Exception:
-            logger.exception("Failed to list supabase storage for user %s", user.id)
-            book_ids = []
-    else:
-        logger.debug("Supabase client or bucket not configured; skipping book listing")
+    # book catalog from the indexed documents table; storage is only listed to reconcile it
+    # (POST /documents/catalog/reconcile)
+    try:
+        book_ids: List[str] = user_book_ids(db, user.id)
+    except Exception:
+        logger.exception("Failed to load books for user %s", user.id)
+        book_ids = []
 
     return {
         "access_token": access_token,
         "token_type": "bearer",
         "user_id": str(user.id),
         "book_ids": book_ids,
-    }
\ No newline at end of file
+    }
+
+
+@router.get("/cache/stats")
+def get_user_cache_stats(current_user=Depends(get_current_user)):
+    """
+    GET /auth/cache/stats
+    Resolved-user cache behind get_current_user: entries, limits, hits / misses / hit ratio,
+    expirations, evictions.
+    """
+    return user_cache_stats()
@@ -1,20 +1,19 @@
 # app/api_routes/documents.py
-import ast
-import base64
+import asyncio
 import os
 import uuid
 import json
-import time
 import datetime
 import logging
 import mimetypes
 import re
 from pathlib import Path
+from urllib.parse import quote
 from typing import Optional, List, Dict, Any
 
 import aiofiles
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, requests
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse, FileResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List
 from fastapi import Body
@@ -23,17 +22,32 @@ from supabase import create_client as create_supabase_client
 import meilisearch
 
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from async_batch_pdf import run_pdf_async, aggregate_to_markdown, OUTPUT_DIR
+from async_batch_pdf import (
+    run_pdf_async, aggregate_to_markdown, append_to_markdown, journal_results, failed_pages_for_book,
+    count_pdf_pages, model_calls_saved, PageRecord, OUTPUT_DIR, GEMINI_LIMITER
+)
 
-from ..db import get_db
-from ..models import Document, User
-from ..crud import get_user_by_id
+from ..db import get_db, SessionLocal
+from ..models import Document, User, OCRJob
+from ..crud import get_user_by_id, list_user_books, user_books
 from ..config import (
-    SUPABASE_URL, SUPABASE_KEY, SUPABASE_BUCKET,
-    MEILI_URL, MEILI_MASTER_KEY, MEILI_INDEX_NAME
+    SUPABASE_URL, SUPABASE_KEY, SUPABASE_BUCKET, EXPORT_CONCURRENCY, STORAGE_SIGNED_URL_TTL_SECONDS,
+    BLOB_CACHE_MAX_BYTES,
+    MEILI_URL, MEILI_MASTER_KEY, MEILI_INDEX_NAME,
+    OCR_WORKERS, OCR_JOB_POLL_SECONDS, MEILI_INDEX_BATCH_SIZE, MEILI_TASK_TIMEOUT_SECONDS
+)
+from ..jobs import (
+    enqueue_job, claim_next_job, update_job_progress, finish_job, release_job, ensure_jobs_table,
+    active_job_for_document, latest_job_for_document, book_parts, book_page_count, job_to_dict,
+    JOB_DONE, JOB_FAILED
 )
 from ..schemas import SearchRequest, DownloadRequest
+from ..storage import (
+    StorageError, list_folder, open_object, tee_object, zip_stream, sign_urls, get_client as storage_client
+)
+from ..blob_cache import BlobCache
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/documents", tags=["documents"])
@@ -56,15 +70,16 @@ supabase = create_supabase_client(SUPABASE_URL, _supabase_key)
 # meilisearch client
 meili_client = meilisearch.Client(MEILI_URL, MEILI_MASTER_KEY)
 
-# default concurrency (no longer provided in payload)
+# per-job page concurrency (no longer provided in payload); the total number of Gemini calls
+# across all jobs is capped by the process-wide GEMINI_LIMITER in async_batch_pdf
 DEFAULT_CONCURRENCY = 4
 
-_tag_re = re.compile(r"tags\s*=\s*(\[[^\]]*\])", re.IGNORECASE | re.DOTALL)
-_date_trailer_re = re.compile(r"date\s*=\s*['\"]([^'\"]+)['\"]", re.IGNORECASE | re.DOTALL)
 _date_any_re = re.compile(r'(\d{1,2})[\/\-](\d{1,2})[\/\-](\d{2,4})')
 
 DOWNLOAD_BASE_DIR = Path("downloads").resolve()
 DOWNLOAD_BASE_DIR.mkdir(parents=True, exist_ok=True)
+# read-through copies of downloaded storage objects (see app/blob_cache.py)
+_BLOB_CACHE = BlobCache(DOWNLOAD_BASE_DIR / "blob_cache", BLOB_CACHE_MAX_BYTES)
 
 
 def _normalize_date_str(raw: str) -> Optional[str]:
@@ -91,63 +106,18 @@ def _normalize_date_str(raw: str) -> Optional[str]:
         return f"{d:02d}-{mth:02d}-{y:04d}"
 
 
-def extract_tags_and_date_from_trailer(text: str):
-    """
-    If text contains `tags=[...]` and/or `date='...'` (anywhere),
-    return (tags_list_or_empty, date_str_or_None, cleaned_text).
-    cleaned_text has the matched trailer spans removed.
-    """
-    if not text:
-        return [], None, text
-
-    tags = []
-    date_val = None
-    spans = []
-
-    # find tags
-    tmatch = _tag_re.search(text)
-    if tmatch:
-        tags_text = tmatch.group(1)
-        try:
-            parsed = ast.literal_eval(tags_text)
-            if isinstance(parsed, (list, tuple)):
-                # ensure list of strings
-                tags = [str(t).strip() for t in parsed if t is not None]
-        except Exception:
-            # fallback: crude parse of items inside brackets
-            inner = tags_text.strip()[1:-1]
-            items = re.split(r'\s*,\s*', inner)
-            tags = [re.sub(r"^['\"]|['\"]$", "", it).strip() for it in items if it.strip()]
-        spans.append(tmatch.span())
-
-    # find date
-    dmatch = _date_trailer_re.search(text)
-    if dmatch:
-        raw_date = dmatch.group(1)
-        date_val = _normalize_date_str(raw_date)
-        spans.append(dmatch.span())
-
-    # remove matched spans from text (in reverse order)
-    if spans:
-        parts = []
-        last = 0
-        for start, end in sorted(spans):
-            parts.append(text[last:start])
-            last = end
-        parts.append(text[last:])
-        cleaned = "".join(parts).strip()
-    else:
-        cleaned = text
-
-    return tags, date_val, cleaned
-
-
 def _is_pdf(filename: str, content_type: Optional[str]) -> bool:
     if content_type and content_type.lower() == "application/pdf":
         return True
     return filename.lower().endswith(".pdf")
 
 
+def _is_image(filename: str, content_type: Optional[str]) -> bool:
+    if content_type and content_type.startswith("image/"):
+        return True
+    return Path(filename or "").suffix.lower() in (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp", ".bmp")
+
+
 def _sanitize_filename(name: str, max_len: int = 200) -> str:
     if not name:
         return f"book-{uuid.uuid4().hex[:8]}"
@@ -167,47 +137,8 @@ def get_or_create_meili_index(client: meilisearch.Client, index_name: str):
         return client.index(index_name)
 
 
-def extract_page_content_from_result(result_item: Dict[str, Any]):
-    for key in ("result", "llm_result", "text", "content", "output"):
-        if key in result_item and result_item[key] is not None:
-            return result_item[key]
-    return ""
-
-
-@router.post("/upload", response_model=dict)
-async def upload_document_and_process(
-        file: UploadFile = File(...),
-        book_name: Optional[str] = Form(None),
-        db: Session = Depends(get_db),
-        current_user: User = Depends(get_current_user),  # automatically obtain user from token
-):
-    """
-    Upload a PDF (authenticated user inferred), create a new book_id (UUID) used as Document.id,
-    save the PDF & consolidated markdown to Supabase under <user_id>/<book_id>/,
-    create Document row with ocr_status=False, process pages and index them, set ocr_status=True.
-    """
-
-    # validate incoming file
-    if not _is_pdf(file.filename, file.content_type):
-        raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
-
-    # current_user is fetched by dependency - ensure it has id
-    if not current_user or not getattr(current_user, "id", None):
-        raise HTTPException(status_code=401, detail="Unable to identify authenticated user")
-
-    # generate book id (use as Document.id)
-    book_uuid = uuid.uuid4()
-    book_id_local = str(book_uuid)
-
-    # filename sanitization
-    safe_book_base = _sanitize_filename(book_name or Path(file.filename).stem)
-    pdf_filename = f"{safe_book_base}.pdf"
-
-    # local save path
-    safe_name = Path(file.filename).name
-    local_path = UPLOAD_DIR / f"{uuid.uuid4().hex}_{safe_name}"
-
-    # save to disk (async)
+async def _save_upload_file(file: UploadFile, local_path: Path):
+    """Stream an UploadFile to disk in 1 MiB chunks; raises 413 above MAX_UPLOAD_SIZE, 500 on I/O errors."""
     total_bytes = 0
     chunk_size = 1024 * 1024
     try:
@@ -249,10 +180,9 @@ async def upload_document_and_process(
         except Exception:
             pass
 
-    # Upload PDF to Supabase storage
-    bucket_name = SUPABASE_BUCKET or DEFAULT_BUCKET
-    bucket_path = f"{current_user.id}/{book_id_local}/{pdf_filename}"
 
+def _upload_pdf_to_supabase(bucket_name: str, bucket_path: str, local_path: Path):
+    """Upload a local PDF to storage; on failure removes the local file and raises HTTPException(500)."""
     upload_resp = None
     try:
         # prefer path-style upload (works for many storage3 client versions)
@@ -295,13 +225,65 @@ async def upload_document_and_process(
         except Exception:
             pass
         raise HTTPException(status_code=500, detail="Failed to upload PDF to Supabase storage")
+    # the book changed (new upload / appended pages): drop its cached downloads
+    _BLOB_CACHE.invalidate(bucket_path.rsplit("/", 1)[0] + "/")
 
-    # create Document DB record using generated book_uuid as the primary id
-    try:
-        doc = Document(id=book_uuid, user_id=current_user.id, filename=bucket_path, ocr_status=False)
+
+@router.post("/upload", response_model=dict, status_code=202)
+async def upload_document_and_process(
+        file: UploadFile = File(...),
+        book_name: Optional[str] = Form(None),
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user),  # automatically obtain user from token
+):
+    """
+    Upload a PDF (authenticated user inferred), create a new book_id (UUID) used as Document.id,
+    save the PDF to Supabase under <user_id>/<book_id>/, create Document row with ocr_status=False
+    and enqueue an OCR job. Returns 202 with the job id right away; poll GET /documents/jobs/{job_id}.
+    The background worker OCRs and indexes the pages, uploads the markdown and sets ocr_status=True.
+    """
+
+    # validate incoming file
+    if not _is_pdf(file.filename, file.content_type):
+        raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
+
+    # current_user is fetched by dependency - ensure it has id
+    if not current_user or not getattr(current_user, "id", None):
+        raise HTTPException(status_code=401, detail="Unable to identify authenticated user")
+
+    # generate book id (use as Document.id)
+    book_uuid = uuid.uuid4()
+    book_id_local = str(book_uuid)
+
+    # filename sanitization
+    safe_book_base = _sanitize_filename(book_name or Path(file.filename).stem)
+    pdf_filename = f"{safe_book_base}.pdf"
+
+    # local save path
+    safe_name = Path(file.filename).name
+    local_path = UPLOAD_DIR / f"{uuid.uuid4().hex}_{safe_name}"
+
+    # save to disk (async)
+    await _save_upload_file(file, local_path)
+
+    # Upload PDF to Supabase storage
+    bucket_name = SUPABASE_BUCKET or DEFAULT_BUCKET
+    bucket_path = f"{current_user.id}/{book_id_local}/{pdf_filename}"
+    size_bytes = local_path.stat().st_size
+    # the storage upload and the DB calls block; keep them off the event loop the OCR workers share
+    await run_in_threadpool(_upload_pdf_to_supabase, bucket_name, bucket_path, local_path)
+
+    def _create_document() -> Document:
+        doc = Document(id=book_uuid, user_id=current_user.id, filename=bucket_path, ocr_status=False,
+                       name=book_name or safe_book_base, page_count=0, size_bytes=size_bytes)
         db.add(doc)
         db.commit()
         db.refresh(doc)
+        return doc
+
+    # create Document DB record using generated book_uuid as the primary id
+    try:
+        doc = await run_in_threadpool(_create_document)
     except Exception:
         logger.exception("Failed to create Document row")
         try:
@@ -310,159 +292,665 @@ async def upload_document_and_process(
             pass
         raise HTTPException(status_code=500, detail="Failed to create document record")
 
-    # Meili index (get or create)
-    index = get_or_create_meili_index(meili_client, MEILI_INDEX_NAME)
+    # enqueue the OCR job; the background workers pick it up (see start_ocr_workers)
+    try:
+        job = await run_in_threadpool(enqueue_job, db, doc.id, current_user.id,
+                                      book_name if book_name else safe_book_base, str(local_path))
+    except Exception:
+        logger.exception("Failed to enqueue OCR job for book %s", book_id_local)
+        raise HTTPException(status_code=500, detail="Failed to enqueue OCR job")
+    _wake_ocr_workers()
+
+    return JSONResponse({
+        "status": "queued",
+        "job_id": str(job.id),
+        "status_url": f"/documents/jobs/{job.id}",
+        "uploaded_to_supabase": f"{bucket_name}/{bucket_path}",
+        "document_id": str(doc.id),
+        "book_id": book_id_local,
+    }, status_code=202)
+
 
-    # run pipeline with fixed concurrency
-    concurrency = DEFAULT_CONCURRENCY
+@router.get("/jobs/{job_id}")
+def get_ocr_job_status(
+        job_id: str,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user),
+):
+    """
+    GET /documents/jobs/{job_id}
+    Report status and per-page progress of an OCR job owned by the authenticated user.
+    """
     try:
-        results = await run_pdf_async(str(local_path), concurrency=concurrency, debug=False)
-        try:
-            md_path = aggregate_to_markdown(results)
-        except Exception:
-            md_path = None
+        job_uuid = uuid.UUID(job_id)
     except Exception:
-        logger.exception("PDF processing failed")
-        raise HTTPException(status_code=500, detail="Failed to process PDF")
+        raise HTTPException(status_code=404, detail="Job not found")
 
-    # Upload consolidated markdown to Supabase (same base name but .md)
-    uploaded_md = None
-    if md_path:
-        try:
-            md_local = Path(md_path)
-            md_filename = f"{safe_book_base}.md"
-            md_bucket_path = f"{current_user.id}/{book_id_local}/{md_filename}"
+    job = db.query(OCRJob).filter(OCRJob.id == job_uuid).first()
+    # 404 (not 403) for other users' jobs so job ids cannot be probed across tenants
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(job)
 
-            md_upload_resp = None
-            try:
-                md_upload_resp = supabase.storage.from_(bucket_name).upload(md_bucket_path, str(md_local))
-            except Exception as e_md_path:
-                logger.debug("MD path upload failed: %s", repr(e_md_path))
-                try:
-                    with open(md_local, "rb") as fmd:
-                        md_upload_resp = supabase.storage.from_(bucket_name).upload(
-                            path=md_bucket_path,
-                            file=fmd,
-                            file_options={"content-type": "text/markdown"},
-                        )
-                except Exception as e_md_file:
-                    logger.exception("MD upload failed (both methods). path_err=%s file_err=%s", repr(e_md_path),
-                                     repr(e_md_file))
-                    md_upload_resp = None
-
-            if isinstance(md_upload_resp, dict) and md_upload_resp.get("error"):
-                logger.error("Supabase returned error for md upload: %s", md_upload_resp)
-                uploaded_md = None
-            elif md_upload_resp is not None:
-                uploaded_md = f"{bucket_name}/{md_bucket_path}"
-                logger.info("Uploaded consolidated markdown to supabase: %s", uploaded_md)
-            else:
-                uploaded_md = None
-        except Exception:
-            logger.exception("Unexpected error while uploading markdown to Supabase")
-            uploaded_md = None
-    else:
-        uploaded_md = None
 
-    # index pages into Meilisearch
-    indexed_pages: List[Dict[str, Any]] = []
-    failed_pages: List[Dict[str, Any]] = []
-    for r in sorted(results, key=lambda x: x.get("page", 0)):
-        page_num = r.get("page")
-        page_id = str(uuid.uuid4())
-        page_content = extract_page_content_from_result(r)
-
-        # normalize content text
-        if isinstance(page_content, dict):
-            content_text = page_content.get("page_content") or json.dumps(page_content)
+def _get_owned_document(db: Session, book_id: str, current_user: User) -> Document:
+    """Document row for book_id if it belongs to the authenticated user, else 404."""
+    try:
+        book_uuid = uuid.UUID(book_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Book not found")
+    doc = db.query(Document).filter(Document.id == book_uuid, Document.user_id == current_user.id).first()
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return doc
+
+
+@router.post("/{book_id}/retry-failed", status_code=202)
+def retry_failed_pages(
+        book_id: str,
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user),
+):
+    """
+    POST /documents/{book_id}/retry-failed
+    Enqueue an OCR job that re-runs only the pages with a saved failed response (FAILED_DIR/<book_id>/);
+    pages that already succeeded are restored from the book's checkpoint journal.
+    """
+    doc = _get_owned_document(db, book_id, current_user)
+    pages = failed_pages_for_book(str(doc.id))
+    if not pages:
+        return JSONResponse({"status": "nothing_to_retry", "book_id": str(doc.id), "pages": []}, status_code=200)
+    if active_job_for_document(db, doc.id) is not None:
+        raise HTTPException(status_code=409, detail="An OCR job for this book is already queued or running")
+
+    # one job per uploaded part (initial PDF + appended pages) so each re-renders from its own source PDF
+    previous = latest_job_for_document(db, doc.id)
+    book_name = previous.book_name if previous else None
+    parts = book_parts(db, doc.id, max(doc.page_count or 0, max(pages)))
+    jobs = []
+    try:
+        for part in parts:
+            lo, hi = part["page_offset"], part["page_offset"] + part["total_pages"]
+            part_pages = [p for p in pages if lo < p <= hi]
+            if part_pages:
+                jobs.append(enqueue_job(db, doc.id, current_user.id, book_name, None, part_pages,
+                                        source_path=part["source_path"], page_offset=part["page_offset"]))
+    except Exception:
+        logger.exception("Failed to enqueue retry job for book %s", book_id)
+        raise HTTPException(status_code=500, detail="Failed to enqueue OCR job")
+    if not jobs:
+        return JSONResponse({"status": "nothing_to_retry", "book_id": str(doc.id), "pages": []}, status_code=200)
+    _wake_ocr_workers()
+
+    return JSONResponse({
+        "status": "queued",
+        "job_id": str(jobs[0].id),
+        "status_url": f"/documents/jobs/{jobs[0].id}",
+        "jobs": [{"job_id": str(j.id), "pages": j.pages} for j in jobs],
+        "book_id": str(doc.id),
+        "pages": pages,
+    }, status_code=202)
+
+
+def _images_to_pdf(image_paths: List[Path], out_path: Path) -> Path:
+    """Combine page images (in upload order) into one PDF so they go through the normal render path."""
+    from PIL import Image
+
+    images = []
+    try:
+        for ip in image_paths:
+            with Image.open(ip) as im:
+                images.append(im.convert("RGB"))
+        images[0].save(out_path, "PDF", save_all=True, append_images=images[1:], resolution=300.0)
+    finally:
+        for im in images:
+            im.close()
+    return out_path
+
+
+@router.post("/{book_id}/pages", status_code=202)
+async def append_pages(
+        book_id: str,
+        files: List[UploadFile] = File(...),
+        db: Session = Depends(get_db),
+        current_user: User = Depends(get_current_user),
+):
+    """
+    POST /documents/{book_id}/pages
+    Append pages to an existing book: either one PDF or one or more page images (combined in order).
+    Only the new pages are OCR'd; they are numbered after the book's current last page, appended to
+    the book's markdown and added to the search index. Returns 202 with the job id.
+    """
+    # DB and storage calls block; run them in the threadpool so the OCR workers' loop keeps going
+    def _check_book():
+        doc = _get_owned_document(db, book_id, current_user)
+        if active_job_for_document(db, doc.id) is not None:
+            raise HTTPException(status_code=409, detail="An OCR job for this book is already queued or running")
+        return doc, _book_page_count(db, doc, SUPABASE_BUCKET or DEFAULT_BUCKET)
+
+    doc, page_offset = await run_in_threadpool(_check_book)
+    if page_offset == 0:
+        raise HTTPException(status_code=409, detail="The book has not been processed yet")
+
+    pdfs = [f for f in files if _is_pdf(f.filename, f.content_type)]
+    images = [f for f in files if _is_image(f.filename, f.content_type)]
+    if not ((len(pdfs) == 1 and len(files) == 1) or (images and len(images) == len(files))):
+        raise HTTPException(status_code=400, detail="Upload either one PDF or one or more page images")
+
+    saved: List[Path] = []
+    try:
+        for f in files:
+            path = UPLOAD_DIR / f"{uuid.uuid4().hex}_{Path(f.filename or 'page').name}"
+            await _save_upload_file(f, path)
+            saved.append(path)
+        if pdfs:
+            local_path = saved[0]
         else:
-            content_text = str(page_content)
+            local_path = UPLOAD_DIR / f"{uuid.uuid4().hex}_pages.pdf"
+            await run_in_threadpool(_images_to_pdf, saved, local_path)
+            for path in saved:
+                os.remove(path)
+        new_pages = await run_in_threadpool(count_pdf_pages, str(local_path))
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Failed to prepare appended pages for book %s", book_id)
+        for path in saved:
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+        raise HTTPException(status_code=400, detail="Could not read the uploaded pages")
 
-        # Extract tags and date from trailer like: tags=[...] date='...'
-        tags, date_val, cleaned_content = extract_tags_and_date_from_trailer(content_text)
+    first, last = page_offset + 1, page_offset + new_pages
+    safe_book_base = Path(doc.filename).stem
+    bucket_name = SUPABASE_BUCKET or DEFAULT_BUCKET
+    bucket_path = f"{current_user.id}/{doc.id}/{safe_book_base}_pages_{first}-{last}.pdf"
+    appended_bytes = local_path.stat().st_size
+    await run_in_threadpool(_upload_pdf_to_supabase, bucket_name, bucket_path, local_path)
 
-        meili_doc = {
-            "page_id": page_id,
-            "user_id": str(current_user.id),
-            "book_id": book_id_local,
-            "book_name": book_name if book_name else safe_book_base,
-            "page_number": page_num,
-            "content": cleaned_content,
-            "tags": tags,
-            "date": date_val,
-        }
+    def _enqueue_append():
+        doc.size_bytes = (doc.size_bytes or 0) + appended_bytes
+        db.commit()
+        previous = latest_job_for_document(db, doc.id)
+        return enqueue_job(db, doc.id, current_user.id, previous.book_name if previous else None, str(local_path),
+                           source_path=bucket_path, page_offset=page_offset)
+
+    try:
+        job = await run_in_threadpool(_enqueue_append)
+    except Exception:
+        logger.exception("Failed to enqueue append job for book %s", book_id)
+        raise HTTPException(status_code=500, detail="Failed to enqueue OCR job")
+    _wake_ocr_workers()
+
+    return JSONResponse({
+        "status": "queued",
+        "job_id": str(job.id),
+        "status_url": f"/documents/jobs/{job.id}",
+        "uploaded_to_supabase": f"{bucket_name}/{bucket_path}",
+        "book_id": str(doc.id),
+        "pages": [first, last],
+    }, status_code=202)
+
+
+@router.get("")
+def list_books(
+    limit: int = Query(20, ge=1, le=100, description="Books per page (1-100)"),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    GET /documents
+    The caller's books, oldest first, from the documents table (no storage calls):
+    {"total", "limit", "offset", "books": [{"book_id", "name", "page_count", "size_bytes", "status", "upload_date"}]}.
+    """
+    total, books = list_user_books(db, current_user.id, limit, offset)
+    return {"total": total, "limit": limit, "offset": offset, "books": books}
 
-        try:
-            task = index.add_documents([meili_doc])
-            task_id = None
-            if hasattr(task, "task_uid"):
-                task_id = task.task_uid
-            elif isinstance(task, dict):
-                task_id = task.get("taskUid") or task.get("task_uid") or task.get("uid")
-            elif isinstance(task, int):
-                task_id = task
-
-            if task_id is not None:
-                for _ in range(60):
-                    try:
-                        status = index.get_task(task_id)
-                    except Exception:
-                        status = None
-                    if status:
-                        st = status.get("status") if isinstance(status, dict) else getattr(status, "status", None)
-                        if st in ("succeeded", "done"):
-                            break
-                        if st == "failed":
-                            raise RuntimeError(f"Meili indexing failed for page {page_num}: {status}")
-                    time.sleep(1)
-            indexed_pages.append({"page": page_num, "page_id": page_id})
-        except Exception:
-            logger.exception("Failed to index page %s", page_num)
-            failed_pages.append({"page": page_num})
 
-    # mark ocr_status True
+@router.post("/catalog/reconcile")
+async def reconcile_catalog(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    POST /documents/catalog/reconcile
+    Bring the caller's catalog in line with storage: recompute size_bytes (PDF parts), page_count and
+    missing names, and report books without files ("missing") and storage folders without a
+    documents row ("orphaned"). Login and GET /documents never list storage.
+    """
+    bucket_name = SUPABASE_BUCKET or DEFAULT_BUCKET
+    client = storage_client()
+    try:
+        items = await list_folder(client, bucket_name, str(current_user.id))
+    except StorageError as exc:
+        raise HTTPException(status_code=502, detail=exc.detail)
+    folders = {item.get("name") for item in items if isinstance(item, dict) and item.get("id") is None}
+
+    docs = await run_in_threadpool(user_books, db, current_user.id)
+    book_ids = [str(d.id) for d in docs]
+    entries, _ = await _list_books(client, bucket_name, current_user.id, book_ids, ["pdf"])
+    sizes: Dict[str, int] = {}
+    for e in entries:
+        sizes[e["book_id"]] = sizes.get(e["book_id"], 0) + (e["size"] or 0)
+
+    def _update_catalog() -> List[str]:
+        updated = []
+        for d in docs:
+            # a count that can't be determined (0) never overwrites the stored one
+            page_count = _book_page_count(db, d, bucket_name) or d.page_count
+            catalog = (d.name or Path(d.filename).stem, page_count, sizes.get(str(d.id), 0))
+            if (d.name, d.page_count, d.size_bytes) != catalog:
+                d.name, d.page_count, d.size_bytes = catalog
+                updated.append(str(d.id))
+        db.commit()
+        return updated
+
+    updated = await run_in_threadpool(_update_catalog)
+
+    return {
+        "books": len(docs),
+        "updated": updated,
+        "missing": [book_id for book_id in book_ids if book_id not in sizes],
+        "orphaned": sorted(f for f in folders if f and f not in set(book_ids)),
+    }
+
+
+@router.get("/ocr/limiter")
+def get_ocr_limiter_stats(current_user: User = Depends(get_current_user)):
+    """
+    GET /documents/ocr/limiter
+    Current adaptive concurrency limit, in-flight calls and queue depth of the shared Gemini limiter.
+    """
+    return GEMINI_LIMITER.stats()
+
+
+@router.get("/cache/stats")
+def get_blob_cache_stats(current_user: User = Depends(get_current_user)):
+    """
+    GET /documents/cache/stats
+    Download blob cache: entries, stored bytes, hits / misses / hit ratio, fills, evictions, invalidations.
+    """
+    return _BLOB_CACHE.stats()
+
+
+# ---------------- background OCR workers ----------------
+_ocr_worker_tasks: List[asyncio.Task] = []
+_ocr_wakeup: Optional[asyncio.Event] = None
+
+
+def _wake_ocr_workers():
+    if _ocr_wakeup is not None:
+        _ocr_wakeup.set()
+
+
+def _load_document_filename(document_id) -> Optional[str]:
+    db = SessionLocal()
     try:
+        doc = db.query(Document).filter(Document.id == document_id).first()
+        return doc.filename if doc else None
+    finally:
+        db.close()
+
+
+def _mark_document_ocr_done(document_id) -> bool:
+    db = SessionLocal()
+    try:
+        doc = db.query(Document).filter(Document.id == document_id).first()
+        if doc is None:
+            return False
         doc.ocr_status = True
-        db.add(doc)
+        page_count = _book_page_count(db, doc, SUPABASE_BUCKET or DEFAULT_BUCKET)
+        if page_count:
+            doc.page_count = page_count
         db.commit()
-        db.refresh(doc)
+        return True
     except Exception:
+        db.rollback()
         logger.exception("Failed to update document ocr_status")
+        return False
+    finally:
+        db.close()
+
+
+def _fetch_pdf_from_supabase(bucket_name: str, bucket_path: str) -> Optional[Path]:
+    """Re-download the source PDF when the local upload copy is gone (restart, other host)."""
+    try:
+        raw = supabase.storage.from_(bucket_name).download(bucket_path)
+    except Exception:
+        logger.exception("Supabase download() raised for %s", bucket_path)
+        return None
+    if not isinstance(raw, (bytes, bytearray)) or not raw:
+        return None
+    local_path = UPLOAD_DIR / f"{uuid.uuid4().hex}_{Path(bucket_path).name}"
+    local_path.write_bytes(bytes(raw))
+    return local_path
+
+
+def _stored_page_count(bucket_name: str, doc: Document) -> int:
+    """Pages of the book's original PDF in storage; 0 when it can't be fetched or read."""
+    local_path = _fetch_pdf_from_supabase(bucket_name, doc.filename)
+    if local_path is None:
+        return 0
+    try:
+        return count_pdf_pages(str(local_path))
+    except Exception:
+        logger.exception("Failed to count the pages of %s", doc.filename)
+        return 0
+    finally:
         try:
             os.remove(local_path)
         except Exception:
             pass
-        return JSONResponse({
-            "status": "partial_success",
+
+
+def _book_page_count(db: Session, doc: Document, bucket_name: str) -> int:
+    """
+    book_page_count() from the book's OCR jobs. Books uploaded before jobs were recorded have no parts:
+    their catalog page_count is used, else the pages of the stored PDF are counted.
+    """
+    legacy_pages = 0
+    if not book_parts(db, doc.id):
+        legacy_pages = doc.page_count or _stored_page_count(bucket_name, doc)
+    return book_page_count(db, doc.id, legacy_pages)
+
+
+def _upload_markdown(bucket_name: str, md_local: Path, md_bucket_path: str) -> Optional[str]:
+    """Upload (overwrite) the consolidated markdown; returns '<bucket>/<path>' or None on failure."""
+    md_upload_resp = None
+    try:
+        md_upload_resp = supabase.storage.from_(bucket_name).upload(
+            md_bucket_path, str(md_local), file_options={"content-type": "text/markdown", "upsert": "true"})
+    except Exception as e_md_path:
+        logger.debug("MD path upload failed: %s", repr(e_md_path))
+        try:
+            with open(md_local, "rb") as fmd:
+                md_upload_resp = supabase.storage.from_(bucket_name).upload(
+                    path=md_bucket_path,
+                    file=fmd,
+                    file_options={"content-type": "text/markdown", "upsert": "true"},
+                )
+        except Exception as e_md_file:
+            logger.exception("MD upload failed (both methods). path_err=%s file_err=%s", repr(e_md_path),
+                             repr(e_md_file))
+            md_upload_resp = None
+
+    if isinstance(md_upload_resp, dict) and md_upload_resp.get("error"):
+        logger.error("Supabase returned error for md upload: %s", md_upload_resp)
+        return None
+    if md_upload_resp is None:
+        return None
+    uploaded_md = f"{bucket_name}/{md_bucket_path}"
+    logger.info("Uploaded consolidated markdown to supabase: %s", uploaded_md)
+    _BLOB_CACHE.invalidate(md_bucket_path)
+    return uploaded_md
+
+
+def _fetch_markdown_from_supabase(bucket_name: str, md_bucket_path: str, md_local: Path) -> bool:
+    """Restore the book's current markdown locally before appending to it."""
+    try:
+        raw = supabase.storage.from_(bucket_name).download(md_bucket_path)
+    except Exception:
+        logger.exception("Supabase download() raised for %s", md_bucket_path)
+        return False
+    if not isinstance(raw, (bytes, bytearray)) or not raw:
+        return False
+    md_local.parent.mkdir(parents=True, exist_ok=True)
+    md_local.write_bytes(bytes(raw))
+    return True
+
+
+def _write_book_markdown(bucket_name: str, md_bucket_path: str, book_id: str, results: List[Dict[str, Any]],
+                         page_offset: int, append: bool) -> Path:
+    """
+    Update OUTPUT_DIR/<book_id>.md: appended parts only add their new pages at the end;
+    anything else (or an append whose pages are already in the file) rebuilds it from the book's journal.
+    """
+    md_local = OUTPUT_DIR / f"{book_id}.md"
+    if append:
+        if not md_local.exists():
+            _fetch_markdown_from_supabase(bucket_name, md_bucket_path, md_local)
+        if md_local.exists():
+            with open(md_local, encoding="utf-8") as fh:
+                already = f"## Page {page_offset + 1}\n" in fh.read()
+            if not already:
+                return append_to_markdown(results, md_local)
+    return aggregate_to_markdown(journal_results(book_id) or results, md_local)
+
+
+def _meili_task_id(task) -> Optional[int]:
+    if hasattr(task, "task_uid"):
+        return task.task_uid
+    if isinstance(task, dict):
+        return task.get("taskUid") or task.get("task_uid") or task.get("uid")
+    if isinstance(task, int):
+        return task
+    return None
+
+
+async def _wait_for_meili_task(index, task_id: int, timeout: float = MEILI_TASK_TIMEOUT_SECONDS):
+    """
+    Poll a Meilisearch task without blocking the event loop (exponential backoff, capped at 2s).
+    Returns (status, error) where status is 'succeeded', 'failed' or 'timeout'.
+    """
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    delay = 0.05
+    while True:
+        try:
+            task = await run_in_threadpool(index.get_task, task_id)
+        except Exception:
+            task = None
+        if task:
+            st = task.get("status") if isinstance(task, dict) else getattr(task, "status", None)
+            if st in ("succeeded", "done"):
+                return "succeeded", None
+            if st in ("failed", "canceled"):
+                err = task.get("error") if isinstance(task, dict) else getattr(task, "error", None)
+                return "failed", err or {"message": f"task {st}"}
+        if loop.time() >= deadline:
+            return "timeout", None
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 2.0)
+
+
+def _meili_error_message(err) -> str:
+    if isinstance(err, dict):
+        return err.get("message") or err.get("code") or json.dumps(err)
+    return str(err)
+
+
+async def _add_documents_batch(index, docs: List[Dict[str, Any]], indexed: List[Dict[str, Any]],
+                               failed: List[Dict[str, Any]]):
+    """
+    Send one batch in a single add_documents call. A Meilisearch task fails as a whole, so a
+    failed batch is split in halves and retried until the offending documents are isolated;
+    each of those is reported with the error message from the task.
+    """
+    try:
+        task = await run_in_threadpool(index.add_documents, docs)
+        task_id = _meili_task_id(task)
+        if task_id is None:
+            status, err = "succeeded", None
+        else:
+            status, err = await _wait_for_meili_task(index, task_id)
+    except Exception as exc:
+        logger.exception("Meili add_documents raised for %s docs", len(docs))
+        status, err = "failed", {"message": repr(exc)}
+
+    if status == "succeeded":
+        indexed.extend({"page": d["page_number"], "page_id": d["page_id"]} for d in docs)
+        return
+    if status == "timeout":
+        # the task is still queued in Meilisearch and will most likely land; do not resubmit
+        logger.warning("Meili task for %s docs did not finish within %ss", len(docs), MEILI_TASK_TIMEOUT_SECONDS)
+        failed.extend({"page": d["page_number"], "error": "index_task_timeout"} for d in docs)
+        return
+    if len(docs) > 1:
+        mid = len(docs) // 2
+        await _add_documents_batch(index, docs[:mid], indexed, failed)
+        await _add_documents_batch(index, docs[mid:], indexed, failed)
+        return
+    logger.error("Failed to index page %s: %s", docs[0]["page_number"], err)
+    failed.append({"page": docs[0]["page_number"], "error": _meili_error_message(err)})
+
+
+async def _index_pages(index, results: List[Dict[str, Any]], user_id: str, book_id: str, book_name: str,
+                       batch_size: int = MEILI_INDEX_BATCH_SIZE):
+    """
+    Index OCR page results into Meilisearch in batches of `batch_size` documents
+    (one index task per batch); blank pages are left out. Returns (indexed_pages, failed_pages).
+    """
+    records = sorted((rec for rec in map(PageRecord.from_result, results) if not rec.blank), key=lambda rec: rec.page)
+    docs = [rec.to_search_doc(user_id, book_id, book_name) for rec in records]
+
+    indexed_pages: List[Dict[str, Any]] = []
+    failed_pages: List[Dict[str, Any]] = []
+    batch_size = max(1, batch_size)
+    for start in range(0, len(docs), batch_size):
+        await _add_documents_batch(index, docs[start:start + batch_size], indexed_pages, failed_pages)
+    indexed_pages.sort(key=lambda x: x["page"] or 0)
+    failed_pages.sort(key=lambda x: x["page"] or 0)
+    return indexed_pages, failed_pages
+
+
+async def _process_ocr_job(job: Dict[str, Any]):
+    """
+    Run the full OCR flow for one claimed job:
+    OCR pages (reporting progress) -> upload markdown -> index pages -> mark Document ocr_status=True.
+    """
+    job_id = job["id"]
+    book_id_local = str(job["document_id"])
+    user_id = str(job["user_id"])
+    bucket_name = SUPABASE_BUCKET or DEFAULT_BUCKET
+
+    document_path = await run_in_threadpool(_load_document_filename, job["document_id"])
+    if not document_path:
+        await run_in_threadpool(finish_job, job_id, JOB_FAILED, None, "document_not_found")
+        return
+    safe_book_base = Path(document_path).stem
+    book_name = job.get("book_name") or safe_book_base
+    # appended parts have their own PDF; their pages are numbered after the existing ones
+    bucket_path = job.get("source_path") or document_path
+    page_offset = job.get("page_offset") or 0
+
+    local_path = Path(job["local_path"]) if job.get("local_path") else None
+    if local_path is None or not local_path.exists():
+        local_path = await run_in_threadpool(_fetch_pdf_from_supabase, bucket_name, bucket_path)
+        if local_path is None:
+            # transient storage failure: put it back on the queue (attempts are capped by claim_next_job)
+            await run_in_threadpool(release_job, job_id, "source_pdf_unavailable")
+            return
+
+    try:
+        # pages finish concurrently; serialize the read-modify-write progress updates
+        progress_lock = asyncio.Lock()
+
+        async def _on_start(total_pages: int):
+            async with progress_lock:
+                await run_in_threadpool(update_job_progress, job_id, total_pages)
+
+        async def _on_page_done(r: Dict[str, Any]):
+            async with progress_lock:
+                await run_in_threadpool(update_job_progress, job_id, None, bool(r.get("ok")), r.get("page"))
+
+        try:
+            # checkpointed per book: a re-claimed job (worker crash / restart) only OCRs the missing pages
+            results = await run_pdf_async(str(local_path), concurrency=DEFAULT_CONCURRENCY, debug=False,
+                                          on_start=_on_start, on_page_done=_on_page_done,
+                                          book_id=book_id_local, pages=job.get("pages"), page_offset=page_offset,
+                                          user_id=user_id)
+        except Exception as exc:
+            logger.exception("PDF processing failed for job %s", job_id)
+            await run_in_threadpool(finish_job, job_id, JOB_FAILED, None, f"pdf_processing_failed: {exc!r}")
+            return
+
+        # Upload consolidated markdown to Supabase (same base name but .md)
+        md_bucket_path = f"{user_id}/{book_id_local}/{safe_book_base}.md"
+        try:
+            md_path = await run_in_threadpool(_write_book_markdown, bucket_name, md_bucket_path, book_id_local,
+                                              results, page_offset, page_offset > 0 and not job.get("pages"))
+        except Exception:
+            logger.exception("Failed to aggregate markdown for book %s", book_id_local)
+            md_path = None
+
+        uploaded_md = None
+        if md_path:
+            uploaded_md = await run_in_threadpool(_upload_markdown, bucket_name, Path(md_path), md_bucket_path)
+
+        # index pages into Meilisearch
+        index = get_or_create_meili_index(meili_client, MEILI_INDEX_NAME)
+        indexed_pages, failed_pages = await _index_pages(index, results, user_id, book_id_local, book_name)
+
+        marked = await run_in_threadpool(_mark_document_ocr_done, job["document_id"])
+
+        result = {
+            "status": "success" if marked else "partial_success",
             "uploaded_to_supabase": f"{bucket_name}/{bucket_path}",
             "uploaded_markdown": uploaded_md,
-            "saved_local_path": str(local_path),
             "pages_indexed": indexed_pages,
             "pages_failed": failed_pages,
-            # "document_id": str(doc.id),
+            "cache_hits": sum(1 for r in results if r.get("cached")),
+            "model_calls_saved": model_calls_saved(results),
+            "document_id": book_id_local,
             "book_id": book_id_local,
-            "markdown_path": str(md_path) if md_path else None
-        }, status_code=200)
+            "markdown_path": str(md_path) if md_path else None,
+        }
+        await run_in_threadpool(finish_job, job_id, JOB_DONE, result, None)
+    finally:
+        # the local copy only mirrors the stored PDF: drop it whatever happened (a retry fetches it again)
+        try:
+            os.remove(local_path)
+        except Exception:
+            pass
 
-    # cleanup local file
-    try:
-        os.remove(local_path)
-    except Exception:
-        pass
-
-    return JSONResponse({
-        "status": "success",
-        "uploaded_to_supabase": f"{bucket_name}/{bucket_path}",
-        "uploaded_markdown": uploaded_md,
-        "saved_local_path": str(local_path),
-        "pages_indexed": indexed_pages,
-        "pages_failed": failed_pages,
-        "document_id": str(doc.id),
-        "book_id": book_id_local,
-        "markdown_path": str(md_path) if md_path else None
-    }, status_code=200)
 
+async def _ocr_worker_loop(worker_no: int):
+    while True:
+        claim = asyncio.ensure_future(run_in_threadpool(claim_next_job))
+        try:
+            job = await asyncio.shield(claim)
+        except asyncio.CancelledError:
+            # cancelled while claiming: a job claimed by the thread would stay "running" until its lease expires
+            job = await claim
+            if job is not None:
+                await run_in_threadpool(release_job, job["id"], "worker_shutdown")
+            raise
+        if job is None:
+            try:
+                await asyncio.wait_for(_ocr_wakeup.wait(), timeout=OCR_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            _ocr_wakeup.clear()
+            continue
 
+        logger.info("OCR worker %s picked up job %s (attempt %s)", worker_no, job["id"], job["attempts"])
+        try:
+            await _process_ocr_job(job)
+        except asyncio.CancelledError:
+            # shutting down mid-job: hand the job back instead of waiting for the lease to expire
+            await run_in_threadpool(release_job, job["id"], "worker_shutdown")
+            raise
+        except Exception as exc:
+            logger.exception("OCR worker %s failed job %s", worker_no, job["id"])
+            await run_in_threadpool(finish_job, job["id"], JOB_FAILED, None, repr(exc))
+
+
+async def start_ocr_workers(num_workers: int = OCR_WORKERS):
+    global _ocr_wakeup
+    await run_in_threadpool(ensure_jobs_table)
+    _ocr_wakeup = asyncio.Event()
+    for i in range(num_workers):
+        _ocr_worker_tasks.append(asyncio.create_task(_ocr_worker_loop(i + 1)))
+    logger.info("Started %s OCR workers", num_workers)
+
+
+async def stop_ocr_workers():
+    for t in _ocr_worker_tasks:
+        t.cancel()
+    await asyncio.gather(*_ocr_worker_tasks, return_exceptions=True)
+    _ocr_worker_tasks.clear()
 
     # NOTE: we intentionally do NOT accept user_id in the body — user is determined from JWT
 
@@ -550,30 +1038,152 @@ async def search_documents(
 
 MAX_TOTAL_BYTES = int(os.getenv("EXPORT_MAX_TOTAL_BYTES", "0"))  # 0 = no limit
 
+
+async def _list_book_files(client, bucket_name: str, user_id, book_id: str,
+                           extensions: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Storage listing of one book folder as download entries
+    {"book_id", "object_path", "filename", "arcname", "mime", "size"}.
+    Raises StorageError when the folder cannot be listed.
+    """
+    prefix = f"{user_id}/{book_id}"
+    try:
+        raw_list = await list_folder(client, bucket_name, prefix)
+    except StorageError:
+        logger.exception("Supabase list failed for prefix=%s", prefix)
+        raise StorageError(502, "supabase_list_failed")
+
+    if isinstance(raw_list, dict):
+        data_list = raw_list.get("data") or []
+    elif isinstance(raw_list, list):
+        data_list = raw_list
+    else:
+        data_list = []
+
+    wanted = {e.lower().lstrip(".") for e in extensions} if extensions else None
+    entries = []
+    for item in data_list:
+        if isinstance(item, dict):
+            name = item.get("name") or item.get("path") or item.get("id")
+            metadata = item.get("metadata") or {}
+        else:
+            name = str(item)
+            metadata = {}
+        if not name:
+            continue
+
+        # normalize object_path and filename
+        if name.startswith(str(user_id) + "/"):
+            object_path = name
+            filename = "/".join(name.split("/")[2:])
+        elif name.startswith(book_id + "/"):
+            object_path = f"{user_id}/{name}"
+            filename = "/".join(name.split("/")[1:])
+        elif name.startswith(book_id):
+            parts = name.split("/", 1)
+            filename = parts[1] if len(parts) > 1 else ""
+            object_path = f"{user_id}/{name}"
+        else:
+            object_path = f"{prefix}/{name.split('/')[-1]}"
+            filename = name.split("/")[-1]
+
+        if not filename:
+            # folder entry -> skip
+            continue
+        if wanted is not None and Path(filename).suffix.lower().lstrip(".") not in wanted:
+            continue
+
+        mime_type = metadata.get("mimetype") or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        size = metadata.get("size")
+        version = (metadata.get("eTag") or item.get("updated_at")) if isinstance(item, dict) else None
+        entries.append({
+            "book_id": book_id,
+            "object_path": object_path,
+            "filename": Path(filename).name,
+            "arcname": f"{book_id}/{filename}",
+            "mime": mime_type,
+            "size": int(size) if size is not None else None,
+            "version": version,  # blob cache key part; changes whenever the object is re-uploaded
+        })
+    return entries
+
+
+async def _list_books(client, bucket_name: str, user_id, book_ids: List[str],
+                      extensions: Optional[List[str]] = None):
+    """
+    List every book folder concurrently (EXPORT_CONCURRENCY at a time).
+    Returns (entries in the requested book order, failed map {book_id: [reasons]}).
+    """
+    failed: Dict[str, List[str]] = {book_id: [] for book_id in book_ids}
+    sem = asyncio.Semaphore(EXPORT_CONCURRENCY)
+
+    async def _list(book_id: str) -> List[Dict[str, Any]]:
+        async with sem:
+            try:
+                book_entries = await _list_book_files(client, bucket_name, user_id, book_id, extensions)
+            except StorageError as exc:
+                failed[book_id].append(exc.detail)
+                return []
+        if not book_entries:
+            failed[book_id].append("no_files_found")
+        return book_entries
+
+    entries: List[Dict[str, Any]] = []
+    for book_entries in await asyncio.gather(*(_list(book_id) for book_id in book_ids)):
+        entries.extend(book_entries)
+    return entries, failed
+
+
+async def _signed_files(client, bucket_name: str, entries: List[Dict[str, Any]],
+                        failed: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """Signed-URL descriptions of `entries`; objects storage would not sign are added to `failed`."""
+    try:
+        links = await sign_urls(client, bucket_name, [e["object_path"] for e in entries],
+                                download_names={e["object_path"]: e["filename"] for e in entries})
+    except StorageError as exc:
+        logger.exception("Signing download URLs failed")
+        raise HTTPException(status_code=502, detail=exc.detail)
+    files = []
+    for e in entries:
+        url = links.get(e["object_path"])
+        if url is None:
+            failed.setdefault(e["book_id"], []).append(e["object_path"])
+            continue
+        files.append({"book_id": e["book_id"], "filename": e["filename"], "mime": e["mime"],
+                      "size_bytes": e["size"], "url": url})
+    return files
+
+
+def _content_disposition(filename: str) -> str:
+    ascii_name = filename.encode("ascii", "replace").decode("ascii").replace('"', "")
+    return f'attachment; filename="{ascii_name}"; filename*=UTF-8\'\'{quote(filename)}'
+
+
 @router.post("/download")
-def download_books_as_base64(
+async def download_books(
+    request: Request,
     body: DownloadRequest = Body(...),
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     """
-    Download requested book files from Supabase and return JSON:
-      {
-        "status": "done",
-        "files": [
-           {"book_id": "...", "filename": "...", "mime": "...", "b64": "..." },
-           ...
-        ],
-        "failed": { "<book_id>": [ ... ] }
-      }
-
-    NOTE: This encodes files as base64 in memory. Use with caution for large files.
+    Stream the requested books' files from Supabase Storage without buffering them:
+    - a single file (format 'raw', or 'auto' when exactly one file matches) is streamed as-is with its
+      Content-Type and supports HTTP Range (206 / Content-Range); 'auto' for one book with extensions ["pdf"]
+      streams the book's original PDF (Document.filename) even when pages were appended as separate PDFs;
+    - otherwise a ZIP (<book_id>/<filename> members) is built on the fly; it cannot be range-requested.
+    Book folders are listed, and ZIP members fetched, EXPORT_CONCURRENCY at a time over the shared
+    storage client. Objects are read through the on-disk blob cache (_BLOB_CACHE); a warm single file
+    is returned as a FileResponse.
+    - format 'signed' returns JSON with a short-lived signed storage URL per file (clients download
+      straight from storage; nothing is proxied). Only the caller's own <user_id>/<book_id>/ folders are listed.
+    `extensions` restricts the files (e.g. ["pdf"]). Books that could not be listed are reported in the
+    X-Download-Failed header ({"<book_id>": [...]}); files that fail mid-export are listed in the
+    archive's failed.json.
     """
 
     bucket_name = SUPABASE_BUCKET or DEFAULT_BUCKET
 
-    # (Optional) keep same target_path checks for parity with previous behavior,
-    # but we will ignore target_path for output location (client receives blobs).
+    # target_path is no longer used for output (the client receives the files), but keep validating it
     if body.target_path:
         requested = Path(body.target_path)
         if requested.is_absolute():
@@ -588,146 +1198,104 @@ def download_books_as_base64(
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid target_path")
 
-    files_out: List[Dict] = []
-    failed: Dict[str, List[str]] = {}
-    total_bytes_accum = 0
-
-    def get_bytes_from_supabase_object(object_path: str):
-        """Download fallback logic — returns bytes or None"""
+    client = storage_client()
+    book_ids = list(dict.fromkeys(body.book_ids))
+    entries, failed = await _list_books(client, bucket_name, current_user.id, book_ids, body.extensions)
+    if not entries:
+        raise HTTPException(status_code=404, detail={"message": "No files found", "failed": failed})
+
+    # safety: check total bytes limit if configured (sizes from the storage listing)
+    total_bytes = sum(e["size"] or 0 for e in entries)
+    if MAX_TOTAL_BYTES and total_bytes > MAX_TOTAL_BYTES:
+        logger.error("Export exceeded MAX_TOTAL_BYTES (%s bytes)", MAX_TOTAL_BYTES)
+        raise HTTPException(status_code=413, detail="Requested files exceed maximum allowed total size")
+
+    if body.format == "signed":
+        files = await _signed_files(client, bucket_name, entries, failed)
+        return JSONResponse(content={
+            "status": "done",
+            "expires_in": STORAGE_SIGNED_URL_TTL_SECONDS,
+            "files": files,
+            "failed": failed,
+            "total_bytes": total_bytes,
+        })
+
+    headers = {}
+    if any(failed.values()):
+        headers["X-Download-Failed"] = json.dumps(failed)
+
+    pdf_only = bool(body.extensions) and {ext.lower().lstrip(".") for ext in body.extensions} == {"pdf"}
+    if body.format == "auto" and len(book_ids) == 1 and pdf_only and len(entries) > 1:
+        # a book with appended parts: the PDF viewer needs one PDF, not a ZIP, so serve the original upload
         try:
-            raw_download = supabase.storage.from_(bucket_name).download(object_path)
+            primary = await run_in_threadpool(_load_document_filename, uuid.UUID(book_ids[0]))
         except Exception:
-            logger.exception("Supabase download() raised for %s", object_path)
-            raw_download = None
-
-        file_bytes = None
-        if isinstance(raw_download, dict):
-            data = raw_download.get("data") or raw_download.get("body") or raw_download.get("content")
-            if isinstance(data, (bytes, bytearray)):
-                file_bytes = bytes(data)
-            elif isinstance(data, str):
-                try:
-                    file_bytes = base64.b64decode(data)
-                except Exception:
-                    file_bytes = data.encode("utf-8")
-        elif isinstance(raw_download, (bytes, bytearray)):
-            file_bytes = bytes(raw_download)
-        elif raw_download is not None:
-            try:
-                file_bytes = getattr(raw_download, "content", None)
-                if callable(file_bytes):
-                    file_bytes = file_bytes()
-            except Exception:
-                file_bytes = None
+            logger.exception("Failed to load the primary PDF of book %s", book_ids[0])
+            primary = None
+        entries = [e for e in entries if e["object_path"] == primary] or entries
 
-        # fallback: public url
-        if not file_bytes:
-            try:
-                pub = supabase.storage.from_(bucket_name).get_public_url(object_path)
-                if isinstance(pub, dict):
-                    public_url = pub.get("publicUrl") or pub.get("public_url") or pub.get("publicURL")
-                elif isinstance(pub, str):
-                    public_url = pub
-                else:
-                    public_url = None
-
-                if public_url:
-                    r = requests.get(public_url, timeout=30)
-                    if r.status_code == 200:
-                        file_bytes = r.content
-            except Exception:
-                logger.exception("Public-url fallback failed for %s", object_path)
-
-        return file_bytes
-
-    for book_id in body.book_ids:
-        failed.setdefault(book_id, [])
+    raw = body.format == "raw" or (body.format == "auto" and len(entries) == 1)
+    if raw and len(entries) != 1:
+        raise HTTPException(status_code=400, detail=f"format 'raw' needs exactly one file, found {len(entries)}")
 
-        prefix = f"{current_user.id}/{book_id}"
+    if raw:
+        entry = entries[0]
         try:
-            raw_list = supabase.storage.from_(bucket_name).list(prefix)
+            cached = await run_in_threadpool(_BLOB_CACHE.lookup, entry["object_path"], entry["version"])
         except Exception:
-            logger.exception("Supabase list failed for prefix=%s", prefix)
-            failed[book_id].append("supabase_list_failed")
-            continue
-
-        if isinstance(raw_list, dict):
-            data_list = raw_list.get("data") or []
-        elif isinstance(raw_list, list):
-            data_list = raw_list
-        else:
-            data_list = []
-
-        if not data_list:
-            failed[book_id].append("no_files_found")
-            continue
-
-        # iterate listed items and download each file
-        for item in data_list:
-            if isinstance(item, dict):
-                name = item.get("name") or item.get("path") or item.get("id")
-            else:
-                name = str(item)
-            if not name:
-                continue
-
-            # normalize object_path and filename like your original logic
-            if name.startswith(str(current_user.id) + "/"):
-                object_path = name
-                filename = "/".join(name.split("/")[2:])
-            else:
-                if name.startswith(book_id + "/"):
-                    object_path = f"{current_user.id}/{name}"
-                    filename = "/".join(name.split("/")[1:])
-                elif name.startswith(book_id):
-                    parts = name.split("/", 1)
-                    filename = parts[1] if len(parts) > 1 else ""
-                    object_path = f"{current_user.id}/{name}"
-                else:
-                    object_path = f"{prefix}/{name.split('/')[-1]}"
-                    filename = name.split("/")[-1]
-
-            if not filename:
-                # folder entry -> skip
-                continue
-
-            # Download bytes (same fallback logic)
-            file_bytes = get_bytes_from_supabase_object(object_path)
-            if not file_bytes:
-                logger.error("Failed to get bytes for %s", object_path)
-                failed[book_id].append(object_path)
-                continue
-
-            # safety: check total bytes limit if configured
-            total_bytes_accum += len(file_bytes)
-            if MAX_TOTAL_BYTES and total_bytes_accum > MAX_TOTAL_BYTES:
-                logger.error("Export exceeded MAX_TOTAL_BYTES (%s bytes)", MAX_TOTAL_BYTES)
-                raise HTTPException(status_code=413, detail="Requested files exceed maximum allowed total size")
-
-            # infer mime
-            mime_type, _ = mimetypes.guess_type(filename)
-            if not mime_type:
-                mime_type = "application/octet-stream"
-
-            # encode base64
-            try:
-                b64 = base64.b64encode(file_bytes).decode("ascii")
-            except Exception:
-                logger.exception("Failed base64-encoding %s", object_path)
-                failed[book_id].append(object_path)
-                continue
-
-            files_out.append({
-                "book_id": book_id,
-                "filename": Path(filename).name,
-                "mime": mime_type,
-                "b64": b64,
-                "size_bytes": len(file_bytes),
-            })
-
-    return JSONResponse(content={
-        "status": "done",
-        "files": files_out,
-        "failed": failed,
-        "total_bytes": total_bytes_accum,
-    })
\ No newline at end of file
+            logger.exception("Blob cache lookup failed for %s; reading from storage", entry["object_path"])
+            cached = None
+        if cached is not None:
+            # warm: served from disk (sendfile where the server supports it); FileResponse handles Range itself
+            return FileResponse(cached, media_type=entry["mime"], filename=entry["filename"], headers=headers)
+        range_header = request.headers.get("range")
+        try:
+            resp = await open_object(client, bucket_name, entry["object_path"], range_header)
+        except StorageError as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+        headers.update({
+            "Content-Disposition": _content_disposition(entry["filename"]),
+            "Accept-Ranges": "bytes",
+        })
+        for name in ("Content-Length", "Content-Range", "ETag", "Last-Modified"):
+            if name in resp.headers:
+                headers[name] = resp.headers[name]
+
+        # cold: stream from storage, keeping a copy of full (non-Range) reads for next time
+        writer = _BLOB_CACHE.writer(entry["object_path"], entry["version"]) if resp.status_code == 200 else None
+        return StreamingResponse(tee_object(resp, writer), status_code=resp.status_code, media_type=entry["mime"],
+                                 headers=headers)
+
+    archive = f"{book_ids[0]}.zip" if len(book_ids) == 1 else "books.zip"
+    headers.update({"Content-Disposition": _content_disposition(archive), "Accept-Ranges": "none"})
+    return StreamingResponse(zip_stream(client, bucket_name, entries, failed, cache=_BLOB_CACHE),
+                             media_type="application/zip", headers=headers)
+
+
+@router.get("/{book_id}/file")
+async def book_file(
+    book_id: str,
+    extensions: Optional[List[str]] = Query(None, description="Only these file types, e.g. ?extensions=pdf"),
+    redirect: bool = Query(True, description="302 to the signed URL when exactly one file matches"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    GET /documents/{book_id}/file
+    Short-lived signed storage URLs for the files of one of the caller's books, so the client downloads
+    straight from storage: a 302 redirect when exactly one file matches (and redirect=true), otherwise
+    JSON {"files": [{"filename", "mime", "size_bytes", "url"}, ...], "expires_in": ...}.
+    """
+    doc = _get_owned_document(db, book_id, current_user)
+    bucket_name = SUPABASE_BUCKET or DEFAULT_BUCKET
+    client = storage_client()
+    entries, failed = await _list_books(client, bucket_name, current_user.id, [str(doc.id)], extensions)
+    if not entries:
+        raise HTTPException(status_code=404, detail={"message": "No files found", "failed": failed})
+
+    files = await _signed_files(client, bucket_name, entries, failed)
+    if not files:
+        raise HTTPException(status_code=502, detail={"message": "Could not sign download URLs", "failed": failed})
+    if redirect and len(files) == 1:
+        return RedirectResponse(files[0]["url"], status_code=302, headers={"Cache-Control": "no-store"})
+    return {"book_id": str(doc.id), "expires_in": STORAGE_SIGNED_URL_TTL_SECONDS, "files": files, "failed": failed}
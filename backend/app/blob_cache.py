@@ -0,0 +1,182 @@
+# app/blob_cache.py
+"""
+On-disk read-through cache of Supabase Storage objects for the download endpoints.
+
+Objects are stored as plain files (so a warm download is a FileResponse / sendfile) and indexed in
+SQLite by sha256(object path + version), where version is the ETag (or updated_at) reported by the
+storage listing: a re-uploaded object gets a new key, so a stale copy is never served even if an
+explicit invalidate() was missed (e.g. another API process did the upload). Total stored bytes are
+capped at `max_bytes`; least recently used objects are evicted first.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+import aiofiles
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class BlobCache:
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._metrics = {"hits": 0, "misses": 0, "fills": 0, "hit_bytes": 0, "fill_bytes": 0,
+                         "evictions": 0, "invalidations": 0}
+        if max_bytes > 0:
+            (self.root / "objects").mkdir(parents=True, exist_ok=True)
+            # partial copies left behind by a crash mid-download
+            for part in (self.root / "objects").glob("*.part"):
+                if part.stat().st_mtime < time.time() - 3600:
+                    part.unlink(missing_ok=True)
+            self._conn = sqlite3.connect(str(self.root / "index.sqlite3"), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " key TEXT PRIMARY KEY, object_path TEXT NOT NULL, version TEXT NOT NULL,"
+                " size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_lru ON blobs (last_access)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_path ON blobs (object_path)")
+            self._conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self._conn is not None
+
+    @staticmethod
+    def make_key(object_path: str, version: str) -> str:
+        return hashlib.sha256(f"{object_path}\0{version}".encode("utf-8")).hexdigest()
+
+    def _file(self, key: str) -> Path:
+        return self.root / "objects" / key
+
+    def lookup(self, object_path: str, version: Optional[str]) -> Optional[Path]:
+        """Path of the cached copy of this object version (counted as a hit), or None (a miss)."""
+        if self._conn is None or not version:
+            return None
+        key = self.make_key(object_path, version)
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM blobs WHERE key = ?", (key,)).fetchone()
+            path = self._file(key)
+            if row is None or not path.exists():
+                if row is not None:  # file removed behind our back
+                    self._conn.execute("DELETE FROM blobs WHERE key = ?", (key,))
+                    self._conn.commit()
+                self._metrics["misses"] += 1
+                return None
+            self._conn.execute("UPDATE blobs SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self._metrics["hits"] += 1
+            self._metrics["hit_bytes"] += row[0]
+        return path
+
+    def writer(self, object_path: str, version: Optional[str]) -> Optional["BlobWriter"]:
+        """A BlobWriter that fills the cache while the object is streamed, or None when caching is off."""
+        if self._conn is None or not version:
+            return None
+        return BlobWriter(self, object_path, version)
+
+    def _commit(self, object_path: str, version: str, tmp: Path, size: int):
+        key = self.make_key(object_path, version)
+        if size > self.max_bytes:
+            tmp.unlink(missing_ok=True)
+            return
+        os.replace(tmp, self._file(key))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (key, object_path, version, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, object_path, version, size, time.time()),
+            )
+            self._metrics["fills"] += 1
+            self._metrics["fill_bytes"] += size
+            # older versions of the same object can never be served again
+            stale = [r[0] for r in self._conn.execute(
+                "SELECT key FROM blobs WHERE object_path = ? AND key != ?", (object_path, key)).fetchall()]
+            self._delete(stale)
+            self._metrics["invalidations"] += len(stale)
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total > self.max_bytes:
+                # evict least recently used objects until we are back under the cap
+                rows = self._conn.execute("SELECT key, size FROM blobs ORDER BY last_access").fetchall()
+                evict = []
+                for k, sz in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evict.append(k)
+                    total -= sz
+                self._delete(evict)
+                self._metrics["evictions"] += len(evict)
+            self._conn.commit()
+
+    def _delete(self, keys):
+        self._conn.executemany("DELETE FROM blobs WHERE key = ?", [(k,) for k in keys])
+        for k in keys:
+            self._file(k).unlink(missing_ok=True)
+
+    def invalidate(self, prefix: str) -> int:
+        """Drop every cached object whose path starts with `prefix` (an object path or '<user>/<book>/')."""
+        if self._conn is None:
+            return 0
+        with self._lock:
+            like = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            keys = [r[0] for r in self._conn.execute(
+                "SELECT key FROM blobs WHERE object_path LIKE ? ESCAPE '\\'", (like,)).fetchall()]
+            self._delete(keys)
+            self._conn.commit()
+            self._metrics["invalidations"] += len(keys)
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        if self._conn is None:
+            return {"enabled": False}
+        with self._lock:
+            entries, stored = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            metrics = dict(self._metrics)
+        lookups = metrics["hits"] + metrics["misses"]
+        return {"enabled": True, "entries": entries, "stored_bytes": stored, "max_bytes": self.max_bytes,
+                "hit_ratio": round(metrics["hits"] / lookups, 4) if lookups else 0.0, **metrics}
+
+
+class BlobWriter:
+    """
+    Tee for a streamed object: write() each chunk, then commit() a complete copy or abort() a partial one.
+    The index update, rename and evictions of commit() run in the threadpool, off the event loop.
+    """
+
+    def __init__(self, cache: BlobCache, object_path: str, version: str):
+        self.cache = cache
+        self.object_path = object_path
+        self.version = version
+        self.size = 0
+        self._tmp = cache.root / "objects" / f"{uuid.uuid4().hex}.part"
+        self._fh = None
+
+    async def write(self, chunk: bytes):
+        if self._fh is None:
+            self._fh = await aiofiles.open(self._tmp, "wb")
+        await self._fh.write(chunk)
+        self.size += len(chunk)
+
+    async def commit(self):
+        if self._fh is None:
+            self._fh = await aiofiles.open(self._tmp, "wb")  # empty object
+        await self._fh.close()
+        try:
+            await run_in_threadpool(self.cache._commit, self.object_path, self.version, self._tmp, self.size)
+        except Exception:
+            logger.exception("Failed to add %s to the blob cache", self.object_path)
+            await run_in_threadpool(self._tmp.unlink, missing_ok=True)
+
+    async def abort(self):
+        if self._fh is not None:
+            await self._fh.close()
+        await run_in_threadpool(self._tmp.unlink, missing_ok=True)
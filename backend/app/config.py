@@ -18,6 +18,14 @@ POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET_NAME")
+# Streaming reads from Supabase Storage (app/storage.py)
+STORAGE_CHUNK_SIZE = int(os.getenv("STORAGE_CHUNK_SIZE", 256 * 1024))
+STORAGE_TIMEOUT_SECONDS = float(os.getenv("STORAGE_TIMEOUT_SECONDS", 60))
+STORAGE_MAX_CONNECTIONS = int(os.getenv("STORAGE_MAX_CONNECTIONS", 32))  # shared pooled HTTP client
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", 8))  # objects fetched at once per export
+EXPORT_PREFETCH_BYTES = int(os.getenv("EXPORT_PREFETCH_BYTES", 4 * 1024 * 1024))  # read-ahead buffer per object
+STORAGE_SIGNED_URL_TTL_SECONDS = int(os.getenv("STORAGE_SIGNED_URL_TTL_SECONDS", 300))  # signed download links
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", 2 * 1024 ** 3))  # on-disk download cache; 0 disables
 
 # Final SQLAlchemy URL used by db.py
 SQLALCHEMY_DATABASE_URL = os.getenv("SUPABASE_POSTGRESS_URL")  # or build from POSTGRES_* if you prefer local
@@ -26,6 +34,8 @@ SQLALCHEMY_DATABASE_URL = os.getenv("SUPABASE_POSTGRESS_URL")  # or build from P
 SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_THIS_TO_SOMETHING_SECURE")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+AUTH_USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", 30))  # get_current_user cache
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", 1024))  # cached users; 0 disables the cache
 
 # CORS
 cors_origins_raw = os.getenv("CORS_ORIGINS", "")
@@ -36,11 +46,19 @@ CORS_ORIGINS = [origin.strip() for origin in cors_origins_raw.split(",") if orig
 MEILI_URL = os.getenv("MEILI_URL", "http://192.168.2.15:7700")
 MEILI_MASTER_KEY = os.getenv("MEILI_MASTER_KEY")
 MEILI_INDEX_NAME = os.getenv("MEILI_INDEX_NAME", "handwritten_notes")
+MEILI_INDEX_BATCH_SIZE = int(os.getenv("MEILI_INDEX_BATCH_SIZE", 500))  # documents per add_documents task
+MEILI_TASK_TIMEOUT_SECONDS = float(os.getenv("MEILI_TASK_TIMEOUT_SECONDS", 120))
 
 # Gemini API Key
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL")
 
+# Background OCR job queue
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", 2))  # in-process workers draining the ocr_jobs table
+OCR_JOB_POLL_SECONDS = float(os.getenv("OCR_JOB_POLL_SECONDS", 2.0))
+OCR_JOB_LEASE_SECONDS = int(os.getenv("OCR_JOB_LEASE_SECONDS", 600))  # re-claim jobs whose worker died
+OCR_JOB_MAX_ATTEMPTS = int(os.getenv("OCR_JOB_MAX_ATTEMPTS", 3))
+
 # ElevenLabs API Key
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID")
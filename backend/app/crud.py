@@ -1,7 +1,14 @@
 # app/crud.py
+import threading
+import time
+from collections import OrderedDict
 from uuid import UUID
+from typing import List, Dict, Any, Tuple
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
-from .models import User
+from .models import User, Document, OCRJob
+from .db import engine
+from .config import AUTH_USER_CACHE_TTL_SECONDS, AUTH_USER_CACHE_SIZE
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import logging
 
@@ -24,6 +31,68 @@ def get_user_by_id(db: Session, uid):
     return db.query(User).filter(User.id == uid_val).first()
 
 
+# ---------------- resolved-user cache (get_current_user) ----------------
+# user id -> (expires at, detached User). Users that do not exist are never cached, so a new account is
+# visible at once. Nothing in the API updates or deletes users; a change made directly in the database
+# (password, deletion) reaches authenticated requests within AUTH_USER_CACHE_TTL_SECONDS.
+_USER_CACHE = OrderedDict()
+_USER_CACHE_LOCK = threading.Lock()
+_USER_CACHE_TTL = AUTH_USER_CACHE_TTL_SECONDS
+_USER_CACHE_SIZE = AUTH_USER_CACHE_SIZE
+_USER_CACHE_METRICS = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+
+def get_cached_user(db: Session, uid: UUID):
+    """
+    get_user_by_id behind a short-TTL, size-bounded LRU cache. The returned User is detached from
+    `db` (only its loaded columns are available) and shared between requests: treat it as read-only.
+    """
+    now = time.monotonic()
+    with _USER_CACHE_LOCK:
+        cached = _USER_CACHE.get(uid)
+        if cached is not None and cached[0] > now:
+            _USER_CACHE.move_to_end(uid)
+            _USER_CACHE_METRICS["hits"] += 1
+            return cached[1]
+        if cached is not None:
+            del _USER_CACHE[uid]
+            _USER_CACHE_METRICS["expired"] += 1
+        _USER_CACHE_METRICS["misses"] += 1
+        enabled = _USER_CACHE_SIZE > 0 and _USER_CACHE_TTL > 0
+
+    user = get_user_by_id(db, uid)
+    if user is None or not enabled:
+        return user
+    db.expunge(user)  # keep it usable after this request's session commits or closes
+    with _USER_CACHE_LOCK:
+        _USER_CACHE[uid] = (now + _USER_CACHE_TTL, user)
+        _USER_CACHE.move_to_end(uid)
+        while len(_USER_CACHE) > _USER_CACHE_SIZE:
+            _USER_CACHE.popitem(last=False)
+            _USER_CACHE_METRICS["evictions"] += 1
+    return user
+
+
+def configure_user_cache(ttl_seconds: float, max_entries: int):
+    """Change the cache limits at runtime (benchmarks, tests); clears the cache and its counters."""
+    global _USER_CACHE_TTL, _USER_CACHE_SIZE
+    with _USER_CACHE_LOCK:
+        _USER_CACHE_TTL, _USER_CACHE_SIZE = ttl_seconds, max_entries
+        _USER_CACHE.clear()
+        for k in _USER_CACHE_METRICS:
+            _USER_CACHE_METRICS[k] = 0
+
+
+def user_cache_stats() -> Dict[str, Any]:
+    with _USER_CACHE_LOCK:
+        metrics = dict(_USER_CACHE_METRICS)
+        entries = len(_USER_CACHE)
+    lookups = metrics["hits"] + metrics["misses"]
+    return {"enabled": _USER_CACHE_SIZE > 0 and _USER_CACHE_TTL > 0, "entries": entries,
+            "max_entries": _USER_CACHE_SIZE, "ttl_seconds": _USER_CACHE_TTL,
+            "hit_ratio": round(metrics["hits"] / lookups, 4) if lookups else 0.0, **metrics}
+
+
 def create_user(db, email: str, password: str, name: str):
     try:
         user = User(email=email, password=password, name=name)
@@ -36,3 +105,69 @@ def create_user(db, email: str, password: str, name: str):
         logger.exception("create_user failed")
         # re-raise so caller can inspect, or return an error object
         raise
+
+
+# ---------------- book catalog ----------------
+_CATALOG_COLUMNS = {"name": "VARCHAR", "page_count": "INTEGER DEFAULT 0", "size_bytes": "BIGINT DEFAULT 0"}
+
+
+def ensure_document_catalog():
+    """Add the catalog columns and the (user_id, upload_date) index to an existing documents table."""
+    existing = {c["name"] for c in inspect(engine).get_columns(Document.__tablename__)}
+    with engine.begin() as conn:
+        for column, ddl in _CATALOG_COLUMNS.items():
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {Document.__tablename__} ADD COLUMN {column} {ddl}"))
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_documents_user_upload ON {Document.__tablename__} (user_id, upload_date)"))
+
+
+def _active_books(db: Session, user_id):
+    return (
+        db.query(Document)
+        .filter(Document.user_id == user_id, Document.is_active.isnot(False))
+        .order_by(Document.upload_date, Document.id)
+    )
+
+
+def user_books(db: Session, user_id) -> List[Document]:
+    return _active_books(db, user_id).all()
+
+
+def user_book_ids(db: Session, user_id) -> List[str]:
+    return [str(book_id) for (book_id,) in _active_books(db, user_id).with_entities(Document.id).all()]
+
+
+def book_status(doc: Document, latest_job_status=None) -> str:
+    """queued / running while a job is active, else ready (OCR done), failed, or pending (no job yet)."""
+    if latest_job_status in ("queued", "running"):
+        return latest_job_status
+    if doc.ocr_status:
+        return "ready"
+    return "failed" if latest_job_status == "failed" else "pending"
+
+
+def list_user_books(db: Session, user_id, limit: int = 20, offset: int = 0) -> Tuple[int, List[Dict[str, Any]]]:
+    """One page of the user's books (oldest first) as catalog dicts, plus the total count."""
+    query = _active_books(db, user_id)
+    total = query.count()
+    docs = query.offset(offset).limit(limit).all()
+    latest: Dict[Any, Any] = {}
+    if docs:
+        # one query for the latest job of every book on this page
+        jobs = (
+            db.query(OCRJob.document_id, OCRJob.status)
+            .filter(OCRJob.document_id.in_([d.id for d in docs]))
+            .order_by(OCRJob.created_at)
+            .all()
+        )
+        latest = {document_id: status for document_id, status in jobs}
+    books = [{
+        "book_id": str(d.id),
+        "name": d.name or d.filename.rsplit("/", 1)[-1].rsplit(".", 1)[0],
+        "page_count": d.page_count or 0,
+        "size_bytes": d.size_bytes or 0,
+        "status": book_status(d, latest.get(d.id)),
+        "upload_date": d.upload_date.isoformat() if d.upload_date else None,
+    } for d in docs]
+    return total, books
@@ -7,7 +7,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from .schemas import TokenData
-from .crud import get_user_by_id
+from .crud import get_cached_user
 from .db import get_db
 from .auth_utils import decode_access_token
 
@@ -35,7 +35,8 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except Exception:
         raise credentials_exception
 
-    user = get_user_by_id(db, user_uuid)
+    # cached for AUTH_USER_CACHE_TTL_SECONDS, so bursts of requests (search-as-you-type) skip the DB
+    user = get_cached_user(db, user_uuid)
     if user is None:
         raise credentials_exception
 
@@ -0,0 +1,244 @@
+# app/jobs.py
+"""
+Durable OCR job queue backed by the `ocr_jobs` Postgres table.
+
+The upload endpoint enqueues a job and returns immediately; in-process workers
+(see documents.start_ocr_workers) claim jobs with SELECT ... FOR UPDATE SKIP LOCKED,
+so several API processes can drain the same table without double-processing.
+A claimed job holds a lease (`locked_until`) that is refreshed on every page; if a
+worker dies, the lease expires and another worker picks the job up again.
+
+All helpers here are synchronous and open their own short-lived session, so call
+them through run_in_threadpool from async code.
+"""
+import datetime
+import logging
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import or_, and_
+
+from .db import SessionLocal, engine
+from .models import OCRJob
+from .config import OCR_JOB_LEASE_SECONDS, OCR_JOB_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _lease_expiry() -> datetime.datetime:
+    return _now() + datetime.timedelta(seconds=OCR_JOB_LEASE_SECONDS)
+
+
+def ensure_jobs_table():
+    """Create the ocr_jobs table if it does not exist yet (other tables are managed elsewhere)."""
+    OCRJob.__table__.create(bind=engine, checkfirst=True)
+
+
+def enqueue_job(db, document_id, user_id, book_name: Optional[str], local_path: Optional[str],
+                pages: Optional[List[int]] = None, source_path: Optional[str] = None,
+                page_offset: int = 0) -> OCRJob:
+    job = OCRJob(
+        document_id=document_id,
+        user_id=user_id,
+        book_name=book_name,
+        local_path=local_path,
+        pages=pages,
+        source_path=source_path,
+        page_offset=page_offset,
+        status=JOB_QUEUED,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def claim_next_job() -> Optional[Dict[str, Any]]:
+    """
+    Atomically claim the oldest queued job (or a running job whose lease expired).
+    Returns a plain dict snapshot of the job, or None if the queue is empty.
+    """
+    db = SessionLocal()
+    try:
+        now = _now()
+        job = (
+            db.query(OCRJob)
+            .filter(or_(
+                OCRJob.status == JOB_QUEUED,
+                and_(OCRJob.status == JOB_RUNNING, OCRJob.locked_until < now),
+            ))
+            .order_by(OCRJob.created_at)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None:
+            db.rollback()
+            return None
+
+        job.attempts = (job.attempts or 0) + 1
+        if job.attempts > OCR_JOB_MAX_ATTEMPTS:
+            job.status = JOB_FAILED
+            job.error = "exceeded_max_attempts"
+            job.finished_at = now
+            job.locked_until = None
+            db.commit()
+            logger.error("OCR job %s exceeded max attempts; marked failed", job.id)
+            return None
+
+        job.status = JOB_RUNNING
+        job.started_at = job.started_at or now
+        job.locked_until = _lease_expiry()
+        job.pages_done = 0
+        job.pages_failed = 0
+        job.failed_pages = []
+        db.commit()
+        return {
+            "id": job.id,
+            "document_id": job.document_id,
+            "user_id": job.user_id,
+            "book_name": job.book_name,
+            "local_path": job.local_path,
+            "pages": job.pages,
+            "source_path": job.source_path,
+            "page_offset": job.page_offset or 0,
+            "attempts": job.attempts,
+        }
+    except Exception:
+        db.rollback()
+        logger.exception("Failed to claim OCR job")
+        return None
+    finally:
+        db.close()
+
+
+def update_job_progress(job_id, total_pages: Optional[int] = None, page_ok: Optional[bool] = None,
+                        page_number: Optional[int] = None):
+    """Record one finished page (and/or the page total) and refresh the worker lease."""
+    db = SessionLocal()
+    try:
+        job = db.query(OCRJob).filter(OCRJob.id == job_id).first()
+        if job is None:
+            return
+        if total_pages is not None:
+            job.total_pages = total_pages
+        if page_ok is True:
+            job.pages_done = (job.pages_done or 0) + 1
+        elif page_ok is False:
+            job.pages_failed = (job.pages_failed or 0) + 1
+            failed: List[int] = list(job.failed_pages or [])
+            if page_number is not None:
+                failed.append(page_number)
+            job.failed_pages = failed
+        job.locked_until = _lease_expiry()
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Failed to update progress for OCR job %s", job_id)
+    finally:
+        db.close()
+
+
+def finish_job(job_id, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+    db = SessionLocal()
+    try:
+        job = db.query(OCRJob).filter(OCRJob.id == job_id).first()
+        if job is None:
+            return
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = _now()
+        job.locked_until = None
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Failed to finish OCR job %s", job_id)
+    finally:
+        db.close()
+
+
+def release_job(job_id, error: Optional[str] = None):
+    """Put a job back on the queue (e.g. after a transient failure) so another worker retries it."""
+    db = SessionLocal()
+    try:
+        job = db.query(OCRJob).filter(OCRJob.id == job_id).first()
+        if job is None:
+            return
+        job.status = JOB_QUEUED
+        job.error = error
+        job.locked_until = None
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Failed to release OCR job %s", job_id)
+    finally:
+        db.close()
+
+
+def active_job_for_document(db, document_id) -> Optional[OCRJob]:
+    return (
+        db.query(OCRJob)
+        .filter(OCRJob.document_id == document_id, OCRJob.status.in_([JOB_QUEUED, JOB_RUNNING]))
+        .first()
+    )
+
+
+def latest_job_for_document(db, document_id) -> Optional[OCRJob]:
+    return (
+        db.query(OCRJob)
+        .filter(OCRJob.document_id == document_id)
+        .order_by(OCRJob.created_at.desc())
+        .first()
+    )
+
+
+def book_parts(db, document_id, legacy_pages: int = 0) -> List[Dict[str, Any]]:
+    """
+    The PDF parts a book was built from (initial upload + appended pages), ordered by page offset:
+    [{"source_path": ..., "page_offset": ..., "total_pages": ...}, ...]. source_path None = Document.filename.
+    Books uploaded before OCR jobs were recorded have no job for their original PDF: it becomes a part at
+    offset 0 covering the pages before the first recorded part, or `legacy_pages` when none is recorded.
+    """
+    parts: Dict[Any, Dict[str, Any]] = {}
+    for job in db.query(OCRJob).filter(OCRJob.document_id == document_id, OCRJob.total_pages > 0).all():
+        key = (job.source_path, job.page_offset or 0)
+        parts[key] = {"source_path": job.source_path, "page_offset": job.page_offset or 0,
+                      "total_pages": job.total_pages}
+    ordered = sorted(parts.values(), key=lambda p: p["page_offset"])
+    first = ordered[0]["page_offset"] if ordered else legacy_pages
+    if first > 0:
+        ordered.insert(0, {"source_path": None, "page_offset": 0, "total_pages": first})
+    return ordered
+
+
+def book_page_count(db, document_id, legacy_pages: int = 0) -> int:
+    return max((p["page_offset"] + p["total_pages"] for p in book_parts(db, document_id, legacy_pages)), default=0)
+
+
+def job_to_dict(job: OCRJob) -> Dict[str, Any]:
+    total = job.total_pages or 0
+    processed = (job.pages_done or 0) + (job.pages_failed or 0)
+    return {
+        "job_id": str(job.id),
+        "book_id": str(job.document_id),
+        "status": job.status,
+        "total_pages": total,
+        "pages_done": job.pages_done or 0,
+        "pages_failed": job.pages_failed or 0,
+        "failed_pages": sorted(job.failed_pages or []),
+        "progress": round(processed / total, 4) if total else 0.0,
+        "attempts": job.attempts or 0,
+        "error": job.error,
+        "result": job.result,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -7,6 +7,9 @@ from .api_routes import elevenlabs
 from .config import CORS_ORIGINS
 from .models import Base
 from .db import engine
+from .crud import ensure_document_catalog
+from .storage import close_client as close_storage_client
+from async_batch_pdf import shutdown_executors
 import os
 
 app = FastAPI(title="Pen and Paper")
@@ -19,6 +22,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # let the browser read the download headers (file name, ranges, partial failures)
+    expose_headers=["Content-Disposition", "Content-Range", "Accept-Ranges", "X-Download-Failed"],
 )
 
 app.include_router(auth.router)
@@ -32,6 +37,25 @@ app.include_router(elevenlabs.router)
 #     Base.metadata.create_all(bind=engine)
 
 
+@app.on_event("startup")
+def upgrade_schema():
+    # catalog columns / index on documents (no migration tool); runs whether or not OCR workers are enabled
+    ensure_document_catalog()
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    # drain the ocr_jobs queue filled by /documents/upload
+    await documents.start_ocr_workers()
+
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await documents.stop_ocr_workers()
+    await close_storage_client()
+    shutdown_executors()
+
+
 @app.get("/")
 def root():
     return {"ok": True, "msg": "Pen & Paper API"}
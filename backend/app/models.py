@@ -1,6 +1,6 @@
 # app/models.py
 import uuid
-from sqlalchemy import Column, String, DateTime, func, ForeignKey, Boolean
+from sqlalchemy import Column, String, DateTime, func, ForeignKey, Boolean, Integer, BigInteger, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID  # <-- Postgres UUID type
 
@@ -26,3 +26,34 @@ class Document(Base):
     upload_date = Column(DateTime(timezone=True), server_default=func.now())
     ocr_status = Column(Boolean, nullable=False, default=False)  # True if OCR completed successfully
     is_active = Column(Boolean, default=True)  # Soft delete flag
+    # book catalog, kept current by upload / append / OCR (columns added by crud.ensure_document_catalog)
+    name = Column(String, nullable=True)  # display name given at upload
+    page_count = Column(Integer, nullable=True, default=0)
+    size_bytes = Column(BigInteger, nullable=True, default=0)  # all uploaded PDF parts
+
+    __table_args__ = (Index("ix_documents_user_upload", "user_id", "upload_date"),)
+
+
+class OCRJob(Base):
+    __tablename__ = "ocr_jobs"
+
+    id = Column(PG_UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    document_id = Column(PG_UUID(as_uuid=True), ForeignKey("documents.id"), nullable=False, index=True)
+    user_id = Column(PG_UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued | running | done | failed
+    book_name = Column(String, nullable=True)
+    local_path = Column(String, nullable=True)  # PDF saved by the upload endpoint; re-downloaded if missing
+    pages = Column(JSON, nullable=True)  # page numbers to force re-processing (retry-failed); null = resume/all
+    source_path = Column(String, nullable=True)  # storage path of the PDF part to OCR; null = Document.filename
+    page_offset = Column(Integer, nullable=False, default=0)  # >0 for pages appended to an existing book
+    total_pages = Column(Integer, nullable=False, default=0)
+    pages_done = Column(Integer, nullable=False, default=0)
+    pages_failed = Column(Integer, nullable=False, default=0)
+    failed_pages = Column(JSON, nullable=True)  # list of page numbers that exhausted retries
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    result = Column(JSON, nullable=True)  # final summary (same shape as the old synchronous upload response)
+    locked_until = Column(DateTime(timezone=True), nullable=True)  # worker lease; expired leases are re-claimed
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -61,6 +61,10 @@ class DownloadRequest(BaseModel):
     book_ids: List[str] = Field(..., min_items=1, description="List of book_id folder names to download")
     # optional target path under the server DOWNLOAD_BASE_DIR (relative). If omitted uses default downloads dir.
     target_path: Optional[str] = Field(None, description="Optional relative sub-path under server download base")
+    format: str = Field("auto", pattern="^(auto|zip|raw|signed)$",
+                        description="'raw' streams a single file, 'zip' an archive, 'auto' = raw when exactly "
+                                    "one file; 'signed' returns short-lived storage URLs instead of the bytes")
+    extensions: Optional[List[str]] = Field(None, description="Only include files with these extensions, e.g. ['pdf']")
 
 
 class TTSRequest(BaseModel):
@@ -0,0 +1,303 @@
+# app/storage.py
+"""
+Streaming reads from Supabase Storage.
+
+supabase-py's storage.download() returns a whole object as bytes. The helpers here talk to the
+Storage REST API with httpx instead, so an object is read STORAGE_CHUNK_SIZE bytes at a time,
+HTTP Range requests are passed through, and files can be streamed to the client one by one or
+as a ZIP built on the fly (zip_stream) with bounded memory, whatever the export size.
+All requests share one pooled client (get_client); exports list folders and fetch objects
+EXPORT_CONCURRENCY at a time. sign_urls hands out short-lived signed URLs instead, so clients
+download straight from storage and no bytes pass through the API server. Reads can go through
+an on-disk BlobCache (app/blob_cache.py): read_through / tee_object serve warm objects from disk
+and fill the cache while streaming cold ones.
+"""
+import asyncio
+import json
+import logging
+import time
+import zipfile
+from typing import Optional, Dict, Any, List, AsyncIterator
+from urllib.parse import quote
+
+import aiofiles
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from .config import (
+    SUPABASE_URL, SUPABASE_KEY, STORAGE_CHUNK_SIZE, STORAGE_TIMEOUT_SECONDS, STORAGE_MAX_CONNECTIONS,
+    EXPORT_CONCURRENCY, EXPORT_PREFETCH_BYTES, STORAGE_SIGNED_URL_TTL_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# already-compressed formats are stored as-is; deflating them costs CPU for nothing
+_STORED_MIME_PREFIXES = ("application/pdf", "image/", "application/zip")
+
+# one pooled client for the whole process (keep-alive connections are reused across requests)
+_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+class StorageError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def object_url(bucket: str, path: str) -> str:
+    return f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/{quote(bucket)}/{quote(path)}"
+
+
+def _auth_headers() -> Dict[str, str]:
+    key = (SUPABASE_KEY or "").strip()
+    return {"Authorization": f"Bearer {key}", "apikey": key}
+
+
+def get_client() -> httpx.AsyncClient:
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        limits = httpx.Limits(max_connections=STORAGE_MAX_CONNECTIONS,
+                              max_keepalive_connections=STORAGE_MAX_CONNECTIONS)
+        _CLIENT = httpx.AsyncClient(timeout=STORAGE_TIMEOUT_SECONDS, headers=_auth_headers(), limits=limits)
+    return _CLIENT
+
+
+async def close_client():
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
+
+async def list_folder(client: httpx.AsyncClient, bucket: str, prefix: str,
+                      page_size: int = 1000) -> List[Dict[str, Any]]:
+    """All items directly under `prefix` (same shape as supabase-py's storage list()); raises StorageError."""
+    url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/list/{quote(bucket)}"
+    items: List[Dict[str, Any]] = []
+    while True:
+        payload = {"prefix": prefix, "limit": page_size, "offset": len(items),
+                   "sortBy": {"column": "name", "order": "asc"}}
+        try:
+            resp = await client.post(url, json=payload)
+        except httpx.HTTPError as exc:
+            raise StorageError(502, f"storage list failed: {exc!r}")
+        if resp.status_code != 200:
+            raise StorageError(502, f"storage list returned {resp.status_code} for {prefix}")
+        page = resp.json()
+        items.extend(page)
+        if len(page) < page_size:
+            return items
+
+
+async def sign_urls(client: httpx.AsyncClient, bucket: str, paths: List[str],
+                    expires_in: int = STORAGE_SIGNED_URL_TTL_SECONDS,
+                    download_names: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Signed GET URLs valid for `expires_in` seconds, one storage request for all `paths`: {path: absolute url}.
+    With download_names ({path: filename}) storage serves the file as an attachment under that name.
+    Paths storage refused to sign are missing from the result; raises StorageError if the request fails.
+    """
+    url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/sign/{quote(bucket)}"
+    try:
+        resp = await client.post(url, json={"expiresIn": expires_in, "paths": paths})
+    except httpx.HTTPError as exc:
+        raise StorageError(502, f"storage sign failed: {exc!r}")
+    if resp.status_code != 200:
+        raise StorageError(502, f"storage sign returned {resp.status_code}")
+    signed: Dict[str, str] = {}
+    for item in resp.json():
+        if item.get("error") or not item.get("signedURL"):
+            logger.error("Storage refused to sign %s: %s", item.get("path"), item.get("error"))
+            continue
+        # signedURL is relative to the storage API root: /object/sign/<bucket>/<path>?token=...
+        link = f"{SUPABASE_URL.rstrip('/')}/storage/v1/{item['signedURL'].lstrip('/')}"
+        name = (download_names or {}).get(item["path"])
+        if name:
+            link += f"&download={quote(name)}"
+        signed[item["path"]] = link
+    return signed
+
+
+async def open_object(client: httpx.AsyncClient, bucket: str, path: str,
+                      range_header: Optional[str] = None) -> httpx.Response:
+    """
+    Start reading an object; returns the streaming response (200, or 206 for a Range request)
+    whose body the caller consumes with iter_object and must close (aclose).
+    Raises StorageError with the upstream status (404 missing, 416 bad range, ...).
+    """
+    headers = {"Range": range_header} if range_header else None
+    request = client.build_request("GET", object_url(bucket, path), headers=headers)
+    try:
+        resp = await client.send(request, stream=True)
+    except httpx.HTTPError as exc:
+        raise StorageError(502, f"storage request failed: {exc!r}")
+    if resp.status_code not in (200, 206):
+        await resp.aread()
+        await resp.aclose()
+        # Supabase reports a missing object as 400 with a JSON body
+        status = 404 if resp.status_code in (400, 404) else resp.status_code
+        raise StorageError(status, f"storage returned {resp.status_code} for {path}")
+    return resp
+
+
+async def iter_object(resp: httpx.Response) -> AsyncIterator[bytes]:
+    """Yield the body of an open_object response in STORAGE_CHUNK_SIZE chunks, then close it."""
+    try:
+        async for chunk in resp.aiter_bytes(STORAGE_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await resp.aclose()
+
+
+async def _drop_writer(writer):
+    try:
+        await writer.abort()
+    except Exception:
+        logger.exception("Failed to discard partial blob cache copy of %s", writer.object_path)
+
+
+async def tee_object(resp: httpx.Response, writer=None) -> AsyncIterator[bytes]:
+    """
+    iter_object that also copies the body into a BlobWriter; the copy is committed only if the whole body arrived.
+    A failing cache write (full disk, permissions) drops the copy but never the download.
+    """
+    complete = False
+    try:
+        async for chunk in iter_object(resp):
+            if writer is not None:
+                try:
+                    await writer.write(chunk)
+                except Exception:
+                    logger.exception("Blob cache write failed for %s; streaming without caching", writer.object_path)
+                    await _drop_writer(writer)
+                    writer = None
+            yield chunk
+        complete = True
+    finally:
+        if writer is not None:
+            if complete:
+                try:
+                    await writer.commit()
+                except Exception:
+                    logger.exception("Blob cache commit failed for %s", writer.object_path)
+                    await _drop_writer(writer)
+            else:
+                await _drop_writer(writer)
+
+
+async def read_through(client: httpx.AsyncClient, bucket: str, entry: Dict[str, Any],
+                       cache=None) -> AsyncIterator[bytes]:
+    """Chunks of a download entry: from `cache` (BlobCache) when warm, else from storage while filling it."""
+    cached = None
+    if cache is not None:
+        try:
+            cached = await run_in_threadpool(cache.lookup, entry["object_path"], entry.get("version"))
+        except Exception:
+            logger.exception("Blob cache lookup failed for %s; reading from storage", entry["object_path"])
+            cache = None
+    if cached is not None:
+        try:
+            async with aiofiles.open(cached, "rb") as fh:
+                while True:
+                    chunk = await fh.read(STORAGE_CHUNK_SIZE)
+                    if not chunk:
+                        return
+                    yield chunk
+        except FileNotFoundError:
+            logger.warning("Cached copy of %s vanished (evicted); reading from storage", entry["object_path"])
+    resp = await open_object(client, bucket, entry["object_path"])
+    writer = cache.writer(entry["object_path"], entry.get("version")) if cache is not None else None
+    async for chunk in tee_object(resp, writer):
+        yield chunk
+
+
+class _ZipSink:
+    """Write-only, unseekable file object: zipfile appends to it, zip_stream drains it after each write."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._chunks)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _prefetch(client: httpx.AsyncClient, bucket: str, entry: Dict[str, Any], queue: asyncio.Queue,
+                    cache=None):
+    """Export worker: read one object into its bounded queue, then put None (done) or the exception that stopped it."""
+    try:
+        async for chunk in read_through(client, bucket, entry, cache):
+            await queue.put(chunk)
+        await queue.put(None)
+    except Exception as exc:
+        # anything else would end the worker silently and leave zip_stream waiting on this queue forever
+        logger.error("Export read of %s failed: %r", entry["object_path"], exc)
+        await queue.put(exc)
+
+
+async def zip_stream(client: httpx.AsyncClient, bucket: str, entries: List[Dict[str, Any]],
+                     failed: Dict[str, List[str]], concurrency: int = EXPORT_CONCURRENCY,
+                     cache=None) -> AsyncIterator[bytes]:
+    """
+    Stream a ZIP of `entries` ({"book_id", "object_path", "arcname", "mime", "size"}) read from storage.
+    `concurrency` workers fetch the next objects while earlier ones are being written, each into a queue
+    of at most EXPORT_PREFETCH_BYTES, so the export takes about as long as its slowest objects rather
+    than the sum of all of them, and memory stays bounded by concurrency * EXPORT_PREFETCH_BYTES.
+    Objects are read through `cache` (BlobCache) when given.
+    Members are written in order with data descriptors. Objects that cannot be read are added to
+    `failed[book_id]`; when anything failed, a failed.json listing `failed` is the last member.
+    """
+    queues = [asyncio.Queue(maxsize=max(1, EXPORT_PREFETCH_BYTES // STORAGE_CHUNK_SIZE)) for _ in entries]
+    pending = iter(range(len(entries)))  # shared by the workers, so they pick up entries in order
+
+    async def _worker():
+        for i in pending:
+            await _prefetch(client, bucket, entries[i], queues[i], cache)
+
+    workers = [asyncio.create_task(_worker()) for _ in range(min(max(1, concurrency), len(entries)))]
+    sink = _ZipSink()
+    zf = zipfile.ZipFile(sink, mode="w")
+    try:
+        for entry, queue in zip(entries, queues):
+            item = await queue.get()
+            if isinstance(item, Exception):
+                failed.setdefault(entry["book_id"], []).append(entry["object_path"])
+                continue
+            info = zipfile.ZipInfo(entry["arcname"], date_time=time.localtime()[:6])
+            stored = (entry.get("mime") or "").startswith(_STORED_MIME_PREFIXES)
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            size = entry.get("size")
+            if size is not None:
+                info.file_size = size
+            with zf.open(info, mode="w", force_zip64=size is None) as member:
+                while item is not None and not isinstance(item, Exception):
+                    member.write(item)
+                    if sink.pending:
+                        yield sink.drain()
+                    item = await queue.get()
+            if isinstance(item, Exception):
+                # the member is already (partly) in the archive; report it so the client can retry it
+                failed.setdefault(entry["book_id"], []).append(entry["object_path"])
+            if sink.pending:
+                yield sink.drain()
+
+        if any(failed.values()):
+            zf.writestr("failed.json", json.dumps({"failed": failed}, indent=2))
+    finally:
+        for task in workers:
+            task.cancel()
+        zf.close()
+    yield sink.drain()
@@ -1,20 +1,28 @@
 # async_batch_pdf.py
 import asyncio
+import collections
+import datetime
 import io
 import json
 import mimetypes
+import multiprocessing
 import os
 import random
+import hashlib
+import sqlite3
 import tempfile
+import threading
+import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Awaitable, Tuple
 
 from dotenv import load_dotenv
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from google import genai
 from google.genai import types
+from google.genai import errors as genai_errors
 from PIL import Image
 import io as _io  # you already had `import io`; using alias to avoid shadowing
 import logging
@@ -24,7 +32,9 @@ _logger = logging.getLogger(__name__)
 
 # import your preprocess helper functions from preprocessor.py
 # which should expose: simple_preprocess_page(pil_page, ...) and cv2_to_pil(img)
-from preprocessor import simple_preprocess_page, cv2_to_pil
+from preprocessor import (simple_preprocess_page, cv2_to_pil, page_to_shared_memory,
+                          preprocess_shared_page, encode_page_image, page_signals, hash_distance,
+                          embedded_images, page_sizes_inches, choose_page_dpi)
 
 # reuse your prompt module
 import prompt
@@ -40,17 +50,77 @@ client = genai.Client(api_key=GEMINI_API_KEY)
 
 MODEL_NAME = GEMINI_MODEL
 CONCURRENCY = 4
+RASTER_DPI = 300
+# Per-page DPI (see preprocessor.choose_page_dpi): "fixed" uses RASTER_DPI; "adaptive" renders scans at their embedded
+# image resolution and caps the pixel count of large pages, always within [RASTER_MIN_DPI, RASTER_MAX_DPI].
+# Adaptive is unmeasured (`benchmark.py dpi` has not been run on poppler yet) and stays opt-in until
+# `benchmark.py dpi --ocr` shows no accuracy loss: the preprocessing kernels are tuned for 300 DPI input.
+RASTER_DPI_MODE = os.getenv("OCR_RASTER_DPI_MODE", "fixed").lower()
+RASTER_MIN_DPI = int(os.getenv("OCR_RASTER_MIN_DPI", 150))
+RASTER_MAX_DPI = int(os.getenv("OCR_RASTER_MAX_DPI", RASTER_DPI))
+RASTER_MAX_PIXELS = int(float(os.getenv("OCR_RASTER_MAX_MEGAPIXELS", 9.0)) * 1_000_000)  # letter / A4 @300 fit
+PROMPT_ID = "prompt_9"  # attribute of prompt.py; part of the OCR cache key
+PROMPT_TEXT = getattr(prompt, PROMPT_ID)
 MAX_RETRIES = 3
 BASE_BACKOFF = 1.0
+UPLOAD_EXPIRY_MARGIN_SECONDS = 300  # re-upload a page file this long before the Files API expires it
+# Preprocessing profile (see preprocessor.simple_preprocess_page): quality (NLM denoise) | fast (median, in place)
+PREPROCESS_PROFILE = os.getenv("OCR_PREPROCESS_PROFILE", "quality").lower()
+# Pages above OCR_TILE_ABOVE_MEGAPIXELS are preprocessed as overlapping tiles (preprocessor.tiled_preprocess_page)
+TILE_ABOVE_PIXELS = int(float(os.getenv("OCR_TILE_ABOVE_MEGAPIXELS", 20)) * 1_000_000)  # 0 never tiles
+TILE_SIZE = int(os.getenv("OCR_TILE_SIZE", 1024))
+# Ruled-line removal (preprocessor.simple_preprocess_page): "projection" (fast) | "inpaint" (morphology +
+# cv2.inpaint, slow). Off by default: any dark horizontal run also takes out handwritten underlines and rules, and
+# `benchmark.py lines` only scores synthetic pages so far
+REMOVE_LINES = os.getenv("OCR_REMOVE_LINES", "0").lower() not in ("0", "false", "no")
+LINE_METHOD = os.getenv("OCR_LINE_METHOD", "projection").lower()
+# Page image encoding (see preprocessor.encode_page_image): png | png1 (1-bit) | webp (lossless)
+IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "png").lower()
+IMAGE_COMPRESS_LEVEL = int(os.getenv("OCR_IMAGE_COMPRESS_LEVEL", 6))
+IMAGE_MAX_LONG_EDGE = int(os.getenv("OCR_IMAGE_MAX_LONG_EDGE", 0))  # 0 keeps the rendered resolution
+ENCODE_KWARGS = {"fmt": IMAGE_FORMAT, "compress_level": IMAGE_COMPRESS_LEVEL, "max_long_edge": IMAGE_MAX_LONG_EDGE}
+IMAGE_MIME_TYPES = {"png": "image/png", "png1": "image/png", "webp": "image/webp"}
+IMAGE_MIME = IMAGE_MIME_TYPES.get(IMAGE_FORMAT, "image/png")
+# How page images reach the model: "auto" (inline when small enough), "inline" or "upload" (Files API)
+IMAGE_TRANSPORT = os.getenv("OCR_IMAGE_TRANSPORT", "auto").lower()
+INLINE_IMAGE_MAX_BYTES = int(os.getenv("OCR_INLINE_IMAGE_MAX_BYTES", 4 * 1024 * 1024))  # request cap is 20 MB
 OUTPUT_DIR = Path("llm_results")
 FAILED_DIR = OUTPUT_DIR / "failed_responses"
 MARKDOWN_OUTFILE = OUTPUT_DIR / "all_pages.md"
+OCR_CACHE_PATH = OUTPUT_DIR / "ocr_cache.sqlite3"
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", 512 * 1024 * 1024))  # 0 disables the cache
+# Pre-filter before any model call (see PageFilter): pages with less ink than this are blank ...
+BLANK_INK_RATIO = float(os.getenv("OCR_BLANK_INK_RATIO", 0.0002))  # 0 disables blank detection
+# ... and pages whose perceptual hash is within this many bits (of 256) of an earlier page of the same book
+# reuse its result; pages of the user's other books must match exactly (dHash near-matches of short pages,
+# e.g. "TODO" / "TOBO", are only ~13 bits apart)
+DUPLICATE_MAX_DISTANCE = int(os.getenv("OCR_DUPLICATE_MAX_DISTANCE", 10))  # -1 disables duplicate detection
+PAGE_HASHES_PATH = OUTPUT_DIR / "page_hashes.sqlite3"
 
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 FAILED_DIR.mkdir(parents=True, exist_ok=True)
 
-# ThreadPool executor for blocking work
-_EXECUTOR = ThreadPoolExecutor(max_workers=CONCURRENCY + 4)
+# Process-wide Gemini budget shared by every job (see AdaptiveLimiter); 0 = no RPM / TPM cap
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", 0))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", 0))
+GEMINI_MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", 1))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 16))
+EST_TOKENS_PER_PAGE = int(os.getenv("GEMINI_EST_TOKENS_PER_PAGE", 2000))  # corrected with usage_metadata
+
+# I/O (rendering, cache, journal) and CPU (OpenCV preprocessing) are sized independently; Gemini calls run
+# on GEMINI_LIMITER's own pool of GEMINI_MAX_CONCURRENCY threads.
+IO_WORKERS = int(os.getenv("OCR_IO_WORKERS", CONCURRENCY + 4))
+CV_WORKERS = int(os.getenv("OCR_CV_WORKERS", os.cpu_count() or 1))  # 0 -> preprocess on the I/O thread pool
+# threads per tiled page; pages already run CV_WORKERS at a time, so split the cores between them
+TILE_WORKERS = int(os.getenv("OCR_TILE_WORKERS", max(1, (os.cpu_count() or 1) // max(1, CV_WORKERS))))
+PREPROCESS_KWARGS = {"profile": PREPROCESS_PROFILE, "tile_above_pixels": TILE_ABOVE_PIXELS,
+                     "tile_size": TILE_SIZE, "tile_workers": TILE_WORKERS,
+                     "remove_lines": REMOVE_LINES, "line_method": LINE_METHOD}
+
+# ThreadPool executor for blocking I/O work
+_EXECUTOR = ThreadPoolExecutor(max_workers=IO_WORKERS)
+# ProcessPool for CPU-bound preprocessing; created on first use so importing this module stays cheap
+_CV_EXECUTOR: Optional[ProcessPoolExecutor] = None
 
 
 # ---------------- Pydantic model + helpers (use your working version) ----------------
@@ -150,6 +220,54 @@ def parse_and_validate_llm(text: str, debug: bool = False) -> Optional[OCRRespon
     return model
 
 
+class PageRecord(BaseModel):
+    """
+    Typed per-page record built straight from the validated OCRResponse fields; the single
+    source for both the Meilisearch documents and the consolidated markdown.
+    """
+    page: int
+    ok: bool
+    content: str = ""
+    tags: List[str] = []
+    date: Optional[str] = None
+    blank: bool = False  # skipped by the blank-page pre-filter: kept in the markdown, not in the search index
+
+    @classmethod
+    def from_result(cls, r: Dict[str, Any]) -> "PageRecord":
+        model = r.get("result")
+        if not r.get("ok") or model is None:
+            return cls(page=r["page"], ok=False)
+        # journaled pages lose "skipped", so a resumed blank page is recognised by its result
+        blank = r.get("skipped") == "blank" or model == BLANK_PAGE_RESULT
+        return cls(page=r["page"], ok=True, content=model.page_content, tags=model.tags, date=model.date,
+                   blank=blank)
+
+    def to_search_doc(self, user_id: str, book_id: str, book_name: str) -> Dict[str, Any]:
+        return {
+            # deterministic id: re-indexing a resumed / retried book replaces pages instead of duplicating them
+            "page_id": f"{book_id}_{self.page}",
+            "user_id": user_id,
+            "book_id": book_id,
+            "book_name": book_name,
+            "page_number": self.page,
+            "content": self.content,
+            "tags": self.tags,
+            "date": self.date,
+        }
+
+    def to_markdown(self) -> str:
+        lines = [f"## Page {self.page}\n"]
+        if self.ok:
+            lines.append(self.content + "\n")
+            if self.tags:
+                lines.append(f"_Tags: {', '.join(self.tags)}_\n")
+            if self.date:
+                lines.append(f"_Date: {self.date}_\n")
+        else:
+            lines.append("> **UNREADABLE / FAILED — saved raw response for manual review**\n")
+        return "\n".join(lines)
+
+
 def upload_pil_image_client(pil_img: Image.Image, filename: str = "page.png"):
     """
     Upload a PIL Image to Gemini client.files.upload using an in-memory BytesIO.
@@ -192,31 +310,22 @@ def _sanitize_resource_name(filename: str) -> str:
     return base
 
 
-def blocking_upload_bytes(img_bytes: bytes, filename: str = "page.png", resource_name: str | None = None):
+def blocking_upload_bytes(img_bytes: bytes, filename: str = "page.png", resource_name: str | None = None,
+                          mime_type: str = "image/png"):
     """
-    Preferred: upload using an in-memory PIL BytesIO (works reliably in your tests).
+    Preferred: upload the already-encoded bytes straight from an in-memory BytesIO
+    (no PIL decode / re-encode of a PNG we just produced).
     Fallback: write bytes to a temp file and upload that (Windows-safe).
     """
     # ensure filename has an extension for display purposes
     name, ext = os.path.splitext(filename)
     if not ext:
-        ext = ".png"
+        ext = mimetypes.guess_extension(mime_type) or ".png"
         filename = filename + ext
 
-    # Try in-memory PIL path first (most reliable per your tests)
     try:
-        # Wrap bytes in BytesIO and open with PIL to ensure valid image and let PIL normalize
-        bio = _io.BytesIO(img_bytes)
-        pil_img = Image.open(bio)
-        pil_img.load()  # force load to surface errors early
-
-        # Optionally, you could sanitize or convert modes here (e.g., ensure "RGB")
-        # if pil_img.mode != "RGB":
-        #     pil_img = pil_img.convert("RGB")
-
-        # Upload via in-memory helper
-        return upload_pil_image_client(pil_img, filename=filename)
-
+        config = {"mime_type": mime_type, "display_name": filename}
+        return client.files.upload(file=_io.BytesIO(img_bytes), config=config)
     except Exception as e_inmem:
         # Log the in-memory failure and fall back to disk-based upload
         _logger.debug("In-memory upload failed (%s). Falling back to temp-file upload.", repr(e_inmem))
@@ -231,7 +340,7 @@ def blocking_upload_bytes(img_bytes: bytes, filename: str = "page.png", resource
         # open in blocking binary mode (seekable) and upload
         with open(path, "rb") as fh:
             config = {
-                "mime_type": "image/png",
+                "mime_type": mime_type,
                 "display_name": filename,
             }
             return client.files.upload(file=fh, config=config)
@@ -242,6 +351,20 @@ def blocking_upload_bytes(img_bytes: bytes, filename: str = "page.png", resource
             pass
 
 
+def use_inline_image(img_bytes: bytes, transport: str = IMAGE_TRANSPORT) -> bool:
+    """'inline' / 'upload' force a transport; 'auto' inlines payloads up to INLINE_IMAGE_MAX_BYTES."""
+    if transport == "inline":
+        return True
+    if transport == "upload":
+        return False
+    return len(img_bytes) <= INLINE_IMAGE_MAX_BYTES
+
+
+def inline_image_part(img_bytes: bytes, mime_type: str = "image/png"):
+    """Image sent inside the generate_content request itself: no Files API round trip, nothing expires."""
+    return types.Part.from_bytes(data=img_bytes, mime_type=mime_type)
+
+
 def blocking_model_inference(uploaded_file, user_prompt, model_name=MODEL_NAME):
     return client.models.generate_content(
         model=model_name,
@@ -254,53 +377,494 @@ def blocking_model_inference(uploaded_file, user_prompt, model_name=MODEL_NAME):
     )
 
 
+# ---------------- Gemini rate limiting ----------------
+class TokenBucket:
+    """Reservation-style token bucket: take() debits immediately and returns how long to wait."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self, n: float) -> float:
+        self._refill()
+        self.tokens -= n
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, n: float):
+        """Debit (n > 0) or refund (n < 0) after the real cost is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - n)
+
+
+class AdaptiveLimiter:
+    """
+    Process-wide limiter in front of the Gemini Files/Models calls.
+    - concurrency limit follows AIMD: +1 per `limit` successes, halved on 429 / 5xx
+    - optional requests-per-minute and tokens-per-minute token buckets (0 = unlimited)
+    Calls run on the limiter's own thread pool of `max_limit` threads, so a grown limit is never
+    starved by rendering / cache / journal work on the shared I/O pool.
+    All state lives on the event loop thread, so no locks are needed.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, rpm: int = 0, tpm: int = 0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_limit)
+        self.in_flight = 0
+        self._waiters: "collections.deque[asyncio.Future]" = collections.deque()
+        self._requests = TokenBucket(rpm) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    async def acquire(self, est_tokens: int = 0):
+        while self.in_flight >= int(self.limit):
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut in self._waiters:
+                    self._waiters.remove(fut)
+                self._wake()
+                raise
+        self.in_flight += 1
+        try:
+            wait = self._requests.take(1) if self._requests else 0.0
+            if self._tokens and est_tokens:
+                wait = max(wait, self._tokens.take(est_tokens))
+            if wait > 0:
+                await asyncio.sleep(wait)
+        except BaseException:
+            self.in_flight -= 1
+            self._wake()
+            raise
+
+    def release(self, outcome: str, est_tokens: int = 0, used_tokens: Optional[int] = None):
+        self.in_flight -= 1
+        if outcome == "ok":
+            self.successes += 1
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        elif outcome == "throttled":
+            self.throttled += 1
+            self.limit = max(self.min_limit, self.limit / 2)
+        else:
+            self.errors += 1
+        if self._tokens and used_tokens is not None:
+            self._tokens.adjust(used_tokens - est_tokens)
+        self._wake()
+
+    async def call(self, fn, *args, est_tokens: int = 0):
+        """Run blocking `fn(*args)` on the limiter's pool once a slot and rate budget are available."""
+        await self.acquire(est_tokens)
+        outcome, used = "error", None
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(self._executor, fn, *args)
+            outcome = "ok"
+            usage = getattr(result, "usage_metadata", None)
+            used = getattr(usage, "total_token_count", None) if usage is not None else None
+            return result
+        except Exception as exc:
+            outcome = "throttled" if _is_throttle_error(exc) else "error"
+            raise
+        finally:
+            self.release(outcome, est_tokens, used)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "limit_exact": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": sum(1 for f in self._waiters if not f.done()),
+            "successes": self.successes,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "rpm_available": round(self._requests.tokens, 1) if self._requests else None,
+            "tpm_available": round(self._tokens.tokens, 1) if self._tokens else None,
+        }
+
+
+def _is_throttle_error(exc: Exception) -> bool:
+    """429 / 5xx responses from the Gemini API; errors without an HTTP status never shrink the limit."""
+    if isinstance(exc, genai_errors.ServerError):
+        return True
+    return isinstance(exc, genai_errors.APIError) and exc.code == 429
+
+
+GEMINI_LIMITER = AdaptiveLimiter(initial=CONCURRENCY, min_limit=GEMINI_MIN_CONCURRENCY,
+                                 max_limit=GEMINI_MAX_CONCURRENCY, rpm=GEMINI_RPM, tpm=GEMINI_TPM)
+
+
+# ---------------- CPU stage: preprocessing ----------------
+def _get_cv_executor() -> Optional[ProcessPoolExecutor]:
+    global _CV_EXECUTOR
+    if _CV_EXECUTOR is None and CV_WORKERS > 0:
+        # spawn, not fork: the parent runs threads (executor, HTTP clients) that must not be forked
+        _CV_EXECUTOR = ProcessPoolExecutor(max_workers=CV_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _CV_EXECUTOR
+
+
+def _preprocess_and_encode(pil_page) -> Tuple[bytes, Dict[str, Any]]:
+    preproc = simple_preprocess_page(pil_page, **PREPROCESS_KWARGS)
+    return encode_page_image(preproc['binary'], **ENCODE_KWARGS), page_signals(preproc['binary'], preproc['gray'])
+
+
+async def preprocess_page_bytes(pil_page) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Preprocess a page and return the encoded image bytes (IMAGE_MIME) sent to the model, plus the
+    page's pre-filter signals (ink ratio, perceptual hash) computed from the same binary image.
+    Runs on the CV process pool, passing the page through shared memory instead of pickling it
+    (the copy into shared memory runs on the I/O thread pool); falls back to the I/O thread pool when OCR_CV_WORKERS=0.
+    """
+    loop = asyncio.get_event_loop()
+    cv_executor = _get_cv_executor()
+    if cv_executor is None:
+        return await loop.run_in_executor(_EXECUTOR, _preprocess_and_encode, pil_page)
+
+    # decoding the page into the block copies ~25 MB at 300 DPI: keep it off the event loop
+    copy = loop.run_in_executor(_EXECUTOR, page_to_shared_memory, pil_page)
+    try:
+        shm, shape, dtype = await asyncio.shield(copy)
+    except asyncio.CancelledError:
+        # the thread still creates the block: wait for it so it can be unlinked
+        shm, _, _ = await copy
+        shm.close()
+        shm.unlink()
+        raise
+    try:
+        return await loop.run_in_executor(cv_executor, preprocess_shared_page, shm.name, shape, dtype,
+                                          PREPROCESS_KWARGS, ENCODE_KWARGS, True)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def shutdown_executors():
+    global _CV_EXECUTOR
+    if _CV_EXECUTOR is not None:
+        _CV_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+        _CV_EXECUTOR = None
+
+
+# ---------------- OCR result cache ----------------
+class OCRCache:
+    """
+    Persistent content-addressed cache of validated OCR results (SQLite).
+    Key = sha256(encoded preprocessed image bytes + model name + prompt id), value = OCRResponse JSON.
+    Total stored bytes are capped at `max_bytes`; least recently used rows are evicted first.
+    """
+
+    def __init__(self, path: Path, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        if max_bytes > 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_cache_lru ON ocr_cache (last_access)")
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(img_bytes: bytes, model_name: str, prompt_id: str) -> str:
+        h = hashlib.sha256(img_bytes)
+        h.update(b"\0" + str(model_name).encode("utf-8") + b"\0" + prompt_id.encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[OCRResponse]:
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE ocr_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        try:
+            return OCRResponse.model_validate_json(row[0])
+        except ValidationError:
+            return None
+
+    def put(self, key: str, result: OCRResponse):
+        if self._conn is None:
+            return
+        value = result.model_dump_json()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # evict least recently used rows until we are back under the cap
+                rows = self._conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_access").fetchall()
+                evict = []
+                for k, sz in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evict.append((k,))
+                    total -= sz
+                self._conn.executemany("DELETE FROM ocr_cache WHERE key = ?", evict)
+            self._conn.commit()
+
+
+_OCR_CACHE = OCRCache(OCR_CACHE_PATH, OCR_CACHE_MAX_BYTES)
+
+
+# ---------------- blank / near-duplicate pre-filter ----------------
+BLANK_PAGE_RESULT = OCRResponse(page_content="", tags=["blank page"], date=None)
+
+
+class PageHashIndex:
+    """
+    Persistent perceptual hashes of pages the model transcribed, per user (SQLite), so a page that
+    was already OCR'd in another of the user's books is recognised as a duplicate (exact hash match).
+    """
+
+    def __init__(self, path: Path, enabled: bool = True):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = None
+        if enabled:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS page_hashes ("
+                " user_id TEXT NOT NULL, book_id TEXT NOT NULL, page INTEGER NOT NULL,"
+                " phash TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (user_id, book_id, page))"
+            )
+            self._conn.commit()
+
+    def load(self, user_id: str) -> List[Tuple[str, str, int, OCRResponse]]:
+        """[(phash, book_id, page, result), ...] for every indexed page of the user."""
+        if self._conn is None:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT phash, book_id, page, value FROM page_hashes WHERE user_id = ?", (str(user_id),)
+            ).fetchall()
+        entries = []
+        for phash, book_id, page, value in rows:
+            try:
+                entries.append((phash, book_id, page, OCRResponse.model_validate_json(value)))
+            except ValidationError:
+                continue
+        return entries
+
+    def add(self, user_id: str, book_id: str, page: int, phash: str, result: OCRResponse):
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO page_hashes (user_id, book_id, page, phash, value) VALUES (?, ?, ?, ?, ?)",
+                (str(user_id), str(book_id), page, phash, result.model_dump_json()),
+            )
+            self._conn.commit()
+
+
+_PAGE_HASHES = PageHashIndex(PAGE_HASHES_PATH, enabled=DUPLICATE_MAX_DISTANCE >= 0)
+
+
+class PageFilter:
+    """
+    Per-run pre-filter applied after preprocessing, before any model call:
+    - blank pages (ink_ratio below BLANK_INK_RATIO) are not sent to the model;
+    - a page whose hash is within DUPLICATE_MAX_DISTANCE bits of an earlier page of this book, or equal
+      to the hash of a page in another of the user's books, reuses that page's result. Pages still being OCR'd are
+      tracked as futures, so a duplicate waits for its original instead of making a second call.
+    """
+
+    def __init__(self, user_id: Optional[str] = None, book_id: Optional[str] = None,
+                 known: Optional[List[Tuple[str, str, int, OCRResponse]]] = None):
+        self.user_id = user_id
+        self.book_id = book_id
+        self._entries: List[Tuple[str, Dict[str, Any], asyncio.Future]] = []
+        loop = asyncio.get_event_loop()
+        for phash, book_id_, page, result in known or []:
+            fut = loop.create_future()
+            fut.set_result(result)
+            self._entries.append((phash, {"book_id": book_id_, "page": page}, fut))
+
+    @staticmethod
+    def is_blank(signals: Dict[str, Any]) -> bool:
+        return signals["ink_ratio"] < BLANK_INK_RATIO
+
+    async def find_duplicate(self, page_number: int, phash: str
+                             ) -> Optional[Tuple[Dict[str, Any], OCRResponse]]:
+        """(source page, result) of the closest known page, or None (also when its OCR failed)."""
+        if DUPLICATE_MAX_DISTANCE < 0:
+            return None
+        best = None
+        for other, source, fut in self._entries:
+            same_book = source["book_id"] == str(self.book_id)
+            if source["page"] == page_number and same_book:
+                continue  # this page's own earlier result (re-processing it)
+            dist = hash_distance(phash, other)
+            limit = DUPLICATE_MAX_DISTANCE if same_book else 0
+            if dist <= limit and (best is None or dist < best[0]):
+                best = (dist, source, fut)
+        if best is None:
+            return None
+        result = await asyncio.shield(best[2])
+        return (best[1], result) if result is not None else None
+
+    def claim(self, page_number: int, phash: str) -> asyncio.Future:
+        """Register a page that is about to be OCR'd; later duplicates wait on the returned future."""
+        fut = asyncio.get_event_loop().create_future()
+        self._entries.append((phash, {"book_id": str(self.book_id), "page": page_number}, fut))
+        return fut
+
+    @staticmethod
+    def resolve(fut: asyncio.Future, result: Optional[OCRResponse]):
+        """Hand a claimed page's result (None = OCR failed) to the duplicates waiting on it."""
+        if not fut.done():
+            fut.set_result(result)
+
+    def remember(self, page_number: int, phash: str, result: OCRResponse):
+        """Persist the page's hash for cross-book lookups (blocking; run in a thread)."""
+        if not (self.user_id and self.book_id):
+            return
+        try:
+            _PAGE_HASHES.add(self.user_id, self.book_id, page_number, phash, result)
+        except Exception:
+            _logger.exception("Failed to store page hash for page %s", page_number)
+
+
 # ---------------- per-page async processing ----------------
-async def process_page(pil_page, page_number: int, sem: asyncio.Semaphore, debug: bool = False) -> Dict[str, Any]:
+def _uploaded_file_is_fresh(uploaded, margin_seconds: int = UPLOAD_EXPIRY_MARGIN_SECONDS) -> bool:
+    """True while a Files API handle can still be referenced (unknown expiry counts as fresh)."""
+    exp = getattr(uploaded, "expiration_time", None)
+    if exp is None:
+        return True
+    if exp.tzinfo is None:
+        exp = exp.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return exp - now > datetime.timedelta(seconds=margin_seconds)
+
+
+def _is_missing_file_error(exc: Exception) -> bool:
+    msg = str(exc)
+    return any(tok in msg for tok in ("NOT_FOUND", "PERMISSION_DENIED", "expired", "404", "403"))
+
+
+async def process_page(pil_page, page_number: int, sem: asyncio.Semaphore, debug: bool = False,
+                       prefilter: Optional[PageFilter] = None) -> Dict[str, Any]:
     """
-    - preprocess page (in thread)
-    - convert to PNG bytes (in thread)
-    - upload (in thread)
-    - call model (in thread)
+    Staged page pipeline; each stage's output is memoized so a retry resumes at the stage that failed:
+    - preprocess page + encode it (in CV process pool), then blank check, OCR cache lookup and
+      near-duplicate lookup (prefilter); any of these skips the model call
+    - inline the image bytes, or upload (in thread, via GEMINI_LIMITER) when too large for inline;
+      an uploaded file is reused across retries until it expires
+    - call model (in thread, via GEMINI_LIMITER)
     - validate (in thread)
-    Returns dict with "page", "ok", "result" (OCRResponse or None), "raw_text", "attempts", "error"
+    Returns dict with "page", "ok", "result" (OCRResponse or None), "raw_text", "attempts", "error", "cached",
+    "skipped" ("blank" / "duplicate" when the pre-filter answered, with "duplicate_of") and, on failure,
+    "failed_stage".
     """
     attempt = 0
     last_raw = None
+    stage = "preprocess"
+    img_bytes: Optional[bytes] = None
+    cache_key: Optional[str] = None
+    image_part = None  # inline Part or uploaded Files API handle
+    transport = None
+    signals: Dict[str, Any] = {}
+    claimed: Optional[asyncio.Future] = None  # set while other pages may wait for this page's result
     async with sem:
         while attempt < MAX_RETRIES:
             attempt += 1
             try:
-                # 1) preprocess in worker thread (use your simple_preprocess_page)
-                # it returns dict with 'binary' (numpy uint8 image) when save_steps=False
-                preproc = await asyncio.get_event_loop().run_in_executor(
-                    _EXECUTOR, simple_preprocess_page, pil_page
-                )
-                # convert preproc['binary'] (numpy) to PIL and then bytes
-                pil_bin = await asyncio.get_event_loop().run_in_executor(_EXECUTOR, cv2_to_pil, preproc['binary'])
-                png_bytes = await asyncio.get_event_loop().run_in_executor(_EXECUTOR, pil_to_png_bytes, pil_bin)
-
-                # 2) upload bytes (in thread)
-                uploaded = await asyncio.get_event_loop().run_in_executor(_EXECUTOR, blocking_upload_bytes, png_bytes,
-                                                                          f"page_{page_number:03d}.png")
+                # 1) preprocess + encode on the CV process pool (simple_preprocess_page -> 'binary')
+                if img_bytes is None:
+                    stage = "preprocess"
+                    img_bytes, signals = await preprocess_page_bytes(pil_page)
+                    cache_key = OCRCache.make_key(img_bytes, MODEL_NAME, PROMPT_ID)
+
+                    if prefilter is not None and prefilter.is_blank(signals):
+                        if debug:
+                            print(f"[+] page {page_number} is blank (ink {signals['ink_ratio']:.4f}); skipped")
+                        return {"page": page_number, "ok": True, "result": BLANK_PAGE_RESULT, "raw_text": None,
+                                "attempts": attempt, "error": None, "cached": False, "skipped": "blank"}
+
+                    # cache hit -> skip upload + inference entirely
+                    cached = await asyncio.get_event_loop().run_in_executor(_EXECUTOR, _OCR_CACHE.get, cache_key)
+                    if cached is not None:
+                        if debug:
+                            print(f"[+] page {page_number} served from OCR cache")
+                        return {"page": page_number, "ok": True, "result": cached, "raw_text": None,
+                                "attempts": attempt, "error": None, "cached": True}
+
+                    if prefilter is not None:
+                        dup = await prefilter.find_duplicate(page_number, signals["phash"])
+                        if dup is not None:
+                            if debug:
+                                print(f"[+] page {page_number} duplicates {dup[0]}; reusing its result")
+                            return {"page": page_number, "ok": True, "result": dup[1], "raw_text": None,
+                                    "attempts": attempt, "error": None, "cached": False,
+                                    "skipped": "duplicate", "duplicate_of": dup[0]}
+                        claimed = prefilter.claim(page_number, signals["phash"])
+
+                # 2) image part: inline bytes, or upload (in thread) and reuse the file while it is valid
+                if image_part is None or not _uploaded_file_is_fresh(image_part):
+                    if use_inline_image(img_bytes):
+                        transport = "inline"
+                        image_part = inline_image_part(img_bytes, IMAGE_MIME)
+                    else:
+                        stage = transport = "upload"
+                        ext = mimetypes.guess_extension(IMAGE_MIME) or ".png"
+                        image_part = await GEMINI_LIMITER.call(blocking_upload_bytes, img_bytes,
+                                                               f"page_{page_number:03d}{ext}", None, IMAGE_MIME)
 
                 # 3) model inference (in thread)
-                response = await asyncio.get_event_loop().run_in_executor(_EXECUTOR, blocking_model_inference, uploaded,
-                                                                          prompt.prompt_9, MODEL_NAME)
+                stage = "inference"
+                response = await GEMINI_LIMITER.call(blocking_model_inference, image_part, PROMPT_TEXT, MODEL_NAME,
+                                                     est_tokens=EST_TOKENS_PER_PAGE)
 
                 raw_text = getattr(response, "text", str(response))
                 last_raw = raw_text
 
                 # 4) validate (in thread)
+                stage = "validate"
                 validated = await asyncio.get_event_loop().run_in_executor(_EXECUTOR, parse_and_validate_llm, raw_text,
                                                                            debug)
 
                 if validated is not None:
                     if debug:
                         print(f"[+] page {page_number} success (attempt {attempt})")
+                    try:
+                        await asyncio.get_event_loop().run_in_executor(_EXECUTOR, _OCR_CACHE.put, cache_key, validated)
+                    except Exception:
+                        _logger.exception("Failed to store page %s in OCR cache", page_number)
+                    if claimed is not None:
+                        prefilter.resolve(claimed, validated)
+                        await asyncio.get_event_loop().run_in_executor(
+                            _EXECUTOR, prefilter.remember, page_number, signals["phash"], validated)
                     return {"page": page_number, "ok": True, "result": validated, "raw_text": raw_text,
-                            "attempts": attempt, "error": None}
+                            "attempts": attempt, "error": None, "cached": False, "transport": transport}
 
-                # failed validation -> retry after backoff
+                # failed validation -> retry inference after backoff (preprocessed bytes + upload are kept)
                 backoff = BASE_BACKOFF * (2 ** (attempt - 1)) + random.random() * 0.5
                 if debug:
                     print(f"[-] page {page_number} attempt {attempt} failed validation. backoff {backoff:.1f}s")
@@ -308,62 +872,276 @@ async def process_page(pil_page, page_number: int, sem: asyncio.Semaphore, debug
 
             except Exception as exc:
                 last_raw = repr(exc)
+                if stage == "inference" and transport == "upload" and _is_missing_file_error(exc):
+                    # the uploaded file is gone (expired / deleted): upload again on the next attempt
+                    image_part = None
                 backoff = BASE_BACKOFF * (2 ** (attempt - 1)) + random.random() * 0.5
                 if debug:
-                    print(f"[-] page {page_number} exception on attempt {attempt}: {exc}. backoff {backoff:.1f}s")
+                    print(f"[-] page {page_number} {stage} failed on attempt {attempt}: {exc}. backoff {backoff:.1f}s")
                 await asyncio.sleep(backoff)
 
     # exhausted retries
+    if claimed is not None:
+        prefilter.resolve(claimed, None)
     return {"page": page_number, "ok": False, "result": None, "raw_text": last_raw, "attempts": attempt,
-            "error": "exhausted_retries"}
+            "error": "exhausted_retries", "cached": False, "failed_stage": stage}
+
+
+# ---------------- per-book checkpoint journal ----------------
+class PageJournal:
+    """
+    Append-only JSONL checkpoint of finished pages: OUTPUT_DIR/<book_id>/pages.jsonl.
+    Each page result is fsync'ed as soon as it completes, so a restarted run can skip
+    pages that already succeeded. Later lines for the same page override earlier ones.
+    """
+
+    def __init__(self, book_id: str):
+        self.path = OUTPUT_DIR / str(book_id) / "pages.jsonl"
+        self._lock = threading.Lock()  # appends come from several executor threads
+
+    def load(self) -> Dict[int, Dict[str, Any]]:
+        done: Dict[int, Dict[str, Any]] = {}
+        if not self.path.exists():
+            return done
+        with open(self.path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                    result = OCRResponse.model_validate(rec["result"]) if rec.get("result") else None
+                except Exception:
+                    # torn last line after a crash, or an entry from an older schema: ignore it
+                    continue
+                done[int(rec["page"])] = {
+                    "page": int(rec["page"]), "ok": bool(rec.get("ok")) and result is not None,
+                    "result": result, "raw_text": None, "attempts": 0, "error": rec.get("error"),
+                    "cached": False, "resumed": True, "dpi": rec.get("dpi"),
+                }
+        return done
+
+    def append(self, r: Dict[str, Any]):
+        rec = {
+            "page": r["page"],
+            "ok": bool(r.get("ok")),
+            "result": r["result"].model_dump() if r.get("result") is not None else None,
+            "error": r.get("error"),
+            "dpi": r.get("dpi"),
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def failed_dir_for(book_id: Optional[str] = None) -> Path:
+    return FAILED_DIR / str(book_id) if book_id else FAILED_DIR
+
+
+def failed_pages_for_book(book_id: str) -> List[int]:
+    """Page numbers that have a saved failed response in FAILED_DIR/<book_id>/."""
+    pages = []
+    for f in failed_dir_for(book_id).glob("page_*_failed.txt"):
+        m = re.match(r"page_(\d+)_failed$", f.stem)
+        if m:
+            pages.append(int(m.group(1)))
+    return sorted(pages)
 
 
 # ---------------- runner & aggregator ----------------
-async def run_pdf_async(pdf_path: str, concurrency: int = CONCURRENCY, debug: bool = False) -> List[Dict[str, Any]]:
-    # convert_from_path is blocking -> run in thread
-    pil_pages = await asyncio.get_event_loop().run_in_executor(_EXECUTOR, convert_from_path, pdf_path, 300)
+def count_pdf_pages(pdf_path: str) -> int:
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def render_page(pdf_path: str, page_number: int, dpi: int = RASTER_DPI):
+    """Rasterize a single (1-based) page, so only that page's image is held in memory."""
+    pages = convert_from_path(pdf_path, dpi, first_page=page_number, last_page=page_number)
+    return pages[0] if pages else None
+
+
+def render_page_adaptive(pdf_path: str, page_number: int,
+                         images: Optional[Dict[int, Tuple[float, float]]] = None,
+                         sizes: Optional[Dict[int, Tuple[float, float]]] = None):
+    """
+    render_page at the DPI chosen for this page (RASTER_DPI_MODE). Returns (page image, dpi).
+    images / sizes are embedded_images / page_sizes_inches of the whole PDF, looked up once per run.
+    """
+    if RASTER_DPI_MODE != "adaptive":
+        return render_page(pdf_path, page_number, RASTER_DPI), RASTER_DPI
+    dpi = choose_page_dpi((sizes or {}).get(page_number, (0.0, 0.0)),
+                          (images or {}).get(page_number), RASTER_MIN_DPI, RASTER_MAX_DPI, RASTER_MAX_PIXELS)
+    return render_page(pdf_path, page_number, dpi), dpi
+
+
+async def run_pdf_async(pdf_path: str, concurrency: int = CONCURRENCY, debug: bool = False,
+                        on_start: Optional[Callable[[int], Awaitable[None]]] = None,
+                        on_page_done: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                        book_id: Optional[str] = None, pages: Optional[List[int]] = None,
+                        page_offset: int = 0, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    OCR every page of `pdf_path`.
+    Pages are rendered one at a time by a producer and handed to `concurrency` consumers through a
+    bounded queue, so at most ~2*concurrency page images are alive and OCR starts after the first render.
+    - on_start(total_pages) is awaited once the page count is known.
+    - on_page_done(page_result) is awaited as each page finishes (used for job progress reporting).
+    - book_id: checkpoint every finished page to PageJournal(book_id) and skip pages that already
+      succeeded in an earlier (interrupted) run; failed responses go to FAILED_DIR/<book_id>/.
+    - pages: re-process these page numbers even if the journal has a result for them
+      (pages missing from the journal or recorded as failed are always processed).
+    - page_offset: page i of this PDF is book page page_offset + i (PDFs appended to an existing book).
+      Page numbers in `pages`, the journal and the results are book page numbers.
+    - user_id: also match near-duplicates against the user's other books (see PageFilter).
+    Each page is rendered at the DPI picked by render_page_adaptive, recorded as "dpi" in its result.
+    Returns one result per page of the PDF, sorted by page; resumed pages have "resumed": True.
+    """
+    loop = asyncio.get_event_loop()
+    total_pages = await loop.run_in_executor(_EXECUTOR, count_pdf_pages, pdf_path)
+    if on_start is not None:
+        await on_start(total_pages)
+
+    journal = PageJournal(book_id) if book_id else None
+    # journal reads / writes (fsync per page) are blocking file I/O: keep them off the event loop
+    previous = await loop.run_in_executor(_EXECUTOR, journal.load) if journal else {}
+    forced = set(pages or [])
+    book_pages = range(page_offset + 1, page_offset + total_pages + 1)
+    todo = [i for i in book_pages if i in forced or not (i in previous and previous[i]["ok"])]
+    todo_set = set(todo)
+    results: List[Dict[str, Any]] = [r for i, r in previous.items() if i not in todo_set and i in book_pages]
+    if on_page_done is not None:
+        for r in results:
+            await on_page_done(r)
+    if debug and results:
+        print(f"[+] resuming: {len(results)} pages restored from {journal.path}, {len(todo)} to process")
+
+    known = []
+    if user_id and DUPLICATE_MAX_DISTANCE >= 0:
+        known = await loop.run_in_executor(_EXECUTOR, _PAGE_HASHES.load, user_id)
+    prefilter = PageFilter(user_id, book_id, known)
+
+    concurrency = max(1, concurrency)
     sem = asyncio.Semaphore(concurrency)
-    tasks = [asyncio.create_task(process_page(p, i, sem, debug)) for i, p in enumerate(pil_pages, start=1)]
-    results = await asyncio.gather(*tasks)
-    # save failed raw responses to disk for later inspection
-    for r in results:
-        if not r["ok"]:
-            fname = FAILED_DIR / f"page_{r['page']:03d}_failed.txt"
-            with open(fname, "w", encoding="utf-8") as fh:
-                fh.write(str(r["raw_text"] or ""))
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    failed_dir = failed_dir_for(book_id)
+    images, sizes = {}, {}
+    if RASTER_DPI_MODE == "adaptive" and todo:
+        images = await loop.run_in_executor(_EXECUTOR, embedded_images, pdf_path)
+        sizes = await loop.run_in_executor(_EXECUTOR, page_sizes_inches, pdf_path, total_pages)
+
+    async def _producer():
+        for i in todo:
+            dpi = None
+            try:
+                # convert_from_path is blocking -> run in thread
+                page, dpi = await loop.run_in_executor(_EXECUTOR, render_page_adaptive, pdf_path,
+                                                       i - page_offset, images, sizes)
+                err = None if page is not None else "empty render"
+            except Exception as exc:
+                _logger.exception("Rendering page %s of %s failed", i, pdf_path)
+                page, err = None, repr(exc)
+            await queue.put((i, page, err, dpi))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def _consumer():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            i, page, err, dpi = item
+            if page is None:
+                r = {"page": i, "ok": False, "result": None, "raw_text": err, "attempts": 0,
+                     "error": "render_failed", "cached": False}
+            else:
+                r = await process_page(page, i, sem, debug, prefilter)
+            r["dpi"] = dpi
+            del item, page
+            results.append(r)
+            if journal is not None:
+                try:
+                    await loop.run_in_executor(_EXECUTOR, journal.append, r)
+                except Exception:
+                    _logger.exception("Failed to checkpoint page %s", i)
+            await loop.run_in_executor(_EXECUTOR, _record_failed_response, failed_dir, r)
+            if on_page_done is not None:
+                try:
+                    await on_page_done(r)
+                except Exception:
+                    _logger.exception("on_page_done callback failed for page %s", i)
+
+    tasks = [asyncio.ensure_future(_producer())] + [asyncio.ensure_future(_consumer()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # if any task failed (or the run was cancelled), stop the rest: with every consumer gone the
+        # producer would block on the bounded queue forever
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    results.sort(key=lambda r: r["page"])
     return results
 
 
+def _record_failed_response(failed_dir: Path, r: Dict[str, Any]):
+    """Save a failed page's raw response for inspection / retry; clear it once the page succeeds."""
+    fname = failed_dir / f"page_{r['page']:03d}_failed.txt"
+    try:
+        if r["ok"]:
+            if fname.exists():
+                fname.unlink()
+            return
+        failed_dir.mkdir(parents=True, exist_ok=True)
+        with open(fname, "w", encoding="utf-8") as fh:
+            fh.write(str(r["raw_text"] or ""))
+    except Exception:
+        _logger.exception("Failed to record failed response for page %s", r["page"])
+
+
 def aggregate_to_markdown(results: List[Dict[str, Any]], out_path: Path = MARKDOWN_OUTFILE) -> Path:
-    results_sorted = sorted(results, key=lambda r: r["page"])
+    records = sorted((PageRecord.from_result(r) for r in results), key=lambda rec: rec.page)
     lines: List[str] = ["# Combined OCR Pages\n"]
-    for r in results_sorted:
-        lines.append(f"## Page {r['page']}\n")
-        if r["ok"] and r["result"] is not None:
-            model = r["result"]
-            page_md = model.model_dump().get("page_content") if hasattr(model, "model_dump") else model.dict().get(
-                "page_content")
-            lines.append(page_md + "\n")
-            tags = model.model_dump().get("tags") if hasattr(model, "model_dump") else model.dict().get("tags")
-            date = model.model_dump().get("date") if hasattr(model, "model_dump") else model.dict().get("date")
-            if tags:
-                lines.append(f"_Tags: {', '.join(tags)}_\n")
-            if date:
-                lines.append(f"_Date: {date}_\n")
-        else:
-            lines.append("> **UNREADABLE / FAILED — saved raw response for manual review**\n")
+    lines.extend(rec.to_markdown() for rec in records)
     out_path.parent.mkdir(parents=True, exist_ok=True)
     out_path.write_text("\n".join(lines), encoding="utf-8")
     return out_path
 
 
+def append_to_markdown(results: List[Dict[str, Any]], out_path: Path) -> Path:
+    """Append pages to an existing consolidated markdown file (created with the header if missing)."""
+    records = sorted((PageRecord.from_result(r) for r in results), key=lambda rec: rec.page)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    exists = out_path.exists() and out_path.stat().st_size > 0
+    with open(out_path, "a", encoding="utf-8") as fh:
+        if not exists:
+            fh.write("# Combined OCR Pages\n")
+        for rec in records:
+            fh.write("\n" + rec.to_markdown())
+    return out_path
+
+
+def model_calls_saved(results: List[Dict[str, Any]]) -> Dict[str, int]:
+    """How many pages of a run were answered without a model call, by reason."""
+    saved = {
+        "cache": sum(1 for r in results if r.get("cached")),
+        "blank": sum(1 for r in results if r.get("skipped") == "blank"),
+        "duplicate": sum(1 for r in results if r.get("skipped") == "duplicate"),
+    }
+    saved["total"] = sum(saved.values())
+    return saved
+
+
+def journal_results(book_id: str) -> List[Dict[str, Any]]:
+    """All checkpointed page results of a book (every uploaded / appended part), sorted by page."""
+    return sorted(PageJournal(book_id).load().values(), key=lambda r: r["page"])
+
+
 # ---------------- CLI-style entrypoint ----------------
 def run(pdf_path: str, concurrency: int = CONCURRENCY, debug: bool = True):
     results = asyncio.run(run_pdf_async(pdf_path, concurrency=concurrency, debug=debug))
     md_file = aggregate_to_markdown(results)
     succeeded = len([r for r in results if r["ok"]])
     failed = len(results) - succeeded
-    print(f"[+] Done. {succeeded} succeeded, {failed} failed. Markdown: {md_file}")
+    saved = model_calls_saved(results)
+    print(f"[+] Done. {succeeded} succeeded ({saved['cache']} from cache, {saved['blank']} blank, "
+          f"{saved['duplicate']} duplicates), {failed} failed. Markdown: {md_file}")
     if failed:
         print(f"[+] Failed raw outputs saved in {FAILED_DIR}")
 
@@ -0,0 +1,782 @@
+#!/usr/bin/env python3
+"""
+benchmark.py
+Offline benchmarks for the OCR pipeline (no API keys needed).
+
+Usage:
+    python benchmark.py preprocess-scaling --pdf notes.pdf --pages 8 --workers 1 2 4
+    python benchmark.py preprocess-scaling --synthetic 8
+    python benchmark.py ocr-latency --pdf notes.pdf --pages 5 --mode both   # needs GEMINI_API_KEY
+    python benchmark.py encode --pdf notes.pdf --pages 5 [--ocr]
+    python benchmark.py profiles --pdf notes.pdf --pages 5 [--ocr]
+    python benchmark.py dpi --pdfs scan150.pdf notes.pdf poster.pdf [--ocr]   # needs poppler
+    python benchmark.py dpi --synthetic 2
+    python benchmark.py tiles --megapixels 60 --tile-sizes 1024 2048 --workers 1 4
+    python benchmark.py tune --fixtures labeled/ --search random --trials 40 --min-quality 0.9
+    python benchmark.py tune --synthetic 3 --params adaptive_block adaptive_c   # grid over two knobs
+    python benchmark.py lines --pages 10 --profile fast
+    python benchmark.py auth-cache --email me@example.com --requests 500   # needs the API env (app/.env)
+    python benchmark.py downloads --books 4 --files 3 --mb 8 --latency-ms 20   # local storage stand-in
+"""
+import argparse
+import asyncio
+import difflib
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from preprocessor import (simple_preprocess_page, tiled_preprocess_page, binary_to_png_bytes,
+                          page_to_shared_memory, preprocess_shared_page, encode_page_image,
+                          IMAGE_FORMATS, PREPROCESS_PROFILES, LINE_METHODS,
+                          embedded_images, page_sizes_inches, choose_page_dpi)
+
+
+# ------------------ fixtures ------------------
+def synthetic_labeled_page(seed: int, size=(2550, 3300)):
+    """
+    A letter-size 300 DPI 'scan': off-white paper, sensor noise, ruled lines and scribbled strokes.
+    Returns (page, reference) where reference is the clean binary of the strokes alone (ink = 0).
+    """
+    rng = np.random.default_rng(seed)
+    w, h = size
+    img = np.full((h, w), 235, dtype=np.uint8)
+    ref = np.full((h, w), 255, dtype=np.uint8)
+    img = cv2.add(img, rng.normal(0, 8, (h, w)).astype(np.int16).clip(-40, 40).astype(np.uint8))
+    for y in range(300, h - 100, 90):
+        cv2.line(img, (80, y), (w - 80, y), 190, 2)
+    for y in range(300, h - 200, 90):
+        x = 150
+        while x < w - 300:
+            pts = np.cumsum(rng.integers(-12, 16, (12, 2)), axis=0) + (x, y - 30)
+            cv2.polylines(img, [pts.astype(np.int32)], False, int(rng.integers(20, 70)), 3)
+            cv2.polylines(ref, [pts.astype(np.int32)], False, 0, 3)
+            x += int(rng.integers(60, 140))
+    return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)), ref
+
+
+def synthetic_page(seed: int, size=(2550, 3300)) -> Image.Image:
+    return synthetic_labeled_page(seed, size)[0]
+
+
+def load_pages(pdf=None, pages=8, dpi=300, synthetic=0):
+    if pdf and not synthetic:
+        return convert_from_path(pdf, dpi, first_page=1, last_page=pages)
+    return [synthetic_page(i) for i in range(synthetic or pages)]
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+# ------------------ preprocess-scaling ------------------
+def _warmup(_):
+    return os.getpid()
+
+
+def _preprocess_in_thread(pil_page):
+    return binary_to_png_bytes(simple_preprocess_page(pil_page)['binary'])
+
+
+def _run_process_pool(pages, workers):
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        # warm up every worker (imports cv2) outside the timed region
+        list(ex.map(_warmup, range(workers)))
+        t0 = time.perf_counter()
+        blocks = [page_to_shared_memory(p) for p in pages]
+        try:
+            futs = [ex.submit(preprocess_shared_page, shm.name, shape, dtype) for shm, shape, dtype in blocks]
+            for f in futs:
+                f.result()
+        finally:
+            for shm, _, _ in blocks:
+                shm.close()
+                shm.unlink()
+        return time.perf_counter() - t0
+
+
+def _run_thread_pool(pages, workers):
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        t0 = time.perf_counter()
+        list(ex.map(_preprocess_in_thread, pages))
+        return time.perf_counter() - t0
+
+
+def bench_preprocess_scaling(args):
+    pages = load_pages(args.pdf, args.pages, args.dpi, args.synthetic)
+    workers = args.workers or sorted({1, 2, 4, os.cpu_count() or 1})
+    print(f"[+] {len(pages)} pages, {os.cpu_count()} cores")
+    print(f"{'pool':<8}{'workers':>8}{'seconds':>10}{'pages/s':>10}{'speedup':>9}")
+    for kind, runner in (("process", _run_process_pool), ("thread", _run_thread_pool)):
+        base = None
+        for w in workers:
+            secs = runner(pages, w)
+            rate = len(pages) / secs
+            base = base or rate
+            print(f"{kind:<8}{w:>8}{secs:>10.2f}{rate:>10.2f}{rate / base:>8.2f}x")
+
+
+# ------------------ ocr-latency ------------------
+def bench_ocr_latency(args):
+    """Per-page latency of inline image parts vs. Files API upload + reference (real Gemini calls)."""
+    import async_batch_pdf as abp  # imported lazily: needs GEMINI_API_KEY / GEMINI_MODEL
+
+    pages = load_pages(args.pdf, args.pages, args.dpi, args.synthetic)
+    pngs = [_preprocess_in_thread(p) for p in pages]
+    modes = ["inline", "upload"] if args.mode == "both" else [args.mode]
+    print(f"[+] {len(pngs)} pages, mean payload {np.mean([len(b) for b in pngs]) / 1024:.0f} KiB")
+    print(f"{'mode':<8}{'mean s':>9}{'p50 s':>9}{'p95 s':>9}")
+    for mode in modes:
+        latencies = []
+        for i, png in enumerate(pngs, start=1):
+            t0 = time.perf_counter()
+            if mode == "inline":
+                part = abp.inline_image_part(png)
+            else:
+                part = abp.blocking_upload_bytes(png, f"bench_{i:03d}.png")
+            abp.blocking_model_inference(part, abp.PROMPT_TEXT, abp.MODEL_NAME)
+            latencies.append(time.perf_counter() - t0)
+        print(f"{mode:<8}{np.mean(latencies):>9.2f}{_percentile(latencies, 50):>9.2f}"
+              f"{_percentile(latencies, 95):>9.2f}")
+
+
+# ------------------ encode ------------------
+def text_similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a or "", b or "").ratio()
+
+
+def _ocr_text(abp, img_bytes, mime):
+    response = abp.blocking_model_inference(abp.inline_image_part(img_bytes, mime), abp.PROMPT_TEXT, abp.MODEL_NAME)
+    parsed = abp.parse_and_validate_llm(getattr(response, "text", ""))
+    return parsed.page_content if parsed else ""
+
+
+def bench_encode(args):
+    """
+    Bytes and encode time per encoder setting; with --ocr also the transcription similarity
+    against the default setting (png, level 6, full size) as the reference.
+    """
+    pages = load_pages(args.pdf, args.pages, args.dpi, args.synthetic)
+    binaries = [simple_preprocess_page(p)['binary'] for p in pages]
+    settings = [dict(fmt=f, compress_level=c, max_long_edge=e)
+                for f, c, e in itertools.product(args.formats, args.levels, args.long_edges)]
+    reference = dict(fmt="png", compress_level=6, max_long_edge=0)
+    if reference not in settings:
+        settings.insert(0, reference)
+
+    abp = None
+    ref_texts = []
+    if args.ocr:
+        import async_batch_pdf as abp  # needs GEMINI_API_KEY / GEMINI_MODEL
+        ref_texts = [_ocr_text(abp, encode_page_image(b, **reference), "image/png") for b in binaries]
+
+    mime = {"png": "image/png", "png1": "image/png", "webp": "image/webp"}
+    print(f"[+] {len(binaries)} pages")
+    print(f"{'format':<7}{'level':>6}{'edge':>6}{'KiB/page':>10}{'ms/page':>9}{'ocr sim':>9}")
+    for st in settings:
+        sizes, times, sims = [], [], []
+        for i, b in enumerate(binaries):
+            t0 = time.perf_counter()
+            data = encode_page_image(b, **st)
+            times.append(time.perf_counter() - t0)
+            sizes.append(len(data))
+            if abp is not None:
+                sims.append(text_similarity(ref_texts[i], _ocr_text(abp, data, mime[st["fmt"]])))
+        sim = f"{np.mean(sims):>9.3f}" if sims else f"{'-':>9}"
+        print(f"{st['fmt']:<7}{st['compress_level']:>6}{st['max_long_edge']:>6}"
+              f"{np.mean(sizes) / 1024:>10.1f}{np.mean(times) * 1000:>9.1f}{sim}")
+
+
+# ------------------ profiles ------------------
+def _max_rss_bytes():
+    try:
+        import resource  # not available on Windows
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+
+
+def _run_profile(profile, pages):
+    """
+    Runs in a fresh process so the RSS high-water mark belongs to this profile alone.
+    Returns (seconds per page, peak traced bytes per page, RSS growth, encoded binaries).
+    """
+    rss_before = _max_rss_bytes()
+    times, peaks, encoded = [], [], []
+    tracemalloc.start()
+    for page in pages:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        binary = simple_preprocess_page(page, profile=profile)['binary']
+        times.append(time.perf_counter() - t0)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        encoded.append(binary_to_png_bytes(binary))
+        del binary
+    tracemalloc.stop()
+    rss_after = _max_rss_bytes()
+    rss = rss_after - rss_before if rss_before is not None else None
+    return times, peaks, rss, encoded
+
+
+def _decode_binary(png):
+    return cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def bench_profiles(args):
+    """
+    Wall time, peak memory and accuracy of each preprocessing profile. Accuracy is the pixel agreement
+    of the binary page with the 'quality' profile's and, with --ocr, the transcription similarity to it.
+    Peak memory is what tracemalloc sees (numpy/OpenCV output arrays; OpenCV scratch buffers are not traced)
+    plus the process RSS growth where the platform reports it.
+    """
+    pages = load_pages(args.pdf, args.pages, args.dpi, args.synthetic)
+    ctx = multiprocessing.get_context("spawn")
+    runs = {}
+    for profile in args.profiles:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+            runs[profile] = ex.submit(_run_profile, profile, pages).result()
+
+    abp = None
+    ref_texts = []
+    reference = runs.get("quality")
+    if args.ocr and reference is not None:
+        import async_batch_pdf as abp  # needs GEMINI_API_KEY / GEMINI_MODEL
+        ref_texts = [_ocr_text(abp, png, "image/png") for png in reference[3]]
+
+    print(f"[+] {len(pages)} pages")
+    print(f"{'profile':<9}{'s/page':>8}{'speedup':>9}{'peak MiB':>10}{'rss MiB':>9}{'pixels':>8}{'ocr sim':>9}")
+    base = np.mean(reference[0]) if reference is not None else None
+    for profile, (times, peaks, rss, encoded) in runs.items():
+        speedup = f"{base / np.mean(times):>8.1f}x" if base else f"{'-':>9}"
+        rss_mib = f"{rss / 2 ** 20:>9.0f}" if rss is not None else f"{'-':>9}"
+        if reference is not None:
+            agree = np.mean([np.mean(_decode_binary(a) == _decode_binary(b)) for a, b in zip(encoded, reference[3])])
+            pixels = f"{agree:>8.4f}"
+        else:
+            pixels = f"{'-':>8}"
+        sims = [text_similarity(ref, _ocr_text(abp, png, "image/png")) for ref, png in zip(ref_texts, encoded)]
+        sim = f"{np.mean(sims):>9.3f}" if sims else f"{'-':>9}"
+        print(f"{profile:<9}{np.mean(times):>8.2f}{speedup}{max(peaks) / 2 ** 20:>10.0f}{rss_mib}{pixels}{sim}")
+
+
+# ------------------ dpi ------------------
+def mixed_fixture_pdfs(out_dir, pages_each=2):
+    """Scanned-notebook PDFs that need different DPIs: a 150 ppi letter scan, a 300 ppi letter scan
+    and a 300 ppi tabloid (11x17 in) scan."""
+    specs = [("scan150_letter", (8.5, 11), 150), ("scan300_letter", (8.5, 11), 300), ("scan300_tabloid", (11, 17), 300)]
+    paths = []
+    for name, (w_in, h_in), ppi in specs:
+        imgs = [synthetic_page(i).resize((int(w_in * ppi), int(h_in * ppi)), Image.LANCZOS) for i in range(pages_each)]
+        path = os.path.join(out_dir, f"{name}.pdf")
+        imgs[0].save(path, "PDF", save_all=True, append_images=imgs[1:], resolution=float(ppi))
+        paths.append(path)
+    return paths
+
+
+def _render_preprocess(pdf, page_number, dpi, profile):
+    t0 = time.perf_counter()
+    page = convert_from_path(pdf, dpi, first_page=page_number, last_page=page_number)[0]
+    png = binary_to_png_bytes(simple_preprocess_page(page, profile=profile)['binary'])
+    return png, page.size[0] * page.size[1], time.perf_counter() - t0
+
+
+def bench_dpi(args):
+    """
+    Fixed vs adaptive DPI over mixed documents: pages/s (page info + render + preprocess + encode), megapixels
+    and payload per page, chosen DPIs and, with --ocr, transcription similarity to the fixed-DPI render.
+    """
+    # without pdfimages / pdfinfo adaptive mode silently sees no scans and no page sizes: refuse to report that
+    missing = [exe for exe in ("pdftoppm", "pdfinfo", "pdfimages") if shutil.which(exe) is None]
+    if missing:
+        raise SystemExit(f"dpi needs poppler; not on PATH: {', '.join(missing)}")
+
+    tmp = None
+    pdfs = args.pdfs or []
+    if args.synthetic or not pdfs:
+        tmp = tempfile.TemporaryDirectory()
+        pdfs = mixed_fixture_pdfs(tmp.name, args.synthetic or 2)
+
+    abp = None
+    if args.ocr:
+        import async_batch_pdf as abp  # needs GEMINI_API_KEY / GEMINI_MODEL
+
+    rows = {"fixed": [], "adaptive": []}
+    texts = {"fixed": [], "adaptive": []}
+    for pdf in pdfs:
+        n_pages = int(pdfinfo_from_path(pdf)["Pages"])
+        for mode in rows:
+            t0 = time.perf_counter()
+            images = embedded_images(pdf) if mode == "adaptive" else {}
+            sizes = page_sizes_inches(pdf, n_pages) if mode == "adaptive" else {}
+            setup = time.perf_counter() - t0
+            for n in range(1, n_pages + 1):
+                t1 = time.perf_counter()
+                dpi = args.max_dpi
+                if mode == "adaptive":
+                    dpi = choose_page_dpi(sizes.get(n, (0.0, 0.0)), images.get(n),
+                                          args.min_dpi, args.max_dpi, int(args.max_megapixels * 1_000_000))
+                probe = time.perf_counter() - t1
+                png, pixels, secs = _render_preprocess(pdf, n, dpi, args.profile)
+                rows[mode].append((os.path.basename(pdf), n, dpi, pixels, len(png), secs + probe + setup / n_pages))
+                if abp is not None:
+                    texts[mode].append(_ocr_text(abp, png, "image/png"))
+
+    print(f"[+] {len(pdfs)} documents, {len(rows['fixed'])} pages, profile {args.profile}")
+    print(f"{'document':<22}{'page':>5}{'fixed dpi':>10}{'adaptive':>9}{'MPx':>7}{'KiB':>8}{'s':>7}")
+    for f, a in zip(rows["fixed"], rows["adaptive"]):
+        print(f"{f[0][:21]:<22}{f[1]:>5}{f[2]:>10}{a[2]:>9}{a[3] / 1e6:>7.1f}{a[4] / 1024:>8.0f}{a[5]:>7.2f}")
+    print(f"{'mode':<9}{'pages/s':>8}{'MPx/page':>9}{'KiB/page':>9}{'ocr sim':>9}")
+    for mode, rs in rows.items():
+        total = sum(r[5] for r in rs)
+        sim = f"{'-':>9}"
+        if abp is not None and mode == "adaptive":
+            sim = f"{np.mean([text_similarity(a, b) for a, b in zip(texts['fixed'], texts['adaptive'])]):>9.3f}"
+        print(f"{mode:<9}{len(rs) / total:>8.2f}{np.mean([r[3] for r in rs]) / 1e6:>9.1f}"
+              f"{np.mean([r[4] for r in rs]) / 1024:>9.0f}{sim}")
+    if tmp is not None:
+        tmp.cleanup()
+
+
+# ------------------ tiles ------------------
+def _traced(fn, *args, **kwargs):
+    """(result, seconds, peak traced bytes) of one call."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+        return result, time.perf_counter() - t0, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_tiles(args):
+    """Untiled vs tiled preprocessing of one poster-size page: time, peak memory, identical output."""
+    side = int((args.megapixels * 1_000_000 / (11 * 17)) ** 0.5)
+    page = synthetic_page(0, size=(11 * side, 17 * side))
+    print(f"[+] {page.size[0]}x{page.size[1]} page ({page.size[0] * page.size[1] / 1e6:.0f} MPx), "
+          f"profile {args.profile}")
+    print(f"{'mode':<9}{'tile':>6}{'workers':>8}{'seconds':>9}{'peak MiB':>10}{'identical':>10}")
+    ref, secs, peak = _traced(simple_preprocess_page, page, profile=args.profile)
+    print(f"{'untiled':<9}{'-':>6}{'-':>8}{secs:>9.2f}{peak / 2 ** 20:>10.0f}{'-':>10}")
+    for tile, workers in itertools.product(args.tile_sizes, args.workers):
+        res, secs, peak = _traced(tiled_preprocess_page, page, tile_size=tile, workers=workers, profile=args.profile)
+        same = np.array_equal(res['binary'], ref['binary'])
+        print(f"{'tiled':<9}{tile:>6}{workers:>8}{secs:>9.2f}{peak / 2 ** 20:>10.0f}{str(same):>10}")
+
+
+# ------------------ tune ------------------
+# values tried per simple_preprocess_page knob; --params restricts a grid search to some of them
+TUNE_SPACE = {
+    "profile": ["quality", "fast"],
+    "denoise_h": [5, 10, 15],
+    "median_ksize": [3, 5],
+    "adaptive_block": [15, 21, 31, 41, 51],
+    "adaptive_c": [10, 15, 20, 25, 30],
+    "erosion_kernel": [(1, 1), (2, 2), (3, 3)],
+    "close_kernel": [(1, 1), (3, 3)],
+    "clahe_clip": [0, 1.0, 2.0, 3.0],
+    "remove_lines": [False, True],
+    "line_method": list(LINE_METHODS),
+    "line_kernel_factor": [20, 30, 50],
+}
+
+
+def _canonical(params):
+    """Drop knobs the configuration ignores, so equivalent configurations are only measured once."""
+    p = dict(params)
+    if p.get("profile", "quality") == "fast":
+        p.pop("denoise_h", None)
+    else:
+        p.pop("median_ksize", None)
+    if not p.get("remove_lines"):
+        p.pop("line_method", None)
+    if not p.get("remove_lines") or p.get("line_method", "projection") != "inpaint":
+        p.pop("line_kernel_factor", None)
+    return p
+
+
+def tune_candidates(search, params=None, trials=30, seed=0):
+    names = list(params or TUNE_SPACE)
+    if search == "grid":
+        combos = (dict(zip(names, values)) for values in itertools.product(*(TUNE_SPACE[n] for n in names)))
+    else:
+        rng = random.Random(seed)
+        combos = ({n: rng.choice(TUNE_SPACE[n]) for n in names} for _ in range(trials))
+    seen, out = set(), []
+    for combo in combos:
+        key = json.dumps(_canonical(combo), sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            out.append(_canonical(combo))
+    return out
+
+
+def load_fixtures(directory):
+    """
+    Labeled fixture pages: every image in `directory` with a `<stem>.ref.png` clean binary (ink = black)
+    and/or a `<stem>.txt` transcription next to it. Returns [(name, page, ref or None, text or None)].
+    """
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        stem, ext = os.path.splitext(path)
+        if ext.lower() not in (".png", ".jpg", ".jpeg", ".tif", ".tiff") or stem.endswith(".ref"):
+            continue
+        ref = cv2.imread(stem + ".ref.png", cv2.IMREAD_GRAYSCALE) if os.path.exists(stem + ".ref.png") else None
+        text = None
+        if os.path.exists(stem + ".txt"):
+            with open(stem + ".txt", encoding="utf-8") as fh:
+                text = fh.read()
+        fixtures.append((os.path.basename(stem), Image.open(path).convert("RGB"), ref, text))
+    return fixtures
+
+
+def ink_f1(binary, ref):
+    """F1 of predicted vs. reference ink pixels (ink = dark)."""
+    pred, truth = binary < 128, ref < 128
+    tp = np.count_nonzero(pred & truth)
+    denom = np.count_nonzero(pred) + np.count_nonzero(truth)
+    return 2.0 * tp / denom if denom else 1.0
+
+
+def _tesseract_text(binary):
+    import pytesseract  # optional local OCR stand-in; needs the tesseract binary
+    return pytesseract.image_to_string(Image.fromarray(binary))
+
+
+def pareto_front(trials):
+    """Trials no other trial beats on both runtime (lower) and quality (higher), fastest first."""
+    front = [t for t in trials
+             if not any(o["seconds"] <= t["seconds"] and o["quality"] >= t["quality"]
+                        and (o["seconds"] < t["seconds"] or o["quality"] > t["quality"]) for o in trials)]
+    return sorted(front, key=lambda t: t["seconds"])
+
+
+def bench_tune(args):
+    """
+    Grid / random search over simple_preprocess_page parameters. Each configuration is scored on every
+    fixture page by 'reference' (ink F1 against the clean binary), 'ocr' (local tesseract transcription vs.
+    the .txt label) or 'gemini' (Gemini transcription vs. the .txt label); runtime is the mean s/page.
+    Prints all trials with the Pareto front marked and the fastest configuration meeting --min-quality.
+    """
+    if args.fixtures:
+        fixtures = load_fixtures(args.fixtures)
+    else:
+        fixtures = [(f"synthetic_{i}", *synthetic_labeled_page(i, (1275, 1650)), None)
+                    for i in range(args.synthetic or 2)]
+    if not fixtures:
+        raise SystemExit(f"no fixture pages found in {args.fixtures}")
+    score = args.score or ("reference" if all(f[2] is not None for f in fixtures) else "ocr")
+    if score == "reference" and any(f[2] is None for f in fixtures):
+        raise SystemExit("--score reference needs a <name>.ref.png for every fixture page")
+    if score in ("ocr", "gemini") and any(f[3] is None for f in fixtures):
+        raise SystemExit(f"--score {score} needs a <name>.txt transcription for every fixture page")
+
+    abp = None
+    if score == "gemini":
+        import async_batch_pdf as abp  # needs GEMINI_API_KEY / GEMINI_MODEL
+
+    candidates = tune_candidates(args.search, args.params, args.trials, args.seed)
+    print(f"[+] {len(candidates)} configurations x {len(fixtures)} pages, scored by {score}")
+    trials = []
+    for n, params in enumerate(candidates, start=1):
+        times, scores = [], []
+        for name, page, ref, text in fixtures:
+            t0 = time.perf_counter()
+            binary = simple_preprocess_page(page, **params)['binary']
+            times.append(time.perf_counter() - t0)
+            if score == "reference":
+                scores.append(ink_f1(binary, ref))
+            elif score == "ocr":
+                scores.append(text_similarity(text, _tesseract_text(binary)))
+            else:
+                scores.append(text_similarity(text, _ocr_text(abp, binary_to_png_bytes(binary), "image/png")))
+        trials.append({"params": params, "seconds": float(np.mean(times)), "quality": float(np.mean(scores))})
+        print(f"    {n}/{len(candidates)} {np.mean(times):.2f}s q={np.mean(scores):.4f} {params}")
+
+    front = pareto_front(trials)
+    print(f"{'pareto':<7}{'s/page':>8}{'quality':>9}  params")
+    for t in sorted(trials, key=lambda t: t["seconds"]):
+        print(f"{'*' if t in front else '':<7}{t['seconds']:>8.2f}{t['quality']:>9.4f}  {t['params']}")
+    if args.min_quality is not None:
+        ok = [t for t in front if t["quality"] >= args.min_quality]
+        if ok:
+            print(f"[+] fastest with quality >= {args.min_quality}: {ok[0]['params']} "
+                  f"({ok[0]['seconds']:.2f}s/page, {ok[0]['quality']:.4f})")
+        else:
+            print(f"[-] no configuration reaches quality {args.min_quality}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump({"score": score, "trials": trials, "pareto": front}, fh, indent=2)
+        print(f"[+] wrote {args.out}")
+
+
+# ------------------ lines ------------------
+LINE_MODES = {
+    "none": {"remove_lines": False},
+    "inpaint": {"remove_lines": True, "line_method": "inpaint"},
+    "projection": {"remove_lines": True, "line_method": "projection"},
+}
+
+
+def bench_lines(args):
+    """
+    Ruled-line removal over a synthetic notebook (same ruling on every page): s/page, the overhead over
+    no line removal, and ink F1 against the line-free reference.
+    """
+    pages = [synthetic_labeled_page(i) for i in range(args.pages)]
+    print(f"[+] {len(pages)} pages {pages[0][0].size[0]}x{pages[0][0].size[1]}, profile {args.profile}")
+    print(f"{'mode':<18}{'s/page':>8}{'overhead':>9}{'ink F1':>8}")
+    base = None
+    for mode in args.modes:
+        times, f1 = [], []
+        for page, ref in pages:
+            t0 = time.perf_counter()
+            binary = simple_preprocess_page(page, profile=args.profile, **LINE_MODES[mode])['binary']
+            times.append(time.perf_counter() - t0)
+            f1.append(ink_f1(binary, ref))
+        secs = float(np.mean(times))
+        base = secs if mode == "none" else base
+        overhead = f"{secs - base:>+9.3f}" if base is not None else f"{'-':>9}"
+        print(f"{mode:<18}{secs:>8.3f}{overhead}{np.mean(f1):>8.4f}")
+
+
+# ------------------ auth-cache ------------------
+def bench_auth_cache(args):
+    """
+    p50/p99 latency of POST /documents/search, in process (TestClient), with the get_current_user cache
+    off and on, plus the cache hit ratio. Uses the configured database and Meilisearch; run with
+    OCR_WORKERS=0 so the app does not start OCR workers.
+    """
+    from fastapi.testclient import TestClient
+    from app import crud
+    from app.auth_utils import create_access_token
+    from app.config import AUTH_USER_CACHE_TTL_SECONDS, AUTH_USER_CACHE_SIZE
+    from app.db import SessionLocal
+    from app.main import app
+
+    db = SessionLocal()
+    try:
+        user = crud.get_user_by_email(db, args.email)
+    finally:
+        db.close()
+    if user is None:
+        raise SystemExit(f"no user with email {args.email}")
+    headers = {"Authorization": f"Bearer {create_access_token(str(user.id))}"}
+    queries = [args.query[:i] for i in range(1, len(args.query) + 1)]  # as typed, one request per keystroke
+
+    print(f"[+] {args.requests} searches per mode, queries {queries[0]!r}..{queries[-1]!r}")
+    print(f"{'cache':<6}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>8}{'non-200':>9}{'hit ratio':>11}")
+    with TestClient(app) as client:
+        for mode, size in (("off", 0), ("on", AUTH_USER_CACHE_SIZE or 1024)):
+            crud.configure_user_cache(AUTH_USER_CACHE_TTL_SECONDS or 30, size)
+            times, errors = [], 0
+            start = time.perf_counter()
+            for i in range(args.requests):
+                t0 = time.perf_counter()
+                resp = client.post("/documents/search", json={"q": queries[i % len(queries)], "limit": 10},
+                                   headers=headers)
+                times.append(time.perf_counter() - t0)
+                errors += resp.status_code != 200
+            wall = time.perf_counter() - start
+            ratio = crud.user_cache_stats()["hit_ratio"]
+            print(f"{mode:<6}{_percentile(times, 50) * 1000:>9.2f}{_percentile(times, 99) * 1000:>9.2f}"
+                  f"{args.requests / wall:>8.0f}{errors:>9}{ratio:>11.4f}")
+
+
+# ------------------ downloads ------------------
+async def _download_entries(client, bucket, user_id, book_ids):
+    from app.storage import list_folder
+
+    entries = []
+    for book_id in book_ids:
+        for item in await list_folder(client, bucket, f"{user_id}/{book_id}"):
+            meta = item.get("metadata") or {}
+            entries.append({"book_id": book_id, "object_path": f"{user_id}/{book_id}/{item['name']}",
+                            "arcname": f"{book_id}/{item['name']}", "mime": meta.get("mimetype"),
+                            "size": meta.get("size"), "version": meta.get("eTag")})
+    return entries
+
+
+async def _run_downloads(args, bucket, user_id, book_ids, served):
+    import httpx
+    from app.storage import get_client, close_client, zip_stream, sign_urls
+
+    client = get_client()
+    try:
+        entries = await _download_entries(client, bucket, user_id, book_ids)
+        total = sum(e["size"] for e in entries)
+        print(f"[+] {len(book_ids)} books, {len(entries)} files, {total / 1e6:.1f} MB")
+        print(f"{'mode':<16}{'seconds':>9}{'MB/s':>8}{'API MB':>8}{'peak MB':>9}  check")
+        for concurrency in args.concurrency:
+            failed = {}
+            with tempfile.TemporaryFile() as out:
+                before = served()
+                tracemalloc.start()
+                t0 = time.perf_counter()
+                async for chunk in zip_stream(client, bucket, entries, failed, concurrency=concurrency):
+                    out.write(chunk)
+                secs = time.perf_counter() - t0
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                proxied = served() - before
+                out.seek(0)
+                with zipfile.ZipFile(out) as zf:
+                    ok = zf.testzip() is None and sum(i.file_size for i in zf.infolist()) == total and not failed
+            print(f"{f'zip x{concurrency}':<16}{secs:>9.2f}{total / 1e6 / secs:>8.1f}{proxied / 1e6:>8.1f}"
+                  f"{peak / 1e6:>9.1f}  {'ok' if ok else 'MISMATCH'}")
+
+        # signed: the API only signs; the client reads every object straight from storage
+        t0 = time.perf_counter()
+        links = await sign_urls(client, bucket, [e["object_path"] for e in entries])
+        sem = asyncio.Semaphore(max(args.concurrency))
+        async with httpx.AsyncClient() as direct:
+            async def fetch(entry):
+                async with sem:
+                    resp = await direct.get(links[entry["object_path"]])
+                    return resp.status_code == 200 and len(resp.content) == entry["size"]
+            ok = all(await asyncio.gather(*(fetch(e) for e in entries)))
+        secs = time.perf_counter() - t0
+        print(f"{'signed':<16}{secs:>9.2f}{total / 1e6 / secs:>8.1f}{0:>8.1f}{'-':>9}  {'ok' if ok else 'MISMATCH'}")
+    finally:
+        await close_client()
+
+
+def bench_downloads(args):
+    """
+    ZIP export (zip_stream, bytes proxied through the API) at several concurrencies vs. signed URLs
+    (the client reads from storage), against the local storage stand-in (local_storage.py) filled with
+    random-content PDFs. Checks every archive; "API MB" is what passed through the API process.
+    """
+    import local_storage
+
+    root = tempfile.mkdtemp(prefix="local_storage_")
+    bucket, user_id = "pen_and_paper", "bench-user"
+    rng = np.random.default_rng(0)
+    book_ids = [f"book-{b}" for b in range(args.books)]
+    for book_id in book_ids:
+        folder = os.path.join(root, bucket, user_id, book_id)
+        os.makedirs(folder)
+        for f in range(args.files):
+            with open(os.path.join(folder, f"part_{f}.pdf"), "wb") as fh:
+                fh.write(rng.integers(0, 256, int(args.mb * 1e6), dtype=np.uint8).tobytes())
+    server = local_storage.serve(root, port=0, latency_ms=args.latency_ms)
+    # app.storage reads the storage location at import time
+    os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("SUPABASE_KEY", "local")
+    try:
+        asyncio.run(_run_downloads(args, bucket, user_id, book_ids, lambda: server.RequestHandlerClass.bytes_served))
+    finally:
+        server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# ------------------ CLI ------------------
+def main():
+    parser = argparse.ArgumentParser(description="OCR pipeline benchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_page_args(p):
+        p.add_argument("--pdf", help="PDF to take pages from (default: synthetic pages)")
+        p.add_argument("--pages", type=int, default=8, help="number of pages to use")
+        p.add_argument("--dpi", type=int, default=300)
+        p.add_argument("--synthetic", type=int, default=0, help="number of synthetic pages (ignores --pdf)")
+
+    p = sub.add_parser("preprocess-scaling", help="preprocessing throughput vs. worker count")
+    add_page_args(p)
+    p.add_argument("--workers", type=int, nargs="+", help="worker counts to try (default: 1 2 4 ncpu)")
+    p.set_defaults(func=bench_preprocess_scaling)
+
+    p = sub.add_parser("ocr-latency", help="per-page Gemini latency: inline image vs. Files API upload")
+    add_page_args(p)
+    p.add_argument("--mode", choices=["inline", "upload", "both"], default="both")
+    p.set_defaults(func=bench_ocr_latency)
+
+    p = sub.add_parser("encode", help="page image encoders: bytes, encode time, OCR similarity")
+    add_page_args(p)
+    p.add_argument("--formats", nargs="+", choices=IMAGE_FORMATS, default=list(IMAGE_FORMATS))
+    p.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9])
+    p.add_argument("--long-edges", type=int, nargs="+", default=[0, 2000, 1600])
+    p.add_argument("--ocr", action="store_true", help="also OCR every variant with Gemini (costs API calls)")
+    p.set_defaults(func=bench_encode)
+
+    p = sub.add_parser("profiles", help="preprocessing profiles: wall time, peak memory, accuracy")
+    add_page_args(p)
+    p.add_argument("--profiles", nargs="+", choices=PREPROCESS_PROFILES, default=list(PREPROCESS_PROFILES))
+    p.add_argument("--ocr", action="store_true", help="also compare Gemini transcriptions (costs API calls)")
+    p.set_defaults(func=bench_profiles)
+
+    p = sub.add_parser("dpi", help="fixed vs adaptive per-page DPI over mixed documents")
+    p.add_argument("--pdfs", nargs="+", help="documents to render (default: synthetic mixed fixtures)")
+    p.add_argument("--synthetic", type=int, default=0, help="pages per synthetic fixture document")
+    p.add_argument("--min-dpi", type=int, default=150)
+    p.add_argument("--max-dpi", type=int, default=300, help="also the fixed-mode DPI")
+    p.add_argument("--max-megapixels", type=float, default=9.0)
+    p.add_argument("--profile", choices=PREPROCESS_PROFILES, default="quality")
+    p.add_argument("--ocr", action="store_true", help="also compare Gemini transcriptions (costs API calls)")
+    p.set_defaults(func=bench_dpi)
+
+    p = sub.add_parser("tiles", help="tiled vs untiled preprocessing of a poster-size page")
+    p.add_argument("--megapixels", type=float, default=60)
+    p.add_argument("--tile-sizes", type=int, nargs="+", default=[1024, 2048])
+    p.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    p.add_argument("--profile", choices=PREPROCESS_PROFILES, default="fast")
+    p.set_defaults(func=bench_tiles)
+
+    p = sub.add_parser("tune", help="search preprocessing parameters; Pareto front of runtime vs. quality")
+    p.add_argument("--fixtures", help="labeled fixture directory (<page>.png + <page>.ref.png and/or <page>.txt)")
+    p.add_argument("--synthetic", type=int, default=0, help="number of synthetic labeled pages (no --fixtures)")
+    p.add_argument("--score", choices=["reference", "ocr", "gemini"],
+                   help="quality measure (default: reference if every page has a .ref.png, else ocr)")
+    p.add_argument("--search", choices=["grid", "random"], default="random")
+    p.add_argument("--params", nargs="+", choices=list(TUNE_SPACE), help="knobs to vary (default: all)")
+    p.add_argument("--trials", type=int, default=30, help="random search: number of samples")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--min-quality", type=float, help="report the fastest configuration at or above this quality")
+    p.add_argument("--out", help="write all trials and the Pareto front as JSON")
+    p.set_defaults(func=bench_tune)
+
+    p = sub.add_parser("lines", help="ruled-line removal methods: time per page and accuracy")
+    p.add_argument("--pages", type=int, default=6)
+    p.add_argument("--profile", choices=PREPROCESS_PROFILES, default="fast")
+    p.add_argument("--modes", nargs="+", choices=list(LINE_MODES), default=list(LINE_MODES))
+    p.set_defaults(func=bench_lines)
+
+    p = sub.add_parser("auth-cache", help="/documents/search p50/p99 latency with and without the user cache")
+    p.add_argument("--email", required=True, help="existing user to authenticate as")
+    p.add_argument("--requests", type=int, default=300, help="searches per mode")
+    p.add_argument("--query", default="meeting notes", help="typed one character per request")
+    p.set_defaults(func=bench_auth_cache)
+
+    p = sub.add_parser("downloads", help="ZIP export vs. signed URLs against the local storage stand-in")
+    p.add_argument("--books", type=int, default=4)
+    p.add_argument("--files", type=int, default=3, help="PDF parts per book")
+    p.add_argument("--mb", type=float, default=8, help="size of each part")
+    p.add_argument("--latency-ms", type=float, default=20, help="simulated storage round trip")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="zip_stream concurrencies to try")
+    p.set_defaults(func=bench_downloads)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+local_storage.py
+Local stand-in for the part of the Supabase Storage REST API used by app/storage.py, for trying the
+download endpoints (and benchmark.py downloads) without a Supabase project:
+- POST /storage/v1/object/list/<bucket>       folder listing (files with size / mimetype / eTag, sub-folders)
+- GET  /storage/v1/object/<bucket>/<path>     object read, with Range (206 / 416)
+- POST /storage/v1/object/sign/<bucket>       signed URLs ({"expiresIn", "paths"})
+- GET  /storage/v1/object/sign/<bucket>/<path>?token=...[&download=name]   signed read, no API key
+Objects are plain files under <root>/<bucket>/<path>; seed it by copying PDFs into
+<root>/<bucket>/<user_id>/<book_id>/. Uploads are not supported.
+
+Usage:
+    python local_storage.py --root ./local_bucket --port 8765 [--latency-ms 20]
+    SUPABASE_URL=http://127.0.0.1:8765 SUPABASE_KEY=local uvicorn app.main:app
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import quote, unquote, parse_qs, urlsplit
+
+CHUNK_SIZE = 64 * 1024
+
+
+class LocalStorageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    root: Path = Path(".")
+    secret: bytes = b"local-storage"
+    latency: float = 0.0  # seconds added to every request (simulated storage round trip)
+    bytes_served = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status: int, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _file(self, bucket: str, path: str) -> Path:
+        target = (self.root / bucket / path).resolve()
+        if not str(target).startswith(str(self.root.resolve())):
+            raise ValueError("path outside the storage root")
+        return target
+
+    def _token(self, bucket: str, path: str, expires: int) -> str:
+        return hmac.new(self.secret, f"{bucket}/{path}:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._json(400, {"error": "invalid json"})
+        sign = re.fullmatch(r"/storage/v1/object/sign/([^/]+)", self.path)
+        if sign:
+            return self._sign(unquote(sign.group(1)), body)
+        listing = re.fullmatch(r"/storage/v1/object/list/([^/]+)", self.path)
+        if listing:
+            return self._list(unquote(listing.group(1)), body)
+        self._json(404, {"error": "not found"})
+
+    def _list(self, bucket: str, body):
+        folder = self._file(bucket, body.get("prefix", ""))
+        offset, limit = int(body.get("offset", 0)), int(body.get("limit", 100))
+        items = []
+        if folder.is_dir():
+            for child in sorted(folder.iterdir(), key=lambda p: p.name)[offset:offset + limit]:
+                if child.is_dir():
+                    items.append({"name": child.name, "id": None, "metadata": None})
+                    continue
+                st = child.stat()
+                items.append({
+                    "name": child.name, "id": child.name, "updated_at": str(st.st_mtime),
+                    "metadata": {"size": st.st_size, "mimetype": mimetypes.guess_type(child.name)[0],
+                                 "eTag": f'"{st.st_mtime_ns}-{st.st_size}"'},
+                })
+        self._json(200, items)
+
+    def _sign(self, bucket: str, body):
+        expires = int(time.time()) + int(body.get("expiresIn", 60))
+        signed = []
+        for path in body.get("paths", []):
+            if not self._file(bucket, path).is_file():
+                signed.append({"path": path, "signedURL": None,
+                               "error": "Either the object does not exist or you do not have access to it"})
+                continue
+            token = f"{self._token(bucket, path, expires)}.{expires}"
+            signed.append({"path": path, "error": None,
+                           "signedURL": f"/object/sign/{quote(bucket)}/{quote(path)}?token={token}"})
+        self._json(200, signed)
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlsplit(self.path)
+        download_name = None
+        signed = re.fullmatch(r"/storage/v1/object/sign/([^/]+)/(.+)", url.path)
+        plain = re.fullmatch(r"/storage/v1/object/([^/]+)/(.+)", url.path)
+        if signed:
+            bucket, path = unquote(signed.group(1)), unquote(signed.group(2))
+            query = parse_qs(url.query)
+            token, _, expires = query.get("token", [""])[0].partition(".")
+            if not expires.isdigit() or int(expires) < time.time() or \
+                    not hmac.compare_digest(token, self._token(bucket, path, int(expires))):
+                return self._json(400, {"statusCode": "400", "error": "InvalidJWT"})
+            download_name = query.get("download", [None])[0]
+        elif plain:
+            if not self.headers.get("Authorization"):
+                return self._json(400, {"statusCode": "400", "error": "Missing authorization"})
+            bucket, path = unquote(plain.group(1)), unquote(plain.group(2))
+        else:
+            return self._json(404, {"error": "not found"})
+        target = self._file(bucket, path)
+        if not target.is_file():
+            # like Supabase: a missing object is a 400 with a JSON body
+            return self._json(400, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+        self._send_file(target, download_name)
+
+    def _send_file(self, target: Path, download_name):
+        size = target.stat().st_size
+        start, end, status = 0, size - 1, 200
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", mimetypes.guess_type(target.name)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", f'"{target.stat().st_mtime_ns}-{size}"')
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        if download_name:
+            self.send_header("Content-Disposition", f'attachment; filename="{download_name}"')
+        self.end_headers()
+        with open(target, "rb") as fh:
+            fh.seek(start)
+            left = end - start + 1
+            while left > 0:
+                chunk = fh.read(min(CHUNK_SIZE, left))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                left -= len(chunk)
+                type(self).bytes_served += len(chunk)
+
+
+def serve(root, host: str = "127.0.0.1", port: int = 8765, latency_ms: float = 0.0) -> ThreadingHTTPServer:
+    """Start the stand-in on a background thread; returns the server (server_address, shutdown())."""
+    handler = type("Handler", (LocalStorageHandler,), {"root": Path(root), "latency": latency_ms / 1000.0})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default="local_bucket", help="directory holding <bucket>/<path> objects")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every request")
+    args = parser.parse_args()
+    os.makedirs(args.root, exist_ok=True)
+    server = serve(args.root, args.host, args.port, args.latency_ms)
+    print(f"[+] serving {os.path.abspath(args.root)} as Supabase Storage on http://{args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
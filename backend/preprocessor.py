@@ -5,12 +5,22 @@ Simplified PDF page preprocessor for handwriting OCR.
 
 Usage:
     python preprocessor.py input.pdf out_dir --dpi 300
+    python preprocessor.py scans/ "archive/**/*.pdf" out_dir --workers 8 --profile fast   # batch mode
 
 #     best result : python preprocessor.py "Adobe_Scan.pdf" out_dir2 --dpi300 --clahe-clip 0
 """
+import glob
+import io
+import multiprocessing
 import os
+import re
+import shutil
+import subprocess
 import argparse
-from pdf2image import convert_from_path
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+from pdf2image import convert_from_path, pdfinfo_from_path
 import numpy as np
 import cv2
 from PIL import Image
@@ -31,7 +41,321 @@ def cv2_to_pil(img):
     return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
 
 
+def binary_to_png_bytes(img):
+    buf = io.BytesIO()
+    cv2_to_pil(img).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+IMAGE_FORMATS = ("png", "png1", "webp")
+
+
+def encode_page_image(img, fmt="png", compress_level=6, max_long_edge=0):
+    """
+    Encode a preprocessed (binary, uint8 0/255) page for upload.
+    - fmt: 'png' (8-bit grayscale), 'png1' (1-bit PNG) or 'webp' (lossless WebP)
+    - compress_level: 0-9 zlib level for PNG; mapped to WebP method 0-6
+    - max_long_edge: downscale (INTER_AREA) so the longer side is at most this many pixels; 0 keeps size
+    """
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"unknown image format {fmt!r}; expected one of {IMAGE_FORMATS}")
+    h, w = img.shape[:2]
+    if max_long_edge and max(h, w) > max_long_edge:
+        scale = max_long_edge / float(max(h, w))
+        img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    pil = cv2_to_pil(img)
+    buf = io.BytesIO()
+    if fmt == "png1":
+        # binarize again after a downscale; threshold (not dithering) keeps strokes crisp
+        pil.point(lambda v: 255 if v >= 128 else 0).convert("1", dither=Image.Dither.NONE).save(
+            buf, format="PNG", compress_level=compress_level)
+    elif fmt == "webp":
+        pil.save(buf, format="WEBP", lossless=True, quality=100, method=min(6, max(0, int(compress_level))))
+    else:
+        pil.save(buf, format="PNG", compress_level=compress_level)
+    return buf.getvalue()
+
+
+# ------------------ per-page DPI selection ------------------
+def parse_pdfimages_list(out):
+    """{page: (ppi, square inches)} from `pdfimages -list` output; ppi is the lowest among the page's images."""
+    pages = {}
+    for line in out.splitlines():
+        # page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+        cols = line.split()
+        if len(cols) < 14 or not cols[0].isdigit() or cols[2] != "image":
+            continue
+        try:
+            width, height = int(cols[3]), int(cols[4])
+            x_ppi, y_ppi = float(cols[12]), float(cols[13])
+        except ValueError:
+            continue
+        if x_ppi <= 0 or y_ppi <= 0:
+            continue
+        page = int(cols[0])
+        ppi, area = pages.get(page, (float("inf"), 0.0))
+        pages[page] = (min(ppi, x_ppi, y_ppi), area + (width / x_ppi) * (height / y_ppi))
+    return pages
+
+
+def embedded_images(pdf_path):
+    """Embedded raster images per page via `pdfimages -list` (poppler, no rendering); {} if unavailable."""
+    exe = shutil.which("pdfimages")
+    if exe is None:
+        return {}
+    try:
+        out = subprocess.run([exe, "-list", pdf_path], capture_output=True, text=True, timeout=60).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    return parse_pdfimages_list(out)
+
+
+_PDFINFO_PAGE_RE = re.compile(r"^Page\s+(\d+)\s+(size|rot):\s+(.*)$")
+
+
+def parse_pdfinfo_pages(out):
+    """{page: (width, height) in inches, as rendered (rotation applied)} from `pdfinfo -f A -l B` output."""
+    sizes, rotation = {}, {}
+    for line in out.splitlines():
+        m = _PDFINFO_PAGE_RE.match(line.strip())
+        if not m:
+            continue
+        page, key, value = int(m.group(1)), m.group(2), m.group(3).split()
+        try:
+            if key == "size":  # "612 x 792 pts (letter)"
+                sizes[page] = (float(value[0]) / 72.0, float(value[2]) / 72.0)
+            else:
+                rotation[page] = int(float(value[0]))
+        except (ValueError, IndexError):
+            continue
+    return {page: (h, w) if rotation.get(page, 0) % 180 else (w, h) for page, (w, h) in sizes.items()}
+
+
+def page_sizes_inches(pdf_path, last_page, first_page=1):
+    """Page sizes of pages first_page..last_page from a single `pdfinfo` call (no rendering); {} if unavailable."""
+    exe = shutil.which("pdfinfo")
+    if exe is None:
+        return {}
+    try:
+        out = subprocess.run([exe, "-f", str(first_page), "-l", str(last_page), pdf_path],
+                             capture_output=True, text=True, timeout=60).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    return parse_pdfinfo_pages(out)
+
+
+def choose_page_dpi(page_inches, image=None, min_dpi=150, max_dpi=300, max_pixels=9_000_000):
+    """
+    DPI to render a page at, within [min_dpi, max_dpi]:
+    - a scanned page (embedded images, `image` = (ppi, square inches), cover most of it) gains nothing
+      above the scan's own resolution;
+    - a large page is capped at max_pixels instead of getting max_dpi over its whole area.
+    """
+    w_in, h_in = page_inches
+    dpi = float(max_dpi)
+    if image is not None:
+        ppi, image_area = image
+        if image_area >= 0.5 * w_in * h_in:
+            dpi = min(dpi, ppi)
+    if w_in > 0 and h_in > 0:
+        dpi = min(dpi, (max_pixels / (w_in * h_in)) ** 0.5)
+    return int(max(min_dpi, min(max_dpi, round(dpi))))
+
+
+# ------------------ page signals (blank / near-duplicate pre-filter) ------------------
+PAGE_HASH_SIZE = 16  # difference hash of PAGE_HASH_SIZE x PAGE_HASH_SIZE bits
+
+
+def ink_ratio(binary, gray=None, line_fraction=0.5, min_contrast=40):
+    """
+    Fraction of ink (dark) pixels in a binary page, ignoring rows / columns that are mostly ink:
+    ruled lines, margin lines and dark scan borders would otherwise make an empty page look written on.
+    With `gray` (the page before normalization) a pixel only counts as ink if it is also at least
+    `min_contrast` levels darker than the paper: normalizing a blank page stretches scanner noise
+    into speckle that survives binarization.
+    """
+    ink = binary < 128
+    if gray is not None:
+        paper = float(np.median(gray[::4, ::4]))
+        ink &= gray < paper - min_contrast
+    rows = ink.sum(axis=1)
+    cols = ink.sum(axis=0)
+    h, w = ink.shape
+    keep_rows = rows < line_fraction * w
+    keep_cols = cols < line_fraction * h
+    return float(ink[keep_rows][:, keep_cols].sum()) / max(1, ink.size)
+
+
+def page_hash(binary, hash_size=PAGE_HASH_SIZE):
+    """
+    Perceptual difference hash (hex string) of a binary page, computed on the bounding box of the ink
+    so the same page scanned with a slightly different offset hashes (nearly) the same.
+    """
+    x, y, w, h = cv2.boundingRect(cv2.bitwise_not(binary))
+    crop = binary[y:y + h, x:x + w] if w and h else binary
+    small = cv2.resize(crop, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits).tobytes().hex()
+
+
+def hash_distance(a, b):
+    """Hamming distance between two page_hash() values."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def page_signals(binary, gray=None):
+    return {"ink_ratio": ink_ratio(binary, gray), "phash": page_hash(binary)}
+
+
+# ------------------ shared-memory hand-off for process pools ------------------
+def page_to_shared_memory(pil_page):
+    """
+    Copy a page image into a new shared-memory block.
+    Returns (shm, shape, dtype_str); the caller must close() and unlink() the block when done.
+    """
+    arr = np.asarray(pil_page)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[...] = arr
+    del view
+    return shm, arr.shape, arr.dtype.str
+
+
+def preprocess_shared_page(shm_name, shape, dtype, preprocess_kwargs=None, encode_kwargs=None,
+                           with_signals=False):
+    """
+    Process-pool entry point: attach to a page the parent placed in shared memory,
+    preprocess it and return the final binary image encoded with encode_page_image(**encode_kwargs)
+    (with_signals: a tuple (encoded, page_signals(binary))).
+    Only the small encoded image is pickled back to the parent.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        page = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+        res = simple_preprocess_page(page, **(preprocess_kwargs or {}))
+        del page
+    finally:
+        shm.close()
+    encoded = encode_page_image(res['binary'], **(encode_kwargs or {}))
+    if with_signals:
+        return encoded, page_signals(res['binary'], res.get('gray'))
+    return encoded
+
+
 # ------------------ simplified processing (from your Colab steps) ------------------
+PREPROCESS_PROFILES = ("quality", "fast")
+
+
+def _detect_and_inpaint_lines(contrast, adaptive_block, adaptive_c, line_kernel_factor, inpaint_radius):
+    """
+    Detect horizontal ruled lines and inpaint them (uses morphological open on a binary inverse).
+    Returns (inpainted, line_mask).
+    """
+    # create a temporary binary inverted image where strokes (text & lines) are white
+    # Use a slightly more global adaptive method for stable line detection
+    tmp_block = adaptive_block if adaptive_block % 2 == 1 and adaptive_block > 1 else 31
+    binary_inv = cv2.adaptiveThreshold(contrast, 255,
+                                       cv2.ADAPTIVE_THRESH_MEAN_C,
+                                       cv2.THRESH_BINARY_INV,
+                                       blockSize=tmp_block,
+                                       C=adaptive_c)
+
+    # build a horizontal kernel whose length scales with image width
+    h, w = binary_inv.shape
+    kernel_len = max(3, w // int(max(1, line_kernel_factor)))
+    horiz_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_len, 1))
+
+    # morphological open to keep only long horizontal components (i.e. ruled lines)
+    detected_horiz = cv2.morphologyEx(binary_inv, cv2.MORPH_OPEN, horiz_kernel, iterations=1)
+
+    # Optionally dilate the detected lines a tiny bit so we cover line thickness
+    line_mask = cv2.dilate(detected_horiz, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)), iterations=1)
+
+    # inpaint the contrast image to remove lines but preserve surrounding handwriting
+    # inpaint expects mask with non-zero pixels = area to inpaint
+    if np.max(line_mask) > 0:
+        return cv2.inpaint(contrast, line_mask, inpaintRadius=inpaint_radius, flags=cv2.INPAINT_TELEA), line_mask
+    # nothing detected, keep original contrast
+    return contrast, line_mask
+
+
+# ---------- fast ruled-line removal: projection profiles + local fill ----------
+LINE_METHODS = ("projection", "inpaint")
+
+
+def _dark_mask(img, delta=25):
+    """1 where a pixel is clearly darker than the paper (median of a subsample)."""
+    paper = float(np.median(img[::4, ::4]))
+    return (img < paper - delta).view(np.uint8)
+
+
+def detect_ruled_lines(img, strips=8, min_coverage=0.5, max_thickness=12):
+    """
+    Ruled lines from horizontal projection profiles: in each of `strips` vertical strips, rows where
+    at least `min_coverage` of the pixels are darker than the paper, in runs of at most `max_thickness`
+    rows (thicker runs are text or drawings). Per-strip profiles follow slightly skewed lines.
+    Returns [(x0, x1, y0, y1), ...] bands (padded by one row) to fill with fill_ruled_lines.
+    """
+    h, w = img.shape
+    dark = _dark_mask(img)
+    bands = []
+    bounds = np.linspace(0, w, max(1, int(strips)) + 1).astype(int)
+    for x0, x1 in zip(bounds[:-1], bounds[1:]):
+        if x1 <= x0:
+            continue
+        prof = cv2.reduce(dark[:, x0:x1], 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+        rows = np.flatnonzero(prof >= min_coverage * (x1 - x0))
+        if not rows.size:
+            continue
+        # split the line rows into runs of consecutive rows
+        breaks = np.flatnonzero(np.diff(rows) > 1)
+        for start, end in zip(np.r_[rows[0], rows[breaks + 1]], np.r_[rows[breaks], rows[-1]]):
+            if end - start + 1 <= max_thickness:
+                bands.append((int(x0), int(x1), max(0, int(start) - 1), min(h, int(end) + 2)))
+    return bands
+
+
+def fill_ruled_lines(img, bands):
+    """
+    In place: replace each band with the average of the rows just above and below it, so strokes that
+    cross a line stay connected while the line itself becomes paper (a cheap stand-in for cv2.inpaint).
+    """
+    h = img.shape[0]
+    for x0, x1, y0, y1 in bands:
+        if y1 <= y0:
+            continue
+        above = img[max(0, y0 - 1), x0:x1].astype(np.uint16)
+        below = img[min(h - 1, y1), x0:x1].astype(np.uint16)
+        img[y0:y1, x0:x1] = ((above + below) // 2).astype(np.uint8)
+    return img
+
+
+def ruled_lines_mask(shape, bands):
+    mask = np.zeros(shape, dtype=np.uint8)
+    for x0, x1, y0, y1 in bands:
+        mask[y0:y1, x0:x1] = 255
+    return mask
+
+
+def _normalize(gray, norm_range=None):
+    """Stretch to 0-255 like cv2.normalize(NORM_MINMAX), optionally with a given (min, max) instead of the image's."""
+    if norm_range is None:
+        return cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
+    lo, hi = norm_range
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+    return cv2.convertScaleAbs(gray, alpha=scale, beta=-lo * scale)
+
+
+def _odd_block(adaptive_block):
+    # ensure block size is odd and >1
+    if adaptive_block % 2 == 0:
+        adaptive_block += 1
+    if adaptive_block <= 1:
+        adaptive_block = 3
+    return adaptive_block
+
+
 def simple_preprocess_page(pil_page,
                            denoise_h=10,
                            erosion_kernel=(2, 2),
@@ -43,19 +367,49 @@ def simple_preprocess_page(pil_page,
                            remove_lines=False,
                            line_kernel_factor=30,
                            inpaint_radius=3,
-                           save_steps=False):
+                           save_steps=False,
+                           profile="quality",
+                           median_ksize=3,
+                           norm_range=None,
+                           line_method="projection",
+                           tile_above_pixels=0,
+                           tile_size=1024,
+                           tile_workers=None):
     """
     Perform:
       grayscale -> normalize -> denoise -> (optional CLAHE) ->
       (optional line detection & inpaint) -> erosion ->
       adaptive threshold -> close
 
-    - remove_lines: if True, detect horizontal ruled lines and inpaint them (uses morphological open on a binary inverse).
-    - line_kernel_factor: determines horizontal kernel length = img_width // line_kernel_factor (tuneable).
-    - inpaint_radius: radius passed to cv2.inpaint when filling removed lines.
+    - remove_lines: if True, detect horizontal ruled lines and remove them.
+    - line_method: 'projection' (projection profiles + fill_ruled_lines, fast) or 'inpaint'
+      (morphological open on a binary inverse + cv2.inpaint, slow on large masks).
+    - line_kernel_factor: 'inpaint' only; horizontal kernel length = img_width // line_kernel_factor (tuneable).
+    - inpaint_radius: 'inpaint' only; radius passed to cv2.inpaint when filling removed lines.
+    - profile: 'quality' denoises with fastNlMeansDenoising; 'fast' uses a median filter (median_ksize)
+      and works in place on a single buffer (see fast_preprocess_page). save_steps always uses 'quality'.
+    - norm_range: (min, max) to normalize with instead of this image's own (used for tiles of a page).
+    - tile_above_pixels: pages with more pixels than this are processed as overlapping tiles
+      (see tiled_preprocess_page; ignored with save_steps); 0 never tiles.
 
     Returns a dict with intermediate results (all as uint8 numpy arrays).
     """
+    if profile not in PREPROCESS_PROFILES:
+        raise ValueError(f"unknown preprocess profile {profile!r}; expected one of {PREPROCESS_PROFILES}")
+    if tile_above_pixels and not save_steps and _page_pixels(pil_page) > tile_above_pixels:
+        return tiled_preprocess_page(pil_page, tile_size=tile_size, workers=tile_workers, denoise_h=denoise_h,
+                                     erosion_kernel=erosion_kernel, adaptive_block=adaptive_block,
+                                     adaptive_c=adaptive_c, close_kernel=close_kernel, clahe_clip=clahe_clip,
+                                     clahe_grid=clahe_grid, remove_lines=remove_lines,
+                                     line_kernel_factor=line_kernel_factor, inpaint_radius=inpaint_radius,
+                                     profile=profile, median_ksize=median_ksize, line_method=line_method)
+    if profile == "fast" and not save_steps:
+        return fast_preprocess_page(pil_page, erosion_kernel=erosion_kernel, adaptive_block=adaptive_block,
+                                    adaptive_c=adaptive_c, close_kernel=close_kernel, clahe_clip=clahe_clip,
+                                    clahe_grid=clahe_grid, remove_lines=remove_lines,
+                                    line_kernel_factor=line_kernel_factor, inpaint_radius=inpaint_radius,
+                                    median_ksize=median_ksize, norm_range=norm_range, line_method=line_method)
+
     img = pil_to_cv2(pil_page)
     # grayscale
     if img.ndim == 3:
@@ -64,7 +418,7 @@ def simple_preprocess_page(pil_page,
         gray = img.copy()
 
     # normalize to full 0-255 range
-    norm = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
+    norm = _normalize(gray, norm_range)
     norm = norm.astype(np.uint8)
 
     # denoise (fastNlMeansDenoising)
@@ -76,66 +430,40 @@ def simple_preprocess_page(pil_page,
         clahe = cv2.createCLAHE(clipLimit=float(clahe_clip), tileGridSize=(int(tgx), int(tgy)))
         contrast = clahe.apply(denoised)
     else:
-        contrast = denoised.copy()
+        # nothing below modifies these arrays in place, so aliasing instead of copying is safe
+        contrast = denoised
 
     # ---------- optional line detection + inpaint ----------
     line_mask = None
-    inpainted = contrast.copy()
-    if remove_lines:
-        # create a temporary binary inverted image where strokes (text & lines) are white
-        # Use a slightly more global adaptive method for stable line detection
-        tmp_block = adaptive_block if adaptive_block % 2 == 1 and adaptive_block > 1 else 31
-        binary_inv = cv2.adaptiveThreshold(contrast, 255,
-                                           cv2.ADAPTIVE_THRESH_MEAN_C,
-                                           cv2.THRESH_BINARY_INV,
-                                           blockSize=tmp_block,
-                                           C=adaptive_c)
-
-        # build a horizontal kernel whose length scales with image width
-        h, w = binary_inv.shape
-        kernel_len = max(3, w // int(max(1, line_kernel_factor)))
-        horiz_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_len, 1))
-
-        # morphological open to keep only long horizontal components (i.e. ruled lines)
-        detected_horiz = cv2.morphologyEx(binary_inv, cv2.MORPH_OPEN, horiz_kernel, iterations=1)
-
-        # Optionally dilate the detected lines a tiny bit so we cover line thickness
-        detected_horiz = cv2.dilate(detected_horiz, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)), iterations=1)
-
-        # line_mask must be single-channel non-zero where lines exist (for inpaint)
-        line_mask = detected_horiz.copy()
-
-        # inpaint the contrast image to remove lines but preserve surrounding handwriting
-        # inpaint expects mask with non-zero pixels = area to inpaint
-        # ensure mask is 8-bit single channel
-        if np.max(line_mask) > 0:
-            inpainted = cv2.inpaint(contrast, line_mask, inpaintRadius=inpaint_radius, flags=cv2.INPAINT_TELEA)
-        else:
-            # nothing detected, keep original contrast
-            inpainted = contrast.copy()
+    inpainted = contrast
+    if remove_lines and line_method == "inpaint":
+        inpainted, line_mask = _detect_and_inpaint_lines(contrast, adaptive_block, adaptive_c,
+                                                         line_kernel_factor, inpaint_radius)
+    elif remove_lines:
+        bands = detect_ruled_lines(contrast)
+        inpainted = fill_ruled_lines(contrast.copy(), bands)
+        if save_steps:
+            line_mask = ruled_lines_mask(contrast.shape, bands)
 
     # thinning via erosion
     k_erode = cv2.getStructuringElement(cv2.MORPH_RECT, erosion_kernel)
     eroded = cv2.erode(inpainted, k_erode, iterations=1)
 
-    # ensure block size is odd and >1
-    if adaptive_block % 2 == 0:
-        adaptive_block += 1
-    if adaptive_block <= 1:
-        adaptive_block = 3
-
     # adaptive binarization (final)
     binary = cv2.adaptiveThreshold(eroded, 255,
                                    cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
                                    cv2.THRESH_BINARY,
-                                   blockSize=adaptive_block,
+                                   blockSize=_odd_block(adaptive_block),
                                    C=adaptive_c)
 
     # morphological closing to fill small holes
     k_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, close_kernel)
     closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, k_close, iterations=1)
 
-    results = {
+    if not save_steps:
+        return {'gray': gray.astype(np.uint8), 'binary': closed}
+
+    return {
         'gray': gray.astype(np.uint8),
         'normalized': norm,
         'denoised': denoised,
@@ -147,10 +475,128 @@ def simple_preprocess_page(pil_page,
         'closed': closed
     }
 
-    if not save_steps:
-        return {'gray': results['gray'], 'binary': results['closed']}
 
-    return results
+def fast_preprocess_page(pil_page,
+                         erosion_kernel=(2, 2),
+                         adaptive_block=31,
+                         adaptive_c=20,
+                         close_kernel=(3, 3),
+                         clahe_clip=0,
+                         clahe_grid=(8, 8),
+                         remove_lines=False,
+                         line_kernel_factor=30,
+                         inpaint_radius=3,
+                         median_ksize=3,
+                         norm_range=None,
+                         line_method="projection"):
+    """
+    'fast' profile of simple_preprocess_page: same steps, but a median filter replaces
+    fastNlMeansDenoising (the dominant cost) and every step writes into one working buffer,
+    so besides the grayscale page only the final binary image is allocated.
+    Returns {'gray', 'binary'} like simple_preprocess_page(save_steps=False).
+    """
+    img = pil_to_cv2(pil_page)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    gray = np.ascontiguousarray(gray, dtype=np.uint8)
+    del img
+
+    work = _normalize(gray, norm_range)
+    if median_ksize and median_ksize > 1:
+        cv2.medianBlur(work, int(median_ksize) | 1, dst=work)
+
+    if clahe_clip is not None and clahe_clip > 0:
+        tgx, tgy = clahe_grid if isinstance(clahe_grid, (list, tuple)) and len(clahe_grid) == 2 else (8, 8)
+        cv2.createCLAHE(clipLimit=float(clahe_clip), tileGridSize=(int(tgx), int(tgy))).apply(work, dst=work)
+
+    if remove_lines and line_method == "inpaint":
+        work, _ = _detect_and_inpaint_lines(work, adaptive_block, adaptive_c, line_kernel_factor, inpaint_radius)
+    elif remove_lines:
+        fill_ruled_lines(work, detect_ruled_lines(work))
+
+    cv2.erode(work, cv2.getStructuringElement(cv2.MORPH_RECT, erosion_kernel), dst=work, iterations=1)
+    binary = cv2.adaptiveThreshold(work, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                   blockSize=_odd_block(adaptive_block), C=adaptive_c)
+    del work
+    cv2.morphologyEx(binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, close_kernel),
+                     dst=binary, iterations=1)
+    return {'gray': gray, 'binary': binary}
+
+
+# ------------------ tiled processing for very large pages ------------------
+def _page_pixels(page):
+    if isinstance(page, np.ndarray):
+        return page.shape[0] * page.shape[1]
+    w, h = page.size
+    return w * h
+
+
+def tile_overlap(denoise_h=10, adaptive_block=31, erosion_kernel=(2, 2), close_kernel=(3, 3),
+                 remove_lines=False, inpaint_radius=3, median_ksize=3, line_method="projection", **_):
+    """
+    Margin (pixels) around each tile so every output pixel sees the same neighbourhood as in the
+    untiled run: the sum of the radii of the chained filters (NLM search window 21 + template 7,
+    adaptive threshold blocks, line-removal dilate + inpaint, erosion and closing).
+    """
+    block = _odd_block(adaptive_block) // 2
+    radius = max(10 + 3, int(median_ksize) // 2)  # fastNlMeansDenoising defaults: search 21, template 7
+    radius += max(erosion_kernel) + block + max(close_kernel)
+    if remove_lines and line_method == "inpaint":
+        radius += block + 1 + int(inpaint_radius) + 1
+    elif remove_lines:
+        radius += 12 + 2  # a band (max_thickness + padding) and the rows around it
+    return radius + 8
+
+
+def _banded_gray(page, band):
+    """Grayscale copy of a PIL page converted `band` rows at a time (no full-size RGB array)."""
+    if isinstance(page, np.ndarray):
+        return cv2.cvtColor(page, cv2.COLOR_RGB2GRAY) if page.ndim == 3 else np.ascontiguousarray(page, np.uint8)
+    w, h = page.size
+    gray = np.empty((h, w), dtype=np.uint8)
+    for y in range(0, h, band):
+        rows = np.asarray(page.crop((0, y, w, min(h, y + band))))
+        gray[y:y + rows.shape[0]] = cv2.cvtColor(rows, cv2.COLOR_RGB2GRAY) if rows.ndim == 3 else rows
+    return gray
+
+
+def _preprocess_tile(gray, out, region, norm_range, kwargs):
+    """Preprocess gray[padded region] and copy its centre (the tile itself) into out."""
+    (y0, y1, x0, x1), (ty0, ty1, tx0, tx1) = region
+    res = simple_preprocess_page(gray[y0:y1, x0:x1], norm_range=norm_range, **kwargs)
+    out[ty0:ty1, tx0:tx1] = res['binary'][ty0 - y0:ty1 - y0, tx0 - x0:tx1 - x0]
+
+
+def tiled_preprocess_page(pil_page, tile_size=1024, overlap=None, workers=None, **kwargs):
+    """
+    simple_preprocess_page for very large pages: the page is split into tile_size x tile_size tiles,
+    each processed with an `overlap` margin (default tile_overlap(**kwargs)) and its centre stitched
+    into the output, so the binary page is seamless. Normalization uses the whole page's range.
+    Besides the grayscale page and the output, memory is bounded by `workers` padded tiles;
+    tiles run on a thread pool (OpenCV releases the GIL), workers defaults to the CPU count.
+    With remove_lines, tiles span the full page width so ruled-line detection sees whole lines.
+    CLAHE (clahe_clip > 0) and the paper level used by 'projection' line removal are estimated per tile,
+    so those options can differ slightly from the untiled result.
+    Returns {'gray', 'binary'} like simple_preprocess_page(save_steps=False).
+    """
+    gray = _banded_gray(pil_page, max(1, int(tile_size)))
+    h, w = gray.shape
+    margin = tile_overlap(**kwargs) if overlap is None else int(overlap)
+    tile_h = max(1, int(tile_size))
+    tile_w = w if kwargs.get('remove_lines') else tile_h
+    lo, hi = cv2.minMaxLoc(gray)[:2]
+
+    regions = []
+    for ty0 in range(0, h, tile_h):
+        for tx0 in range(0, w, tile_w):
+            ty1, tx1 = min(h, ty0 + tile_h), min(w, tx0 + tile_w)
+            padded = (max(0, ty0 - margin), min(h, ty1 + margin), max(0, tx0 - margin), min(w, tx1 + margin))
+            regions.append((padded, (ty0, ty1, tx0, tx1)))
+
+    out = np.empty_like(gray)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as ex:
+        for f in [ex.submit(_preprocess_tile, gray, out, r, (lo, hi), kwargs) for r in regions]:
+            f.result()
+    return {'gray': gray, 'binary': out}
 
 
 # ------------------ main runner ------------------
@@ -170,7 +616,7 @@ def pdf_to_images_and_preprocess(pdf_path, out_dir, dpi=300, **kwargs):
 
         # if user requested saving intermediate steps, save them too
         if kwargs.get('save_steps'):
-            for name in ('denoised', 'contrast', 'inpainted', 'line_mask', 'eroded'):
+            for name in STEP_NAMES:
                 if name in res:
                     p = os.path.join(out_dir, f"page_{i:03d}_{name}.png")
                     # ensure correct type for line_mask which might be None
@@ -180,51 +626,184 @@ def pdf_to_images_and_preprocess(pdf_path, out_dir, dpi=300, **kwargs):
     return out_files
 
 
+# ------------------ batch mode ------------------
+STEP_NAMES = ('denoised', 'contrast', 'inpainted', 'line_mask', 'eroded')
+
+
+def find_pdfs(inputs):
+    """PDF paths from files, directories (searched recursively) and glob patterns, sorted and de-duplicated."""
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            found.update(glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True))
+            found.update(glob.glob(os.path.join(item, "**", "*.PDF"), recursive=True))
+        elif os.path.isfile(item):
+            found.add(item)
+        else:
+            found.update(p for p in glob.glob(item, recursive=True) if p.lower().endswith(".pdf"))
+    return sorted(os.path.abspath(p) for p in found)
+
+
+def batch_output_dirs(pdfs, out_dir):
+    """A single PDF writes straight into out_dir; several get out_dir/<path relative to their common root>/."""
+    if len(pdfs) == 1:
+        return {pdfs[0]: out_dir}
+    root = os.path.commonpath([os.path.dirname(p) for p in pdfs])
+    return {p: os.path.join(out_dir, os.path.splitext(os.path.relpath(p, root))[0]) for p in pdfs}
+
+
+def _write_image(path, img):
+    # write under a temporary name and rename, so an interrupted run never leaves a truncated output
+    # that the next run would mistake for a finished page
+    tmp = path[:-4] + ".tmp.png"
+    cv2.imwrite(tmp, img)
+    os.replace(tmp, path)
+
+
+def preprocess_page_to_disk(pdf_path, page_number, out_dir, dpi=300, **kwargs):
+    """Batch worker: render one page, preprocess it and write its outputs. Returns per-stage seconds."""
+    t0 = time.perf_counter()
+    pages = convert_from_path(pdf_path, dpi, first_page=page_number, last_page=page_number)
+    t1 = time.perf_counter()
+    res = simple_preprocess_page(pages[0], **kwargs)
+    del pages
+    t2 = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    if kwargs.get('save_steps'):
+        for name in STEP_NAMES:
+            if name in res:
+                _write_image(os.path.join(out_dir, f"page_{page_number:03d}_{name}.png"), res[name])
+    # the binary page is written last: its presence marks the page as done
+    _write_image(os.path.join(out_dir, f"page_{page_number:03d}_binary.png"), res['binary'])
+    return {'render': t1 - t0, 'preprocess': t2 - t1, 'write': time.perf_counter() - t2}
+
+
+def batch_preprocess(inputs, out_dir, dpi=300, workers=None, overwrite=False, **kwargs):
+    """
+    Preprocess every page of every PDF matched by `inputs` (files, directories, globs) on a process pool.
+    Pages are fanned out individually and written as soon as they finish; pages whose binary output
+    already exists are skipped unless overwrite=True. Returns a summary dict (see print_batch_summary).
+    """
+    workers = workers or os.cpu_count() or 1
+    pdfs = find_pdfs(inputs)
+    out_dirs = batch_output_dirs(pdfs, out_dir)
+    summary = {'pdfs': len(pdfs), 'pages': 0, 'skipped': 0, 'failed': 0, 'workers': workers,
+               'stages': {'render': 0.0, 'preprocess': 0.0, 'write': 0.0}, 'seconds': 0.0}
+
+    tasks = []
+    for pdf in pdfs:
+        try:
+            n_pages = int(pdfinfo_from_path(pdf)["Pages"])
+        except Exception as exc:
+            print(f"[-] {pdf}: cannot read page count ({exc})")
+            summary['failed'] += 1
+            continue
+        for n in range(1, n_pages + 1):
+            if not overwrite and os.path.exists(os.path.join(out_dirs[pdf], f"page_{n:03d}_binary.png")):
+                summary['skipped'] += 1
+            else:
+                tasks.append((pdf, n))
+    print(f"[+] {len(pdfs)} PDFs, {len(tasks)} pages to process, {summary['skipped']} already done")
+
+    t_start = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        pending = {}
+        queue = iter(tasks)
+        while True:
+            # keep a bounded number of pages in flight so huge archives do not queue everything at once
+            for pdf, n in queue:
+                pending[ex.submit(preprocess_page_to_disk, pdf, n, out_dirs[pdf], dpi, **kwargs)] = (pdf, n)
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                pdf, n = pending.pop(fut)
+                try:
+                    timings = fut.result()
+                except Exception as exc:
+                    summary['failed'] += 1
+                    print(f"[-] {pdf} page {n}: {exc!r}")
+                    continue
+                summary['pages'] += 1
+                for stage, secs in timings.items():
+                    summary['stages'][stage] += secs
+                print(f"[+] {summary['pages']}/{len(tasks)} {os.path.basename(pdf)} page {n}")
+    summary['seconds'] = time.perf_counter() - t_start
+    return summary
+
+
+def print_batch_summary(summary):
+    pages, secs = summary['pages'], summary['seconds']
+    rate = pages / secs if secs > 0 else 0.0
+    print(f"[+] {pages} pages in {secs:.1f}s: {rate:.2f} pages/s with {summary['workers']} workers "
+          f"({summary['skipped']} skipped, {summary['failed']} failed)")
+    if pages:
+        print(f"    {'stage':<11}{'s/page':>8}{'share':>8}")
+        busy = sum(summary['stages'].values()) or 1.0
+        for stage, total in summary['stages'].items():
+            print(f"    {stage:<11}{total / pages:>8.3f}{total / busy:>8.0%}")
+
+
 # ------------------ CLI ------------------
 def main():
     parser = argparse.ArgumentParser(description="Simplified preprocessing for handwriting OCR.")
-    parser.add_argument("pdf", help="input PDF file")
+    parser.add_argument("inputs", nargs="+", help="input PDF files, directories (searched recursively) or globs")
     parser.add_argument("out_dir", help="output directory for images")
-    # parser.add_argument("--dpi", type=int, default=300)
-    # parser.add_argument("--denoise-h", type=float, default=10.0, help="h parameter for NLMeans denoising")
-    # parser.add_argument("--erosion-k", type=int, nargs=2, default=[2, 2], help="erosion kernel size (w h)")
-    # parser.add_argument("--adaptive-block", type=int, default=31, help="block size for adaptive threshold (odd)")
-    # parser.add_argument("--adaptive-c", type=int, default=20, help="C constant for adaptive threshold")
-    # parser.add_argument("--close-k", type=int, nargs=2, default=[3, 3], help="closing kernel size (w h)")
-    # parser.add_argument("--save-steps", action="store_true",
-    #                     help="save intermediate steps (normalized, denoised, eroded)")
-    # # CLAHE / contrast options
-    # parser.add_argument("--clahe-clip", type=float, default=2.0,
-    #                     help="CLAHE clipLimit (>0 to enable, 0 to disable). Larger -> stronger local contrast.")
-    # parser.add_argument("--clahe-tiles", type=int, nargs=2, default=[8, 8],
-    #                     help="CLAHE tileGridSize (w h)")
-    # # Line removal options
-    # parser.add_argument("--remove-lines", action="store_true", help="detect and remove ruled horizontal lines")
-    # parser.add_argument("--line-kernel-factor", type=int, default=50,
-    #                     help="kernel length = image_width // line_kernel_factor (smaller -> longer kernel)")
-    # parser.add_argument("--inpaint-radius", type=int, default=3, help="radius for cv2.inpaint")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--denoise-h", type=float, default=10.0, help="h parameter for NLMeans denoising")
+    parser.add_argument("--erosion-k", type=int, nargs=2, default=[2, 2], help="erosion kernel size (w h)")
+    parser.add_argument("--adaptive-block", type=int, default=31, help="block size for adaptive threshold (odd)")
+    parser.add_argument("--adaptive-c", type=int, default=20, help="C constant for adaptive threshold")
+    parser.add_argument("--close-k", type=int, nargs=2, default=[3, 3], help="closing kernel size (w h)")
+    parser.add_argument("--save-steps", action="store_true",
+                        help="save intermediate steps (denoised, contrast, inpainted, line_mask, eroded)")
+    # CLAHE / contrast options
+    parser.add_argument("--clahe-clip", type=float, default=0,
+                        help="CLAHE clipLimit (>0 to enable, 0 to disable). Larger -> stronger local contrast.")
+    parser.add_argument("--clahe-tiles", type=int, nargs=2, default=[8, 8],
+                        help="CLAHE tileGridSize (w h)")
+    # Line removal options
+    parser.add_argument("--remove-lines", action="store_true", help="detect and remove ruled horizontal lines")
+    parser.add_argument("--line-method", choices=LINE_METHODS, default="projection",
+                        help="'projection' (fast fill) or 'inpaint' (morphology + cv2.inpaint)")
+    parser.add_argument("--line-kernel-factor", type=int, default=30,
+                        help="kernel length = image_width // line_kernel_factor (smaller -> longer kernel)")
+    parser.add_argument("--inpaint-radius", type=int, default=3, help="radius for cv2.inpaint")
+    # speed / batch options
+    parser.add_argument("--profile", choices=PREPROCESS_PROFILES, default="quality",
+                        help="'fast' replaces NLMeans with a median filter")
+    parser.add_argument("--tile-above-megapixels", type=float, default=0,
+                        help="process pages larger than this as overlapping tiles (0 = never)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parallel page workers")
+    parser.add_argument("--overwrite", action="store_true", help="re-process pages whose output already exists")
 
     args = parser.parse_args()
 
-    files = pdf_to_images_and_preprocess(
-        args.pdf,
+    summary = batch_preprocess(
+        args.inputs,
         args.out_dir,
-        # dpi=args.dpi,
-        # denoise_h=args.denoise_h,
-        # erosion_kernel=tuple(args.erosion_k),
-        # adaptive_block=args.adaptive_block,
-        # adaptive_c=args.adaptive_c,
-        # close_kernel=tuple(args.close_k),
-        # clahe_clip=args.clahe_clip,
-        # clahe_grid=tuple(args.clahe_tiles),
-        # remove_lines=args.remove_lines,
-        # line_kernel_factor=args.line_kernel_factor,
-        # inpaint_radius=args.inpaint_radius,
-        # save_steps=args.save_steps
+        dpi=args.dpi,
+        workers=args.workers,
+        overwrite=args.overwrite,
+        denoise_h=args.denoise_h,
+        erosion_kernel=tuple(args.erosion_k),
+        adaptive_block=args.adaptive_block,
+        adaptive_c=args.adaptive_c,
+        close_kernel=tuple(args.close_k),
+        clahe_clip=args.clahe_clip,
+        clahe_grid=tuple(args.clahe_tiles),
+        remove_lines=args.remove_lines,
+        line_method=args.line_method,
+        line_kernel_factor=args.line_kernel_factor,
+        inpaint_radius=args.inpaint_radius,
+        save_steps=args.save_steps,
+        profile=args.profile,
+        tile_above_pixels=int(args.tile_above_megapixels * 1_000_000),
     )
-    print("[+] Saved files:")
-    for f in files:
-        print("   ", f)
+    print_batch_summary(summary)
 
 
 if __name__ == "__main__":
@@ -231,7 +231,8 @@ const Home = () => {
           
           const requestPayload = {
             book_ids: [bookId],
-            target_path: null
+            target_path: null,
+            extensions: ['pdf']  // stream the PDF itself, not a ZIP with the markdown
           };
           console.log(`📤 REQUEST PAYLOAD:`, JSON.stringify(requestPayload, null, 2));
           
@@ -1142,7 +1143,8 @@ This is a markdown file for **${pdf.name}**. You can add your notes, thoughts, a
         // Prepare the request payload - target_path: null means return PDF blob for browser
         const requestPayload = {
           book_ids: [result.book_id],
-          target_path: null  // null = return PDF blob for browser storage (IndexedDB)
+          target_path: null,  // null = return PDF blob for browser storage (IndexedDB)
+          extensions: ['pdf']  // stream the PDF itself, not a ZIP with the markdown
         };
         
         console.log(`\n📤 REQUEST PAYLOAD:`);